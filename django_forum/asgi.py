@@ -2,6 +2,8 @@
 ASGI config for django_forum project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serving the project through it (e.g. ``uvicorn django_forum.asgi:application``) enables
+the thread pages' Server-Sent Events; under WSGI the pages poll for updates instead.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -40,6 +40,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'forum.metrics.metrics_middleware',
+    'forum.db_routers.primary_pinning_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +55,7 @@ ROOT_URLCONF = 'django_forum.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'forum.metrics.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -62,7 +64,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'forum.views.set_categories'
+                'forum.views.set_categories',
+                'forum.page_cache.csrf_placeholder'
             ],
         },
     },
@@ -79,6 +82,16 @@ DATABASES = {
         'NAME': BASE_DIR / 'db_forum.sqlite3',
     }
 }
+# The production profile of SQLite, enabled by the environment variable FORUM_SQLITE_PROFILE=1: the backend of
+# forum.db.backends.sqlite3 (write-ahead log, tuned pragmas, IMMEDIATE transactions) and persistent connections
+if os.environ.get('FORUM_SQLITE_PROFILE') == '1':
+    DATABASES['default'].update({
+        'ENGINE': 'forum.db.backends.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    })
+DATABASE_ROUTERS = ['forum.db_routers.PrimaryReplicaRouter']
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -129,3 +142,81 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
     }
 }
+
+# Number of root threads displayed per subcategory page
+FORUM_THREADS_PAGE_SIZE = 20
+
+# Longer side (in pixels) of the thumbnails created for uploaded images, from the smallest to the largest
+FORUM_THUMBNAIL_SIZES = (256, 1024)
+# Number of background threads creating thumbnails of new uploads
+FORUM_THUMBNAIL_WORKERS = 2
+
+# Seconds a process serves the categories from its own memory before checking the shared cache version
+FORUM_CATEGORIES_LOCAL_TTL = 5
+# Seconds a version of the categories stays in the shared cache, so the replaced versions expire
+FORUM_CATEGORIES_TIMEOUT = 60 * 60 * 24
+
+# Seconds the threads' updated dates are cached for the update checks
+FORUM_UPDATED_DATE_TIMEOUT = 60 * 60 * 24
+# Seconds the updated_date bumps of the root threads of edited replies are buffered before they are written
+# in one UPDATE, 0 to write each of them at once
+FORUM_UPDATED_DATE_FLUSH_INTERVAL = 2
+
+# Server-Sent Events of the thread pages (served only under ASGI, see asgi.py)
+FORUM_EVENT_HUB = 'forum.events.InProcessHub'
+# Seconds between keepalive comments on an idle event stream
+FORUM_SSE_KEEPALIVE = 15
+# Seconds after which an event stream is closed and the browser reconnects
+FORUM_SSE_MAX_AGE = 60 * 5
+# Seconds the browser waits before reconnecting to a closed event stream
+FORUM_SSE_RETRY = 3
+
+# Maximum number of threads checked by one request of the batch update check
+FORUM_UPDATES_MAX_THREADS = 100
+
+# Seconds a rendered thread or reply stays in the cache
+FORUM_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Whole page cache of the dashboard, subcategory and thread pages for anonymous users
+FORUM_PAGE_CACHE_ENABLED = True
+# Seconds a cached page is kept (pages are invalidated by posts long before that)
+FORUM_PAGE_CACHE_TIMEOUT = 60 * 10
+# Seconds a worker waits for another one rendering the same page before rendering it itself
+FORUM_PAGE_CACHE_WAIT = 2
+
+# Number of search results per page and the last page that can be requested
+FORUM_SEARCH_PAGE_SIZE = 20
+FORUM_SEARCH_MAX_PAGE = 50
+
+# Share of the requests (0 to 1) measured by the metrics middleware, exposed at stats/metrics
+FORUM_METRICS_SAMPLE_RATE = 1.0
+
+# Largest attachment in bytes, larger uploads are rejected while they are received
+FORUM_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+FILE_UPLOAD_HANDLERS = [
+    'forum.uploads.MaxSizeUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Seconds a just uploaded attachment file is kept even if no thread references it yet
+FORUM_ATTACHMENT_REUSE_GRACE = 60 * 60
+
+# Header handing the transfer of media files to the front proxy: None to send them from Django,
+# 'X-Accel-Redirect' for nginx (with an internal location of MEDIA_ROOT at FORUM_MEDIA_ACCEL_PREFIX)
+# or 'X-Sendfile' for Apache and lighttpd
+FORUM_MEDIA_ACCEL_HEADER = None
+FORUM_MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Seconds browsers may cache a media file
+FORUM_MEDIA_MAX_AGE = 60 * 60 * 24 * 365
+# Seconds the subcategories of the threads referencing a media file are cached for its access check
+FORUM_MEDIA_ACCESS_TIMEOUT = 60 * 5
+
+# Route the dashboard, subcategory, thread and update check requests to the async views,
+# for serving through ASGI (under WSGI every async view request runs its own event loop)
+FORUM_ASYNC_READ_VIEWS = False
+
+# Aliases in DATABASES of the read replicas of the default database, which the reads are spread over
+FORUM_DB_REPLICAS = []
+# Seconds the reads of a client go to the default database after it has written, so it sees its writes,
+# longer than the replication lag
+FORUM_DB_PIN_SECONDS = 10
@@ -14,11 +14,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from forum import views as forum_views
+
 urlpatterns = [
-                  path('admin/', admin.site.urls),
-                  path('forum/', include('forum.urls')),
-              ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('admin/', admin.site.urls),
+    path('forum/', include('forum.urls')),
+    # checks the access to the file, which is then sent by the front proxy, see FORUM_MEDIA_ACCEL_HEADER
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', forum_views.media_file, name='media_file'),
+]
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+
+from .models import Thread
+from .transfer import encode_datetime
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# posts fetched from the database cursor at a time
+POSTS_CHUNK_SIZE = 500
+# the authors' emails are left out of the archives
+POST_FIELDS = ('id', 'reply_to_id', 'subject', 'author_name', 'message', 'created_date', 'updated_date', 'file',
+               'file_original_name', 'file_mime_type', 'file_size')
+
+
+class ZipStream:
+    """Write-only file object collecting the output of ZipFile until it is taken with 'pop'.
+       ZipFile writes to unseekable files using only 'write' and 'tell'
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    @property
+    def pending(self):
+        """Number of bytes written since the last 'pop'"""
+        return len(self._buffer)
+
+
+def thread_posts(root_id, *fields):
+    """Iterate over the thread and then its replies in creation order,
+       fetched in chunks from a (where supported, server-side) cursor
+    """
+    yield from Thread.objects.filter(id=root_id).values(*fields)
+    yield from (Thread.objects.filter(root_thread_id=root_id).order_by('created_date', 'id').values(*fields)
+                .iterator(chunk_size=POSTS_CHUNK_SIZE))
+
+
+def jsonl_chunks(root_id):
+    """Return the thread and its replies as JSON Lines, in chunks of about CHUNK_SIZE bytes"""
+    chunk = []
+    size = 0
+    for post in thread_posts(root_id, *POST_FIELDS):
+        line = json.dumps(post, default=encode_datetime, ensure_ascii=False).encode() + b'\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def zip_chunks(root_id):
+    """Return a zip archive of the thread.jsonl and the attachments of the posts, in chunks.
+       The attachments are read from the storage CHUNK_SIZE bytes at a time,
+       so the memory use does not depend on the size of the thread or its files
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(f'thread-{root_id}/thread.jsonl', 'w', force_zip64=True) as entry:
+            for chunk in jsonl_chunks(root_id):
+                entry.write(chunk)
+                if stream.pending >= CHUNK_SIZE:
+                    yield stream.pop()
+
+        for post in thread_posts(root_id, 'id', 'file', 'file_original_name', 'file_is_image'):
+            if not post['file']:
+                continue
+            file_name = post['file_original_name'] or os.path.basename(post['file'])
+            info = zipfile.ZipInfo(f"thread-{root_id}/attachments/{post['id']}_{file_name}")
+            # images are compressed already
+            info.compress_type = zipfile.ZIP_STORED if post['file_is_image'] else zipfile.ZIP_DEFLATED
+            try:
+                attachment = default_storage.open(post['file'], 'rb')
+            except FileNotFoundError:
+                logger.warning('Attachment %s of thread #%s not found', post['file'], post['id'])
+                continue
+            with attachment, archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in iter(lambda: attachment.read(CHUNK_SIZE), b''):
+                    entry.write(chunk)
+                    if stream.pending >= CHUNK_SIZE:
+                        yield stream.pop()
+    yield stream.pop()
+
+
+async def async_chunks(chunks):
+    """Iterate over the synchronous chunks from the async request thread, one chunk at a time.
+       An async StreamingHttpResponse would otherwise read a synchronous iterator into a list
+    """
+    chunks = iter(chunks)
+    end = object()
+    while (chunk := await sync_to_async(next)(chunks, end)) is not end:
+        yield chunk
@@ -0,0 +1,11 @@
+"""The forum's URLs with the async read views, whether FORUM_ASYNC_READ_VIEWS is set or not.
+Mounted like in the project's URLs, e.g. for comparing them with sync_urls in benchmark_concurrency
+"""
+from django.urls import include, path
+
+from forum import async_views
+from forum.urls import forum_patterns
+
+urlpatterns = [
+    path('forum/', include(forum_patterns(async_views))),
+]
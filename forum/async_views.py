@@ -0,0 +1,116 @@
+"""Async versions of the read views, routed instead of the ones in views.py if FORUM_ASYNC_READ_VIEWS is set.
+They query the database and the cache with the async APIs, so under ASGI a request is not handed to
+a thread as a whole. The templates are rendered in the event loop, from data loaded before rendering
+"""
+from math import trunc
+from urllib.parse import unquote
+
+from django.http import HttpResponse, Http404
+from django.shortcuts import redirect
+from django.template import loader
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .forms import ThreadForm
+from .models import Category, Thread, Subcategory
+from .page_cache import (DASHBOARD_SCOPE, ais_authenticated, cache_anonymous_page, subcategory_scope,
+                         thread_scope)
+from .pagination import decode_cursor
+
+
+async def aset_categories(request):
+    """Async counterpart of the set_categories context processor, which then uses the loaded categories"""
+    request.forum_categories = await Category.aget_all()
+
+
+async def render_page(request, template_name, context):
+    """Loads what the context processors need from the database before the template is rendered"""
+    await ais_authenticated(request)
+    await aset_categories(request)
+    template = loader.get_template(template_name)
+    return HttpResponse(template.render(context, request))
+
+
+@cache_anonymous_page(lambda: [DASHBOARD_SCOPE])
+async def dashboard(request):
+    thread_fields = ['id', 'subject', 'subcategory__name']
+    recent_updates = [dict(zip(thread_fields, thread)) for thread in await Thread.objects.aget_latest(thread_fields)]
+
+    context = {
+        'recent_updates': recent_updates
+    }
+    return await render_page(request, 'dashboard.html', context)
+
+
+@cache_anonymous_page(lambda name: [subcategory_scope(unquote(name).lower())])
+async def subcategory(request, name):
+    name_unquote = unquote(name)
+    subcat = await Subcategory.aget_by_name(name_unquote)
+
+    if not subcat:
+        raise Http404("No Subcategory found with name " + name)
+
+    is_authenticated = await ais_authenticated(request)
+    if subcat.auth_required and not is_authenticated:
+        page = 'login'
+        next_page = request.path
+        return redirect(f'{page}?next={next_page}')
+
+    by_activity = request.GET.get('sort') == 'activity'
+    page = await Thread.objects.aget_subcategory_latest(subcat.id,
+                                                        before=decode_cursor(request.GET.get('before')),
+                                                        after=decode_cursor(request.GET.get('after')),
+                                                        by_activity=by_activity)
+    await Thread.objects.apreload_recent_replies(page.items)
+
+    form = ThreadForm()
+    if is_authenticated:
+        form.fields['author_name'].initial = request.user.username
+        form.fields['author_email'].initial = request.user.email
+
+    context = {
+        'subcategory': subcat,
+        'threads': page.items,
+        'page': page,
+        'by_activity': by_activity,
+        'form': form
+    }
+    return await render_page(request, 'subcategory.html', context)
+
+
+@cache_anonymous_page(lambda id: [thread_scope(id)])
+async def thread_view(request, id):
+    try:
+        thread = await Thread.objects.aget_thread_tree(id)
+    except Thread.DoesNotExist:
+        raise Http404("No Thread found with id " + str(id)) from None
+
+    form = ThreadForm()
+    form.fields['subject'].initial = thread.subject
+
+    if await ais_authenticated(request):
+        form.fields['author_name'].initial = request.user.username
+        form.fields['author_email'].initial = request.user.email
+
+    context = {
+        'thread': thread,
+        'form': form
+    }
+    return await render_page(request, 'thread.html', context)
+
+
+async def thread_get_updated_date(request, thread_id):
+    updated_date = await Thread.objects.aget_updated_date(thread_id)
+    if updated_date is None:
+        raise Http404("No Thread found with id " + str(thread_id))
+
+    timestamp = trunc(updated_date.timestamp())
+    etag = f'"{updated_date.timestamp():.6f}"'
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = HttpResponse(timestamp)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    # the browser revalidates every poll, which is answered by 304 while the thread is unchanged
+    patch_cache_control(response, no_cache=True)
+    return response
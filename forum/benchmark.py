@@ -0,0 +1,81 @@
+import json
+import math
+import uuid
+
+from django.conf import settings
+
+
+def client_host():
+    """Return a host the test client's requests are allowed for"""
+    allowed_hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+    return allowed_hosts[0].lstrip('.') if allowed_hosts else 'localhost'
+
+
+def isolated_caches():
+    """Return the CACHES setting with the default cache's keys under a prefix of their own, so the entries
+       written during a benchmark are not read outside of it
+    """
+    default = settings.CACHES['default']
+    prefix = f"{default.get('KEY_PREFIX', '')}benchmark-{uuid.uuid4().hex}"
+    return {**settings.CACHES, 'default': {**default, 'KEY_PREFIX': prefix}}
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of the values, e.g. percent 95 for p95"""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(durations, query_counts):
+    """Return the p50/p95 latency in milliseconds and the mean query count of the measured requests"""
+    return {
+        'requests': len(durations),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'queries': round(sum(query_counts) / len(query_counts), 2),
+    }
+
+
+def summarize_concurrent(durations, elapsed):
+    """Return the throughput and the p50/p95 latency in milliseconds of requests made concurrently
+       during 'elapsed' seconds
+    """
+    return {
+        'requests': len(durations),
+        'per_second': round(len(durations) / elapsed, 1),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+    }
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+
+def find_regressions(results, baseline, max_regression):
+    """Return the descriptions of the results whose p95 latency grew by more than max_regression percent
+       or which make more queries than in the baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + max_regression / 100):
+            regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms")
+        if 'queries' in result and result['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+    return regressions
+
+
+def format_change(value, before):
+    if not before:
+        return ''
+    return f'{(value - before) / before * 100:+.1f}%'
@@ -0,0 +1,49 @@
+"""SQLite backend tuned for serving the forum from one database file to several worker threads or processes.
+Enabled by the ENGINE 'forum.db.backends.sqlite3', with the OPTIONS of Django's sqlite3 backend and:
+    'pragmas': PRAGMA statements run on every new connection, merged over PRAGMAS
+    'transaction_mode': how the atomic blocks begin their transaction, IMMEDIATE by default
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# the write-ahead log lets readers go on while one connection writes, with synchronous=normal a commit
+# is not synced to disk until the checkpoint (it may be lost by a power failure, but not corrupt the database)
+PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = {**PRAGMAS, **self.settings_dict['OPTIONS'].get('pragmas', {})}
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'IMMEDIATE').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"The 'transaction_mode' option must be one of {', '.join(TRANSACTION_MODES)}")
+        return mode
+
+    def _start_transaction_under_autocommit(self):
+        """Begins the atomic blocks' transactions as IMMEDIATE, taking the write lock at once (waiting for it
+           up to busy_timeout). A DEFERRED transaction that reads before writing fails with 'database is
+           locked' without waiting, if another connection has written since its read
+        """
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -0,0 +1,103 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_COOKIE = 'forum_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# the pinning of the request being handled, None outside of requests
+_current_pinning = ContextVar('forum_db_pinning', default=None)
+
+
+class PrimaryPinning:
+    """Whether the reads of a request go to the primary database, and whether the request wrote to it.
+       It is shared by reference, so a write made in a thread of sync_to_async is seen by the middleware
+    """
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+class PrimaryReplicaRouter:
+    """Sends the writes to the primary (default) database and the reads to one of the FORUM_DB_REPLICAS,
+       except for a request pinned to the primary: one which is not GET or HEAD, or made by a client
+       that has written less than FORUM_DB_PIN_SECONDS ago, so it reads its own writes.
+       Reads inside a transaction of the primary stay on the primary too
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.FORUM_DB_REPLICAS
+        if not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        pinning = _current_pinning.get()
+        if pinning is not None and pinning.pinned:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.FORUM_DB_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get the schema by replication
+        if db in settings.FORUM_DB_REPLICAS:
+            return False
+        return None
+
+
+def pin_to_primary():
+    """Sends the rest of the request's reads to the primary, and the client's ones for FORUM_DB_PIN_SECONDS.
+       Called for every write routed, and to be called for writes not made through the ORM
+    """
+    pinning = _current_pinning.get()
+    if pinning is not None:
+        pinning.wrote = True
+        pinning.pinned = True
+
+
+def is_pinned(request):
+    return request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+
+
+@sync_and_async_middleware
+def primary_pinning_middleware(get_response):
+    """Pins the requests that write, and the client's requests for FORUM_DB_PIN_SECONDS after a write,
+       to the primary database, by a cookie expiring with the pinning
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            pinning = PrimaryPinning(is_pinned(request))
+            token = _current_pinning.set(pinning)
+            try:
+                response = await get_response(request)
+            finally:
+                _current_pinning.reset(token)
+            return _finish_pinning(pinning, response)
+    else:
+        def middleware(request):
+            pinning = PrimaryPinning(is_pinned(request))
+            token = _current_pinning.set(pinning)
+            try:
+                response = get_response(request)
+            finally:
+                _current_pinning.reset(token)
+            return _finish_pinning(pinning, response)
+
+    return middleware
+
+
+def _finish_pinning(pinning, response):
+    if pinning.wrote and settings.FORUM_DB_REPLICAS:
+        response.set_cookie(PIN_COOKIE, '1', max_age=settings.FORUM_DB_PIN_SECONDS, httponly=True, samesite='Lax')
+    return response
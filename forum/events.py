@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from functools import lru_cache
+from math import trunc
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Thread
+
+
+class InProcessHub:
+    """Fans out thread events to the subscribers connected to the current process.
+       Subscribers are asyncio queues read on the server's event loop, while publishers may run
+       in any thread (e.g. synchronous views executed by the ASGI handler's thread pool).
+       A hub sharing events between processes only needs the same subscribe/unsubscribe/publish methods
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, thread_id):
+        # only the latest event matters to a page, so a single slot is enough
+        queue = asyncio.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.setdefault(thread_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, thread_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(thread_id, set())
+            subscribers.difference_update({subscriber for subscriber in subscribers if subscriber[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(thread_id, None)
+
+    def subscriber_count(self, thread_id):
+        with self._lock:
+            return len(self._subscribers.get(thread_id, ()))
+
+    def publish(self, thread_id, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(thread_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put_latest, queue, data)
+            except RuntimeError:
+                # the subscriber's event loop is already closed
+                self.unsubscribe(thread_id, queue)
+
+
+def _put_latest(queue, data):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(data)
+
+
+@lru_cache(maxsize=None)
+def get_hub():
+    return import_string(settings.FORUM_EVENT_HUB)()
+
+
+def publish_thread_update(thread_id, updated_date):
+    """Notifies the open pages of the thread about its new updated_date once the change is committed"""
+    transaction.on_commit(lambda: get_hub().publish(thread_id, trunc(updated_date.timestamp())))
+
+
+async def thread_event_stream(thread_id):
+    """Yields the Server-Sent Events of a thread page: an 'update' event with the thread's new
+       updated timestamp, keepalive comments while nothing happens and the end of the stream after
+       FORUM_SSE_MAX_AGE seconds, after which the browser reconnects by itself.
+       The current timestamp is sent first, so the page also learns of the updates made
+       before it subscribed (e.g. while loading or reconnecting)
+    """
+    hub = get_hub()
+    queue = hub.subscribe(thread_id)
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + settings.FORUM_SSE_MAX_AGE
+    try:
+        yield f'retry: {settings.FORUM_SSE_RETRY * 1000}\n\n'
+        updated_date = await Thread.objects.aget_updated_date(thread_id)
+        if updated_date is not None:
+            yield f'event: update\ndata: {trunc(updated_date.timestamp())}\n\n'
+        while loop.time() < closes_at:
+            timeout = min(settings.FORUM_SSE_KEEPALIVE, closes_at - loop.time())
+            try:
+                timestamp = await asyncio.wait_for(queue.get(), timeout)
+                yield f'event: update\ndata: {timestamp}\n\n'
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+    finally:
+        hub.unsubscribe(thread_id, queue)
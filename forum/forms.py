@@ -8,6 +8,14 @@ class ThreadForm(ModelForm):
         super(ThreadForm, self).__init__(*args, **kwargs)
         self.label_suffix = ''
 
+    def save(self, commit=True):
+        thread = super(ThreadForm, self).save(commit=False)
+        if 'file' in self.changed_data and thread.file:
+            thread.detect_file_metadata()
+        if commit:
+            thread.save()
+        return thread
+
     class Meta:
         model = Thread
         fields = ['subcategory', 'subject', 'author_name', 'author_email', 'message', 'file', 'reply_to']
@@ -0,0 +1,51 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import record_cache
+
+
+class FragmentCacheStats:
+    """Process-wide hit and miss counters of the rendered posts cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+stats = FragmentCacheStats()
+
+
+def post_fragment_key(post, *variant):
+    """Return the cache key of a rendered thread or reply.
+       The post's updated_date is part of the key, so editing a post makes its old fragments unreachable,
+       and so is its file name, which changes without an edit when dedupe_attachments moves the file
+    """
+    variant_key = ':'.join(str(part) for part in variant)
+    file_key = hashlib.md5(post.file.name.encode()).hexdigest()[:12] if post.file else ''
+    return (f'post:{post.id}:{post.updated_date.timestamp():.6f}:{int(post.has_thumbnails)}:{file_key}:'
+            f'{variant_key}')
+
+
+def get_or_render(key, render):
+    html = cache.get(key)
+    stats.record(html is not None)
+    record_cache('fragment', html is not None)
+    if html is None:
+        html = render()
+        cache.set(key, html, settings.FORUM_FRAGMENT_CACHE_TIMEOUT)
+    return html
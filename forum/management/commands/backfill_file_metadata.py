@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Thread
+
+
+class Command(BaseCommand):
+    help = 'Detects and stores the file metadata of threads uploaded before it was persisted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of threads updated per query')
+        parser.add_argument('--all', action='store_true',
+                            help='Detect the metadata again for threads which already have it')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        threads = Thread.objects.exclude(file='').exclude(file__isnull=True).only('id', 'file').order_by('id')
+        if not options['all']:
+            threads = threads.filter(file_mime_type='')
+
+        updated = missing = last_id = 0
+        while True:
+            batch = list(threads.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            detected = []
+            for thread in batch:
+                try:
+                    with thread.file.open('rb'):
+                        thread.detect_file_metadata()
+                    detected.append(thread)
+                except FileNotFoundError:
+                    missing += 1
+                    self.stderr.write(f'Thread #{thread.id}: file {thread.file.name} not found')
+
+            Thread.objects.bulk_update(detected, ['file_mime_type', 'file_is_image', 'file_width', 'file_height',
+                                                  'file_size'])
+            updated += len(detected)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} threads, {missing} files not found'))
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from forum.benchmark import (client_host, find_regressions, format_change, load_baseline, save_baseline,
+                             summarize_concurrent)
+from forum.management.commands.benchmark_views import EXPECTED_STATUSES, SCENARIOS
+from forum.models import Thread
+
+READ_VIEWS = ('dashboard', 'subcategory', 'thread_view', 'thread_get_updated_date')
+
+
+class Command(BaseCommand):
+    help = ('Compares the throughput of the sync read views served as by a threaded WSGI server with the async ones '
+            'served through ASGI, at the given number of concurrent anonymous requests, against the current database '
+            '(e.g. one filled by seed_forum). The requests are made in-process through the test clients')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', nargs='+', choices=READ_VIEWS, default=list(READ_VIEWS),
+                            help='Views to measure')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Measured requests per view and server')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Number of requests in progress at a time, the WSGI threads or the ASGI tasks')
+        parser.add_argument('--sample', type=int, default=20,
+                            help='Number of threads the requests go through, the most replied first')
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Render every page instead of serving it from the anonymous page cache')
+        parser.add_argument('--baseline',
+                            help='JSON file of earlier results to compare with')
+        parser.add_argument('--save-baseline',
+                            help='JSON file to save the results to')
+        parser.add_argument('--max-regression', type=float, default=20.0,
+                            help='Fail if a p95 latency is worse than in the baseline by more percent than this')
+
+    def handle(self, *args, **options):
+        threads = list(Thread.objects.filter(root_thread=None, subcategory__category__auth_required=False)
+                       .select_related('subcategory').order_by('-reply_count', '-id')[:options['sample']])
+        if not threads:
+            raise CommandError('There are no threads to measure, seed the database first e.g. with seed_forum')
+
+        requests, concurrency = options['requests'], options['concurrency']
+        page_cache_enabled = settings.FORUM_PAGE_CACHE_ENABLED and not options['no_page_cache']
+        results = {}
+        with override_settings(FORUM_PAGE_CACHE_ENABLED=page_cache_enabled):
+            for name in options['views']:
+                scenario = SCENARIOS[name]
+                with override_settings(ROOT_URLCONF='forum.sync_urls'):
+                    results[f'{name}:wsgi'] = self._measure_wsgi(scenario, threads, requests, concurrency)
+                # the async client of Django 4.2 always sends the Host header testserver
+                with override_settings(ROOT_URLCONF='forum.async_urls',
+                                       ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                    results[f'{name}:asgi'] = asyncio.run(
+                        self._measure_asgi(scenario, threads, requests, concurrency))
+
+        baseline = load_baseline(options['baseline']) if options['baseline'] else {}
+        self._report(results, baseline)
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], results)
+
+        regressions = find_regressions(results, baseline, options['max_regression'])
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+
+    @staticmethod
+    def _measure_wsgi(scenario, threads, requests, concurrency):
+        """Makes the requests from a pool of threads, each with its own client and database connection"""
+        local = threading.local()
+        host = client_host()
+
+        def request(thread):
+            if not hasattr(local, 'client'):
+                local.client = Client(HTTP_HOST=host)
+            start = time.perf_counter()
+            response = scenario(local.client, thread)
+            _check_response(scenario, thread, response)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='benchmark') as executor:
+            durations = list(executor.map(request, islice(cycle(threads), requests)))
+        return summarize_concurrent(durations, time.perf_counter() - start)
+
+    @staticmethod
+    async def _measure_asgi(scenario, threads, requests, concurrency):
+        """Makes the requests as tasks of one event loop, at most 'concurrency' of them at a time"""
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(thread):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await scenario(client, thread)
+                _check_response(scenario, thread, response)
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        durations = await asyncio.gather(*(request(thread) for thread in islice(cycle(threads), requests)))
+        return summarize_concurrent(durations, time.perf_counter() - start)
+
+    def _report(self, results, baseline):
+        self.stdout.write(f"{'view':<26}{'server':>7}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p95 change':>12}")
+        for key, result in results.items():
+            name, server = key.split(':')
+            before = baseline.get(key, {})
+            self.stdout.write(f"{name:<26}{server:>7}{result['per_second']:>10}{result['p50_ms']:>10}"
+                              f"{result['p95_ms']:>10}{format_change(result['p95_ms'], before.get('p95_ms')):>12}")
+
+
+def _check_response(scenario, thread, response):
+    if response.status_code not in EXPECTED_STATUSES:
+        raise CommandError(f'{scenario.__name__} of thread #{thread.id} responded with status {response.status_code}')
@@ -0,0 +1,155 @@
+import json
+import time
+from itertools import cycle
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from forum.benchmark import (client_host, find_regressions, format_change, isolated_caches, load_baseline,
+                             save_baseline, summarize)
+from forum.models import Thread, updated_date_buffer
+from forum.page_cache import DASHBOARD_SCOPE, generation_key, subcategory_scope, thread_scope
+
+EXPECTED_STATUSES = (200, 204, 302)
+# the fields of the measured threads written by the replies and the edits
+RESTORED_FIELDS = ('message', 'updated_date', 'reply_count', 'last_reply', 'last_reply_at', 'last_reply_author')
+
+
+def dashboard(client, thread):
+    return client.get(reverse('home'))
+
+
+def subcategory(client, thread):
+    return client.get(reverse('subcategory', kwargs={'name': thread.subcategory.slug}))
+
+
+def thread_view(client, thread):
+    return client.get(reverse('thread_view', kwargs={'id': thread.id}))
+
+
+def thread_reply(client, thread):
+    data = {'subcategory': thread.subcategory_id, 'message': 'Benchmark reply', 'reply_to': thread.id}
+    return client.post(reverse('thread_reply', kwargs={'root_id': thread.id}), data=data)
+
+
+def thread_get_updated_date(client, thread):
+    return client.get(reverse('thread_get_update', kwargs={'thread_id': thread.id}))
+
+
+def thread_edit_message(client, thread):
+    return client.post(reverse('thread_edit_message', kwargs={'thread_id': thread.id}),
+                       data=json.dumps({'newMessage': 'Benchmark edit'}), content_type='application/json',
+                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+
+SCENARIOS = {scenario.__name__: scenario for scenario in (
+    dashboard, subcategory, thread_view, thread_reply, thread_get_updated_date, thread_edit_message)}
+
+
+class Command(BaseCommand):
+    help = ('Measures the p50/p95 latency and the query count of the forum views through the test client, '
+            'against the current database (e.g. one filled by seed_forum). '
+            'The writes are committed like in production, so their write-behind and on-commit work is measured, '
+            'and are reverted at the end. The cache entries are written under a key prefix of the benchmark')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                            help='Views to measure')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Measured requests per view')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Requests per view made before measuring')
+        parser.add_argument('--sample', type=int, default=20,
+                            help='Number of threads the requests go through, the most replied first. '
+                                 'Anonymous requests go only through the threads not requiring authentication')
+        parser.add_argument('--username',
+                            help='Make the requests as this user instead of anonymously')
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Render every page instead of serving it from the anonymous page cache')
+        parser.add_argument('--baseline',
+                            help='JSON file of earlier results to compare with')
+        parser.add_argument('--save-baseline',
+                            help='JSON file to save the results to')
+        parser.add_argument('--max-regression', type=float, default=20.0,
+                            help='Fail if a p95 latency is worse than in the baseline by more percent than this')
+
+    def handle(self, *args, **options):
+        threads = Thread.objects.filter(root_thread=None).select_related('subcategory').order_by('-reply_count', '-id')
+        if not options['username']:
+            threads = threads.filter(subcategory__category__auth_required=False)
+        threads = list(threads[:options['sample']])
+        if not threads:
+            raise CommandError('There are no threads to measure, seed the database first e.g. with seed_forum')
+
+        client = Client(HTTP_HOST=client_host())
+        if options['username']:
+            try:
+                client.force_login(User.objects.get(username=options['username']))
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['username']} does not exist")
+
+        page_cache_enabled = settings.FORUM_PAGE_CACHE_ENABLED and not options['no_page_cache']
+        last_id = Thread.objects.aggregate(Max('id'))['id__max']
+        with override_settings(FORUM_PAGE_CACHE_ENABLED=page_cache_enabled, CACHES=isolated_caches()):
+            try:
+                results = {name: self._measure(client, SCENARIOS[name], threads, options['warmup'],
+                                               options['iterations'])
+                           for name in options['views']}
+            finally:
+                self._restore(threads, last_id)
+
+        baseline = load_baseline(options['baseline']) if options['baseline'] else {}
+        self._report(results, baseline)
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], results)
+
+        regressions = find_regressions(results, baseline, options['max_regression'])
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+
+    @staticmethod
+    def _measure(client, scenario, threads, warmup, iterations):
+        sample = cycle(threads)
+        for _ in range(warmup):
+            scenario(client, next(sample))
+
+        durations, query_counts = [], []
+        for _ in range(iterations):
+            thread = next(sample)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = scenario(client, thread)
+                durations.append(time.perf_counter() - start)
+            query_counts.append(len(queries))
+            if response.status_code not in EXPECTED_STATUSES:
+                raise CommandError(f'{scenario.__name__} of thread #{thread.id} '
+                                   f'responded with status {response.status_code}')
+        return summarize(durations, query_counts)
+
+    @staticmethod
+    def _restore(threads, last_id):
+        """Deletes the replies posted by the benchmark and restores the measured threads as they were loaded,
+           once the updated dates buffered by the requests are written. The cache entries written under the
+           benchmark's prefix expire, except for the page generations deleted here
+        """
+        updated_date_buffer.stop()
+        with transaction.atomic():
+            Thread.objects.filter(id__gt=last_id).delete()
+            Thread.objects.bulk_update(threads, RESTORED_FIELDS)
+        scopes = {DASHBOARD_SCOPE, *(thread_scope(thread.id) for thread in threads),
+                  *(subcategory_scope(thread.subcategory.slug) for thread in threads)}
+        cache.delete_many([generation_key(scope) for scope in scopes])
+
+    def _report(self, results, baseline):
+        self.stdout.write(f"{'view':<26}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'p95 change':>12}")
+        for name, result in results.items():
+            before = baseline.get(name, {})
+            self.stdout.write(f"{name:<26}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['queries']:>9}"
+                              f"{format_change(result['p95_ms'], before.get('p95_ms')):>12}")
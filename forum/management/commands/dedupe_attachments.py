@@ -0,0 +1,127 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forum.models import Thread
+from forum.page_cache import bump_page_generations, subcategory_scope, thread_scope
+from forum.thumbnails import thumbnail_name
+
+
+class Command(BaseCommand):
+    help = ('Moves the attachments stored before the content-addressed storage to their content names, '
+            'so threads with identical files share one copy, and optionally deletes the files no thread references')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of file names read per query')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be moved and freed')
+        parser.add_argument('--prune', action='store_true',
+                            help='Also delete the content-addressed files (and thumbnails) no thread references, '
+                                 'left e.g. by deletes made while an identical file was being uploaded')
+
+    def handle(self, *args, **options):
+        self.storage = Thread._meta.get_field('file').storage
+        self.dry_run = options['dry_run']
+
+        moved, duplicates, freed, missing = self._dedupe(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would move" if self.dry_run else "Moved"} {moved} files, {duplicates} of them duplicates '
+            f'freeing {freed} bytes, {missing} files not found'))
+
+        if options['prune']:
+            pruned = self._prune()
+            self.stdout.write(self.style.SUCCESS(
+                f'{"Would delete" if self.dry_run else "Deleted"} {pruned} unreferenced files'))
+
+    def _dedupe(self, batch_size):
+        """Moves every referenced file stored under its upload name, one distinct name at a time.
+           The content file is linked (or copied) first, the threads are pointed to it next and
+           the old file is deleted last, so an interrupted run never leaves a thread without its file
+        """
+        names = (Thread.objects.exclude(file='').exclude(file__isnull=True).order_by('file')
+                 .values_list('file', flat=True).distinct())
+        moved = duplicates = freed = missing = 0
+        last_name = ''
+        # the content names moved to, as a dry run does not create them
+        content_names = set()
+        while True:
+            batch = list(names.filter(file__gt=last_name)[:batch_size])
+            if not batch:
+                break
+            last_name = batch[-1]
+
+            for name in batch:
+                if self.storage.is_content_name(name):
+                    continue
+                try:
+                    content_name = self.storage.hash_name(name)
+                    size = self.storage.size(name)
+                except FileNotFoundError:
+                    missing += 1
+                    self.stderr.write(f'File {name} not found')
+                    continue
+
+                moved += 1
+                if content_name in content_names or self.storage.exists(content_name):
+                    duplicates += 1
+                    freed += size
+                content_names.add(content_name)
+                if not self.dry_run:
+                    self._move(name, content_name)
+        return moved, duplicates, freed, missing
+
+    def _move(self, name, content_name):
+        self._link(self.storage.path(name), self.storage.path(content_name))
+        for size in settings.FORUM_THUMBNAIL_SIZES:
+            thumbnail = default_storage.path(thumbnail_name(name, size))
+            if os.path.exists(thumbnail):
+                self._link(thumbnail, default_storage.path(thumbnail_name(content_name, size)))
+
+        with transaction.atomic():
+            threads = Thread.objects.filter(file=name)
+            # the cached pages link to the old name
+            scopes = {scope for root_thread_id, thread_id, slug
+                      in threads.values_list('root_thread_id', 'id', 'subcategory__slug')
+                      for scope in (thread_scope(root_thread_id or thread_id), subcategory_scope(slug))}
+            threads.filter(file_original_name='').update(file_original_name=os.path.basename(name))
+            threads.update(file=content_name)
+            bump_page_generations(*scopes)
+
+        self.storage.delete(name)
+        for size in settings.FORUM_THUMBNAIL_SIZES:
+            default_storage.delete(thumbnail_name(name, size))
+
+    @staticmethod
+    def _link(source, target):
+        """Makes the target path refer to the source file, unless it exists already"""
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(source, target + '.tmp')
+            os.replace(target + '.tmp', target)
+
+    def _prune(self):
+        pruned = 0
+        upload_dir = Thread._meta.get_field('file').upload_to.rstrip('/')
+        oldest = time.time() - settings.FORUM_ATTACHMENT_REUSE_GRACE
+        for directory, _, file_names in os.walk(self.storage.path(upload_dir)):
+            for file_name in file_names:
+                name = os.path.relpath(os.path.join(directory, file_name), self.storage.location).replace(os.sep, '/')
+                if not self.storage.is_content_name(name) or Thread.objects.filter(file=name).exists():
+                    continue
+                if self.dry_run:
+                    pruned += os.path.getmtime(self.storage.path(name)) < oldest
+                else:
+                    pruned += Thread.objects.release_file(name)
+        return pruned
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from forum.models import Category, Subcategory, Thread
+from forum.transfer import (CATEGORY_FIELDS, FORMAT, SUBCATEGORY_FIELDS, THREAD_FIELDS, VERSION, encode_datetime,
+                            open_stream)
+
+
+class Command(BaseCommand):
+    help = ('Exports the categories, subcategories and threads as JSON Lines, one record per line, '
+            'streamed from the database so any forum size takes constant memory. '
+            'Attachments are exported as references, the media files have to be copied separately')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output',
+                            help='File to write, compressed if it ends with .gz, - for stdout')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of threads fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=encode_datetime)
+        exported = 0
+        with open_stream(options['output'], 'w') as output:
+            output.write(encoder.encode({'format': FORMAT, 'version': VERSION}) + '\n')
+            for model, fields in ((Category, CATEGORY_FIELDS), (Subcategory, SUBCATEGORY_FIELDS),
+                                  (Thread, THREAD_FIELDS)):
+                # foreign keys are exported as ids, threads only reference threads with a lower id
+                columns = [model._meta.get_field(field).attname for field in fields]
+                rows = model.objects.order_by('id').values_list('id', *columns).iterator(
+                    chunk_size=options['batch_size'])
+                label = model._meta.label_lower
+                for row in rows:
+                    output.write(encoder.encode({'model': label, 'pk': row[0], 'fields': dict(zip(fields, row[1:]))}))
+                    output.write('\n')
+                    exported += 1
+
+        self.stderr.write(self.style.SUCCESS(f'Exported {exported} records'))
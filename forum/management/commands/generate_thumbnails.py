@@ -0,0 +1,66 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from forum.models import Thread
+from forum.page_cache import bump_page_generations, subcategory_scope, thread_scope
+from forum.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Creates the thumbnails of uploaded images in parallel worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes (defaults to the number of CPUs)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of images handed to the workers at once')
+        parser.add_argument('--force', action='store_true',
+                            help='Create the thumbnails again for images which already have them')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        threads = Thread.objects.filter(file_is_image=True).order_by('id')
+        if not options['force']:
+            threads = threads.filter(has_thumbnails=False)
+
+        created = failed = last_id = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                batch = list(threads.filter(id__gt=last_id).values_list('id', 'file')[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                ids_by_file = {}
+                for thread_id, file_name in batch:
+                    ids_by_file.setdefault(file_name, []).append(thread_id)
+
+                futures = {executor.submit(generate_thumbnails, settings.MEDIA_ROOT, file_name,
+                                           settings.FORUM_THUMBNAIL_SIZES): file_name
+                           for file_name in ids_by_file}
+                created_ids = []
+                for future in as_completed(futures):
+                    file_name = futures[future]
+                    try:
+                        future.result()
+                        created_ids.extend(ids_by_file[file_name])
+                    except Exception as error:
+                        failed += len(ids_by_file[file_name])
+                        self.stderr.write(f'{file_name}: {error}')
+
+                Thread.objects.filter(id__in=created_ids).update(has_thumbnails=True)
+                created += len(created_ids)
+                self._invalidate_pages(created_ids)
+
+        self.stdout.write(self.style.SUCCESS(f'Created thumbnails for {created} threads, {failed} failed'))
+
+    @staticmethod
+    def _invalidate_pages(thread_ids):
+        """Bumps the generations of the thread and subcategory pages showing the threads, cached without
+           their thumbnails
+        """
+        pages = list(Thread.objects.filter(id__in=thread_ids).values_list('id', 'root_thread_id', 'subcategory__slug'))
+        bump_page_generations(*{thread_scope(root_id or thread_id) for thread_id, root_id, _ in pages},
+                              *{subcategory_scope(slug) for _, _, slug in pages})
@@ -0,0 +1,123 @@
+import json
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from forum.models import Category, Subcategory, Thread, updated_date_cache_key
+from forum.transfer import FORMAT, THREAD_FIELDS, VERSION, imported_dates, open_stream
+
+DATE_FIELDS = ('created_date', 'updated_date')
+
+
+class Command(BaseCommand):
+    help = ('Imports a JSON Lines file written by export_forum, reading it line by line and inserting the threads '
+            'in batches, so any forum size takes constant memory. Categories and subcategories are matched by '
+            'name and slug to the existing ones, the threads get new ids above the existing ones. '
+            'Everything is imported in one transaction')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',
+                            help='File to read, compressed if it ends with .gz, - for stdin')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of threads inserted per query')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.category_ids = {}
+        self.subcategory_ids = {}
+        self.imported = 0
+
+        with open_stream(options['input'], 'r') as stream, transaction.atomic(), imported_dates(Thread):
+            # imported thread ids are shifted by the offset, keeping the links between them valid
+            self.id_offset = Thread.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+            batch = []
+            for line_number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if line_number == 1:
+                        self._check_header(record)
+                    elif record['model'] == 'forum.thread':
+                        batch.append(self._thread(record))
+                    elif record['model'] == 'forum.subcategory':
+                        self.subcategory_ids[record['pk']] = self._subcategory_id(record['fields'])
+                    elif record['model'] == 'forum.category':
+                        self.category_ids[record['pk']] = self._category_id(record['fields'])
+                    else:
+                        raise CommandError(f"unknown model {record['model']}")
+                except (ValueError, KeyError, TypeError) as error:
+                    raise CommandError(f'Line {line_number}: invalid record ({error!r})')
+                except CommandError as error:
+                    raise CommandError(f'Line {line_number}: {error}')
+
+                if len(batch) >= self.batch_size:
+                    self._insert(batch)
+                    batch = []
+            self._insert(batch)
+
+            call_command('repair_reply_counters', after_id=self.id_offset, batch_size=self.batch_size,
+                         stdout=self.stderr)
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), [Category, Subcategory, Thread]):
+                    cursor.execute(statement)
+
+        Category.invalidate_cache()
+        self.stderr.write(self.style.SUCCESS(
+            f'Imported {self.imported} threads into {len(self.subcategory_ids)} subcategories'))
+
+    @staticmethod
+    def _check_header(record):
+        if record.get('format') != FORMAT or record.get('version') != VERSION:
+            raise CommandError(f'not an export of version {VERSION}')
+
+    def _category_id(self, fields):
+        category = Category.objects.filter(name=fields['name']).first()
+        if category is None:
+            category = Category.objects.create(name=fields['name'], auth_required=fields['auth_required'])
+        return category.id
+
+    def _subcategory_id(self, fields):
+        subcategory = Subcategory.objects.filter(slug=fields['slug']).first()
+        if subcategory is None:
+            subcategory = Subcategory(category_id=self._mapped(self.category_ids, fields['category'], 'category'),
+                                      name=fields['name'])
+            subcategory.save()
+        return subcategory.id
+
+    def _thread(self, record):
+        fields = dict(record['fields'])
+        fields['subcategory'] = self._mapped(self.subcategory_ids, fields['subcategory'], 'subcategory')
+        for link in ('reply_to', 'root_thread'):
+            if fields[link] is not None:
+                fields[link] += self.id_offset
+        for date in DATE_FIELDS:
+            fields[date] = parse_datetime(fields[date])
+        # fields added after the file was exported take their defaults
+        return Thread(id=record['pk'] + self.id_offset,
+                      **{Thread._meta.get_field(field).attname: fields[field] for field in THREAD_FIELDS
+                         if field in fields})
+
+    @staticmethod
+    def _mapped(ids, exported_id, name):
+        try:
+            return ids[exported_id]
+        except KeyError:
+            raise CommandError(f'{name} {exported_id} is not in the export')
+
+    def _insert(self, threads):
+        if not threads:
+            return
+        Thread.objects.bulk_create(threads)
+        # with DEBUG on, the logged insert statements would otherwise hold on to all of the batches
+        reset_queries()
+        # the ids may have been remembered as unknown by the update checks
+        cache.delete_many([updated_date_cache_key(thread.id) for thread in threads])
+        self.imported += len(threads)
+        self.stderr.write(f'{self.imported} threads')
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from forum.search import SEARCH_TABLE
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the threads search index in short batches, so posting is never blocked for long. '
+            'The old entries stay searchable until they are replaced')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of threads indexed per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between the batches')
+        parser.add_argument('--optimize', action='store_true',
+                            help='Merge the index segments at the end (a single longer write)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        indexed = self._in_batches('SELECT id FROM forum_thread WHERE id > %s ORDER BY id LIMIT %s', f"""
+            INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, subject, message)
+            SELECT id, subject, message FROM forum_thread WHERE id > %s AND id <= %s""", batch_size, options['pause'])
+
+        removed = self._in_batches(f'SELECT rowid FROM {SEARCH_TABLE} WHERE rowid > %s ORDER BY rowid LIMIT %s', f"""
+            DELETE FROM {SEARCH_TABLE} WHERE rowid > %s AND rowid <= %s
+            AND rowid NOT IN (SELECT id FROM forum_thread)""", batch_size, options['pause'])
+
+        if options['optimize']:
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES('optimize')")
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} threads, removed {removed} stale entries'))
+
+    @staticmethod
+    def _in_batches(select_ids_sql, batch_sql, batch_size, pause):
+        """Runs batch_sql for consecutive id ranges of batch_size rows, each in its own transaction"""
+        last_id = affected = 0
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute(select_ids_sql, [last_id, batch_size])
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return affected
+
+                with transaction.atomic():
+                    cursor.execute(batch_sql, [last_id, ids[-1]])
+                    affected += cursor.rowcount
+                last_id = ids[-1]
+                if pause:
+                    time.sleep(pause)
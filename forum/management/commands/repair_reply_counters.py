@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Thread
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the reply counter and the last reply fields of the root threads, '
+            'e.g. after replies were deleted or threads were loaded from fixtures')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of root threads updated per query')
+        parser.add_argument('--after-id', type=int, default=0,
+                            help='Repair only the threads with a greater id, e.g. the ones just imported')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        root_ids = Thread.objects.filter(root_thread=None).order_by('id').values_list('id', flat=True)
+
+        repaired = 0
+        last_id = options['after_id']
+        while True:
+            batch = list(root_ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+
+            Thread.objects.refresh_reply_counters(batch)
+            repaired += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} threads'))
@@ -0,0 +1,128 @@
+import random
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from forum.models import Category, Subcategory, Thread
+
+WORDS = ('forum', 'thread', 'reply', 'django', 'python', 'linux', 'football', 'match', 'kernel', 'skills',
+         'london', 'weather', 'question', 'answer', 'update', 'release', 'version', 'problem', 'solution',
+         'today', 'again', 'never', 'always', 'better', 'faster', 'simple', 'great', 'idea', 'please', 'thanks')
+AUTHORS = ('', '', 'admin', 'test_user', 'ana', 'marko', 'john', 'jane')
+# files of the development media folder, referenced by the seeded attachments
+ATTACHMENTS = ('thread_files/apple.png', 'thread_files/scale.jpg', 'thread_files/java.txt', 'thread_files/ping.txt')
+FILE_METADATA_FIELDS = ('file_mime_type', 'file_is_image', 'file_width', 'file_height', 'file_size')
+
+
+class Command(BaseCommand):
+    help = ('Seeds the database with a synthetic forum of the given shape, '
+            'e.g. to measure the views at scale with benchmark_views')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=5,
+                            help='Number of categories, the last one requires authentication')
+        parser.add_argument('--subcategories', type=int, default=4,
+                            help='Number of subcategories per category')
+        parser.add_argument('--threads', type=int, default=10000,
+                            help='Number of root threads, spread evenly over the subcategories')
+        parser.add_argument('--replies', type=int, default=10,
+                            help='Maximum number of replies per thread, each thread gets a random number of them')
+        parser.add_argument('--reply-depth', type=int, default=5,
+                            help='Length of the chain of replies on replies in each thread')
+        parser.add_argument('--attachments', type=float, default=0.1,
+                            help='Share of threads and replies with an attached file')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of threads inserted per query')
+        parser.add_argument('--prefix', default='Seed',
+                            help='Prefix of the category and subcategory names, has to be unused')
+        parser.add_argument('--random-seed', type=int, default=0,
+                            help='Seed of the generator, the same seed produces the same forum')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['random_seed'])
+        self.attachments = self._load_attachments() if options['attachments'] else []
+        self.attachment_share = options['attachments']
+        prefix = options['prefix']
+        if Category.objects.filter(name__startswith=prefix).exists():
+            raise CommandError(f'Categories named {prefix}... already exist, choose another --prefix')
+
+        subcategory_ids = self._create_categories(prefix, options['categories'], options['subcategories'])
+
+        threads = replies = 0
+        batch_size = options['batch_size']
+        for offset in range(0, options['threads'], batch_size):
+            count = min(batch_size, options['threads'] - offset)
+            roots = Thread.objects.bulk_create(
+                self._post(subcategory_ids[(offset + number) % len(subcategory_ids)], subject=True)
+                for number in range(count))
+            replies += self._create_replies(roots, options['replies'], options['reply_depth'], batch_size)
+            Thread.objects.refresh_reply_counters([root.id for root in roots])
+
+            threads += count
+            self.stdout.write(f'{threads} threads, {replies} replies')
+
+        Category.invalidate_cache()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(subcategory_ids)} subcategories, {threads} threads and {replies} replies'))
+
+    def _load_attachments(self):
+        """Return the metadata of the development media files, to be copied to the seeded posts"""
+        attachments = []
+        for name in ATTACHMENTS:
+            if not default_storage.exists(name):
+                continue
+            thread = Thread(file=name)
+            with thread.file.open('rb'):
+                thread.detect_file_metadata()
+            attachments.append({'file': name, **{field: getattr(thread, field) for field in FILE_METADATA_FIELDS}})
+        if not attachments:
+            raise CommandError(f'None of the attachment files {", ".join(ATTACHMENTS)} exists, use --attachments 0')
+        return attachments
+
+    def _create_categories(self, prefix, categories, subcategories):
+        created = Category.objects.bulk_create(
+            Category(name=f'{prefix} {number}', auth_required=number == categories - 1) for number in range(categories))
+        # bulk_create skips Subcategory.save, which sets the slug
+        created_subcategories = Subcategory.objects.bulk_create(
+            Subcategory(category=category, name=name, slug=name.lower())
+            for number, category in enumerate(created)
+            for name in (f'{prefix}-{number}-{sub_number}' for sub_number in range(subcategories)))
+        return [subcategory.id for subcategory in created_subcategories]
+
+    def _create_replies(self, roots, max_replies, depth, batch_size):
+        """Creates a random number of replies for every root: a chain of replies on replies
+           up to the given depth, inserted level by level, and the rest replying to the root itself
+        """
+        remaining = {root.id: self.random.randint(0, max_replies) for root in roots}
+        created = 0
+
+        parents = roots
+        for _ in range(depth):
+            level = [self._post(parent.subcategory_id, reply_to_id=parent.id,
+                                root_thread_id=parent.root_thread_id or parent.id)
+                     for parent in parents if remaining[parent.root_thread_id or parent.id] > 0]
+            if not level:
+                break
+            parents = Thread.objects.bulk_create(level, batch_size=batch_size)
+            for reply in parents:
+                remaining[reply.root_thread_id] -= 1
+            created += len(parents)
+
+        direct = Thread.objects.bulk_create(
+            (self._post(root.subcategory_id, reply_to_id=root.id, root_thread_id=root.id)
+             for root in roots for _ in range(remaining[root.id])), batch_size=batch_size)
+        return created + len(direct)
+
+    def _post(self, subcategory_id, subject=False, **fields):
+        post = Thread(subcategory_id=subcategory_id,
+                      subject=self._text(2, 6)[:50] if subject else '',
+                      author_name=self.random.choice(AUTHORS),
+                      message=self._text(5, 80),
+                      **fields)
+        if self.attachments and self.random.random() < self.attachment_share:
+            for field, value in self.random.choice(self.attachments).items():
+                setattr(post, field, value)
+        return post
+
+    def _text(self, min_words, max_words):
+        return ' '.join(self.random.choices(WORDS, k=self.random.randint(min_words, max_words))).capitalize()
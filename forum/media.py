@@ -0,0 +1,145 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .models import Category
+from .storage import ContentAddressedStorage
+from .thumbnails import THUMBNAILS_DIR
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def media_name(path):
+    """Return the storage name of the requested media path, or None if it points outside the media folder"""
+    name = posixpath.normpath(path)
+    if name != path or name.startswith(('/', '../')) or name == '..':
+        return None
+    return name
+
+
+def attachment_name(name):
+    """Return the name of the thread file the media file belongs to: the name itself,
+       or for a thumbnail the name of the thumbnailed file
+       e.g. thread_thumbnails/256/thread_files/apple.png returns thread_files/apple.png
+    """
+    prefix = f'{THUMBNAILS_DIR}/'
+    if name.startswith(prefix):
+        size, _, file_name = name[len(prefix):].partition('/')
+        return file_name if size.isdigit() else None
+    return name
+
+
+def requires_auth(subcategory_ids):
+    """Checks if all the given subcategories are in categories requiring authentication,
+       i.e. a file shared by these subcategories' threads may only be seen by authenticated users
+    """
+    private_ids = {subcategory.id for category in Category.get_all() if category.auth_required
+                   for subcategory in category.subcategories}
+    return all(subcategory_id in private_ids for subcategory_id in subcategory_ids)
+
+
+def media_response(request, name, private):
+    """Return the response sending the media file, with ETag, Last-Modified and cache headers.
+       The bytes are sent by the front proxy if FORUM_MEDIA_ACCEL_HEADER is set,
+       otherwise by Django, as a FileResponse the WSGI server may send with sendfile
+    """
+    path = default_storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    content_name = ContentAddressedStorage.is_content_name(attachment_name(name))
+    # content names change with the content, others with the file
+    if content_name:
+        etag = f'"{os.path.splitext(posixpath.basename(name))[0]}"'
+    else:
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        accel_header = settings.FORUM_MEDIA_ACCEL_HEADER
+        if accel_header:
+            response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+            # X-Accel-Redirect takes an internal location of nginx, X-Sendfile the file's path
+            if accel_header.lower() == 'x-accel-redirect':
+                response[accel_header] = settings.FORUM_MEDIA_ACCEL_PREFIX + quote(name)
+            else:
+                response[accel_header] = path
+        else:
+            response = _file_response(request, path, stat.st_size, etag)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if private:
+        patch_cache_control(response, private=True, max_age=settings.FORUM_MEDIA_MAX_AGE)
+        patch_vary_headers(response, ['Cookie'])
+    else:
+        patch_cache_control(response, public=True, max_age=settings.FORUM_MEDIA_MAX_AGE)
+    if content_name:
+        patch_cache_control(response, immutable=True)
+    return response
+
+
+def _file_response(request, path, size, etag):
+    """Return the whole file, or the single byte range requested by the Range header"""
+    byte_range = requested_range(request, size, etag)
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'))
+    elif byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_file_chunks(path, start, end - start + 1), status=206,
+                                         content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def requested_range(request, size, etag):
+    """Return the (first, last) byte positions of a Range request for a single range,
+       None if the whole file is to be sent, or False if the range is not satisfiable
+    """
+    match = RANGE_RE.fullmatch(request.headers.get('Range', '').strip())
+    if_range = request.headers.get('If-Range')
+    if not match or not any(match.groups()) or (if_range and if_range != etag):
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            # an invalid range, ignored like a malformed header
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # the last bytes of the file
+        start = max(size - int(last), 0)
+        end = size - 1 if int(last) else -1
+    if start > end:
+        return False
+    return start, end
+
+
+def _file_chunks(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
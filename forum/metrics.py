@@ -0,0 +1,210 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.decorators import sync_and_async_middleware
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# (name, help, buckets, RequestSample attribute) of the per view histograms
+HISTOGRAMS = (
+    ('forum_request_duration_seconds', 'Wall time of the requests', DURATION_BUCKETS, 'duration'),
+    ('forum_db_queries', 'Database queries made by a request', QUERY_BUCKETS, 'db_queries'),
+    ('forum_db_duration_seconds', 'Time a request spent in database queries', DURATION_BUCKETS, 'db_time'),
+    ('forum_template_duration_seconds', 'Time a request spent rendering templates', DURATION_BUCKETS,
+     'template_time'),
+)
+CACHE_COUNTER = 'forum_cache_requests_total'
+
+# the measurements of the request being handled, None if it is not sampled
+_current_sample = ContextVar('forum_metrics_sample', default=None)
+
+
+class RequestSample:
+    """Measurements of one sampled request"""
+
+    def __init__(self):
+        self.duration = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # (cache, 'hit' or 'miss') -> count
+        self.cache = Counter()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # per bucket (not cumulative) counts, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide aggregates of the sampled requests, per resolved URL name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (histogram name, view) -> Histogram
+        self._histograms = {}
+        # (view, cache, result) -> count
+        self._cache_requests = Counter()
+
+    def observe(self, view, sample):
+        with self._lock:
+            for name, _, buckets, attribute in HISTOGRAMS:
+                histogram = self._histograms.get((name, view))
+                if histogram is None:
+                    histogram = self._histograms[(name, view)] = Histogram(buckets)
+                histogram.observe(getattr(sample, attribute))
+            for (cache_name, result), count in sample.cache.items():
+                self._cache_requests[(view, cache_name, result)] += count
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._cache_requests.clear()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, help_text, buckets, _ in HISTOGRAMS:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (histogram_name, view), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    labels = f'view="{_escape(view)}"'
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+            lines += [f'# HELP {CACHE_COUNTER} Cache lookups made by the requests',
+                      f'# TYPE {CACHE_COUNTER} counter']
+            for (view, cache_name, result), count in sorted(self._cache_requests.items()):
+                labels = f'view="{_escape(view)}",cache="{cache_name}",result="{result}"'
+                lines.append(f'{CACHE_COUNTER}{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def record_cache(cache_name, hit, count=1):
+    """Counts lookups of the named cache for the current request, if it is sampled"""
+    sample = _current_sample.get()
+    if sample is not None and count:
+        sample.cache[(cache_name, 'hit' if hit else 'miss')] += count
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper timing the queries of the sampled requests"""
+    sample = _current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.db_queries += 1
+        sample.db_time += time.perf_counter() - start
+
+
+def instrument_connection(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        sample = _current_sample.get()
+        if sample is None:
+            return super().render(context, request)
+
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django templates backend timing the rendering of the sampled requests' templates.
+       Only the templates rendered by views are wrapped, so included templates are not counted twice
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
+
+
+def _start_sample():
+    rate = settings.FORUM_METRICS_SAMPLE_RATE
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None, None
+    sample = RequestSample()
+    return sample, _current_sample.set(sample)
+
+
+def _finish_sample(request, sample, token, start):
+    sample.duration = time.perf_counter() - start
+    _current_sample.reset(token)
+    resolver_match = getattr(request, 'resolver_match', None)
+    registry.observe(resolver_match.url_name if resolver_match and resolver_match.url_name else 'unresolved',
+                     sample)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Records the wall time, database queries and time, template time and cache lookups
+       of a FORUM_METRICS_SAMPLE_RATE share of the requests, per resolved URL name
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            sample, token = _start_sample()
+            if sample is None:
+                return await get_response(request)
+
+            start = time.perf_counter()
+            try:
+                return await get_response(request)
+            finally:
+                _finish_sample(request, sample, token, start)
+    else:
+        def middleware(request):
+            sample, token = _start_sample()
+            if sample is None:
+                return get_response(request)
+
+            start = time.perf_counter()
+            try:
+                return get_response(request)
+            finally:
+                _finish_sample(request, sample, token, start)
+
+    return middleware
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0007_alter_thread_reply_to_alter_thread_root_thread'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='file_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='file_is_image',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='file_mime_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='file_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
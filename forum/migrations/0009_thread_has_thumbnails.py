@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0008_thread_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def populate_slugs(apps, schema_editor):
+    Subcategory = apps.get_model('forum', 'Subcategory')
+    subcategories = list(Subcategory.objects.all())
+    for subcategory in subcategories:
+        subcategory.slug = subcategory.name.lower()
+    Subcategory.objects.bulk_update(subcategories, ['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0009_thread_has_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subcategory',
+            name='slug',
+            field=models.CharField(editable=False, max_length=50, null=True),
+        ),
+        migrations.RunPython(populate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='subcategory',
+            name='slug',
+            field=models.CharField(editable=False, max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+from forum.search import SEARCH_TABLE, SEARCH_TRIGGERS
+
+CREATE_SEARCH_INDEX = [
+    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(subject, message, tokenize = 'unicode61 remove_diacritics 2')",
+    *SEARCH_TRIGGERS.values(),
+    f"INSERT INTO {SEARCH_TABLE}(rowid, subject, message) SELECT id, subject, message FROM forum_thread",
+]
+
+DROP_SEARCH_INDEX = [
+    *(f"DROP TRIGGER IF EXISTS {name}" for name in SEARCH_TRIGGERS),
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_SEARCH_INDEX:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_SEARCH_INDEX:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_subcategory_slug'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+FOREIGN_KEY_COLUMNS = ('reply_to_id', 'root_thread_id')
+
+
+def drop_foreign_key_indexes(apps, schema_editor):
+    """Drops the single column indexes of the reply_to and root_thread foreign keys,
+       the composite reply indexes lead with the same columns.
+       Altering the fields instead would make SQLite remake the table and lose the search index triggers
+    """
+    Thread = apps.get_model('forum', 'Thread')
+    table = Thread._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        constraints = schema_editor.connection.introspection.get_constraints(cursor, table)
+    for name, constraint in constraints.items():
+        if (constraint['index'] and not constraint['unique'] and not constraint['primary_key']
+                and len(constraint['columns']) == 1 and constraint['columns'][0] in FOREIGN_KEY_COLUMNS):
+            schema_editor.execute(schema_editor.sql_delete_index % {
+                'table': schema_editor.quote_name(table), 'name': schema_editor.quote_name(name)})
+
+
+def create_foreign_key_indexes(apps, schema_editor):
+    Thread = apps.get_model('forum', 'Thread')
+    for column in FOREIGN_KEY_COLUMNS:
+        schema_editor.execute(schema_editor.sql_create_index % {
+            'table': schema_editor.quote_name(Thread._meta.db_table),
+            'name': schema_editor.quote_name(f'forum_thread_{column}'),
+            'using': '', 'columns': schema_editor.quote_name(column), 'extra': '', 'condition': '',
+            'include': ''})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_thread_search_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='thread',
+                    name='reply_to',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_reply_to', to='forum.thread'),
+                ),
+                migrations.AlterField(
+                    model_name='thread',
+                    name='root_thread',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_root_thread', to='forum.thread'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(drop_foreign_key_indexes, create_foreign_key_indexes),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('root_thread', None)), fields=['-updated_date'], name='thread_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('reply_to', None)), fields=['subcategory', '-created_date', '-id'], name='thread_subcat_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('root_thread__isnull', False)), fields=['root_thread', '-created_date', '-id'], name='thread_root_replies_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('reply_to__isnull', False)), fields=['reply_to', 'created_date'], name='thread_direct_replies_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+from forum.search import restore_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_thread_access_indexes'),
+    ]
+
+    operations = [
+        # removing the counter remakes the table on SQLite when migrating backwards
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='thread',
+            name='last_reply',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.thread'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_reply_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_reply_author',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # adding the counter remakes the table on SQLite
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(models.F('subcategory'), models.OrderBy(django.db.models.functions.comparison.Coalesce('last_reply_at', 'created_date'), descending=True), models.OrderBy(models.F('id'), descending=True), condition=models.Q(('reply_to', None)), name='thread_subcat_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:44
+
+from django.db import migrations, models
+import forum.storage
+
+from forum.search import restore_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_thread_reply_counters'),
+    ]
+
+    operations = [
+        # removing the field remakes the table on SQLite when migrating backwards
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='thread',
+            name='file_original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        # adding the field remakes the table on SQLite
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        # the storage is not a database change
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='thread',
+                    name='file',
+                    field=models.FileField(blank=True, null=True, storage=forum.storage.ContentAddressedStorage(), upload_to='thread_files/'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('file__isnull', False)), fields=['file'], name='thread_file_idx'),
+        ),
+    ]
@@ -1,10 +1,48 @@
-import imghdr
+import hashlib
+import mimetypes
 import os
+import time
+from collections import defaultdict, namedtuple
+from operator import attrgetter, itemgetter
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.cache import cache
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.dispatch import Signal
 from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .metrics import record_cache
+from .pagination import akeyset_page, keyset_page
+from .search import SEARCH_TABLE, match_expression
+from .storage import attachment_storage
+from .thumbnails import thumbnail_name
+from .write_behind import UpdatedDateBuffer
+
+
+CategoryEntry = namedtuple('CategoryEntry', ['id', 'name', 'auth_required', 'subcategories'])
+SubcategoryEntry = namedtuple('SubcategoryEntry', ['id', 'name', 'slug', 'category_id', 'auth_required'])
+
+CATEGORIES_VERSION_KEY = 'categories:version'
+# threads whose updated dates are written by one UPDATE, 3 query parameters each
+UPDATED_DATES_BATCH_SIZE = 300
+
+# sent with the thread_ids once write_updated_dates has written their dates
+updated_dates_written = Signal()
+
+
+def updated_date_cache_key(thread_id):
+    return f'thread:{thread_id}:updated_date'
+
+
+def file_subcategories_cache_key(file_name):
+    # file names may contain characters not allowed in cache keys
+    return f'file:{hashlib.md5(file_name.encode()).hexdigest()}:subcategories'
 
 
 class CategoryManager(models.Manager):
@@ -22,30 +60,125 @@ class Category(models.Model):
 
     objects = CategoryManager()
 
+    # (expires_at, version, categories) of the process-local memo
+    _memo = None
+
     @classmethod
     def get_all(cls):
-        categories_data = cache.get('categories')
-        if not categories_data:
-            categories_data = cls.objects.get_all_with_subcategories()
-            cache.set('categories', categories_data)
+        """Return the categories with their subcategories as tuples of CategoryEntry.
+           The tree is kept in a process-local memo for FORUM_CATEGORIES_LOCAL_TTL seconds,
+           behind the shared cache where it is stored under the current categories version
+           for FORUM_CATEGORIES_TIMEOUT seconds (the version itself never expires)
+        """
+        memo = cls._memo
+        now = time.monotonic()
+        if memo and memo[0] > now:
+            return memo[2]
+
+        version = cache.get_or_set(CATEGORIES_VERSION_KEY, time.time_ns, None)
+        if memo and memo[1] == version:
+            categories = memo[2]
+        else:
+            categories_key = f'categories:{version}'
+            categories = cache.get(categories_key)
+            if categories is None:
+                categories = cls._build_tree()
+                cache.set(categories_key, categories, settings.FORUM_CATEGORIES_TIMEOUT)
+
+        cls._memo = (now + settings.FORUM_CATEGORIES_LOCAL_TTL, version, categories)
+        return categories
 
-        return categories_data
+    @classmethod
+    async def aget_all(cls):
+        """Async version of get_all, the tree is built in the sync thread on a cache miss"""
+        memo = cls._memo
+        now = time.monotonic()
+        if memo and memo[0] > now:
+            return memo[2]
+
+        version = await cache.aget_or_set(CATEGORIES_VERSION_KEY, time.time_ns, None)
+        if memo and memo[1] == version:
+            categories = memo[2]
+        else:
+            categories_key = f'categories:{version}'
+            categories = await cache.aget(categories_key)
+            if categories is None:
+                categories = await sync_to_async(cls._build_tree)()
+                await cache.aset(categories_key, categories, settings.FORUM_CATEGORIES_TIMEOUT)
+
+        cls._memo = (now + settings.FORUM_CATEGORIES_LOCAL_TTL, version, categories)
+        return categories
+
+    @classmethod
+    def _build_tree(cls):
+        return tuple(
+            CategoryEntry(category.id, category.name, category.auth_required, tuple(
+                SubcategoryEntry(subcat.id, subcat.name, subcat.slug, category.id, category.auth_required)
+                for subcat in sorted(category.subcategory_set.all(), key=attrgetter('id'))))
+            for category in cls.objects.get_all_with_subcategories().order_by('id'))
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Moves all processes to a new categories version, the current process immediately
+           and the others once their local memo expires
+        """
+        cache.set(CATEGORIES_VERSION_KEY, time.time_ns(), None)
+        cls._memo = None
 
 
 class Subcategory(models.Model):
     category = models.ForeignKey(to=Category, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
+    slug = models.CharField(max_length=50, unique=True, editable=False)
 
     class Meta:
         verbose_name_plural = "Subcategories"
 
+    # (categories, {slug: SubcategoryEntry}) built from the categories returned by Category.get_all
+    _by_slug = None
+
+    def clean(self):
+        if Subcategory.objects.filter(slug=self.name.lower()).exclude(pk=self.pk).exists():
+            raise ValidationError({'name': 'A subcategory with this name (ignoring case) already exists.'})
+
+    def save(self, *args, **kwargs):
+        self.slug = self.name.lower()
+        super().save(*args, **kwargs)
+
     @classmethod
     def get_by_name(cls, name):
-        categories_data = Category.get_all()
-        for category in categories_data:
-            for subcat in category.subcategory_set.all():
-                if subcat.name.lower() == name:
-                    return subcat
+        """Return the SubcategoryEntry by its URL name (the lower-cased name).
+           The lookup is served by a map rebuilt whenever the cached categories change and falls back
+           to the indexed slug column for subcategories created after the categories were cached
+        """
+        slug = name.lower()
+        subcat = cls._get_cached(Category.get_all(), slug)
+        if subcat is None:
+            subcat = cls._entry(cls.objects.select_related('category').filter(slug=slug).first())
+        return subcat
+
+    @classmethod
+    async def aget_by_name(cls, name):
+        """Async version of get_by_name"""
+        slug = name.lower()
+        subcat = cls._get_cached(await Category.aget_all(), slug)
+        if subcat is None:
+            subcat = cls._entry(await cls.objects.select_related('category').filter(slug=slug).afirst())
+        return subcat
+
+    @classmethod
+    def _get_cached(cls, categories, slug):
+        if cls._by_slug is None or cls._by_slug[0] is not categories:
+            cls._by_slug = (categories, {subcat.slug: subcat
+                                         for category in categories for subcat in category.subcategories})
+        return cls._by_slug[1].get(slug)
+
+    @staticmethod
+    def _entry(db_subcat):
+        if db_subcat is None:
+            return None
+        return SubcategoryEntry(db_subcat.id, db_subcat.name, db_subcat.slug, db_subcat.category_id,
+                                db_subcat.category.auth_required)
 
 
 class ThreadManager(models.Manager):
@@ -54,22 +187,371 @@ class ThreadManager(models.Manager):
         return queryset.get(id=thread_id)
 
     def get_latest(self, fields, limit=5):
+        """Return the tuples of the fields of the last updated root threads, with the updated dates
+           pending in updated_date_buffer
+        """
+        queryset, pending = self._latest_threads(fields, limit)
+        rows = list(queryset.order_by('-updated_date')[:limit])
+        if pending:
+            rows += queryset.filter(id__in=pending)
+        return self._merge_latest(rows, pending, limit)
+
+    async def aget_latest(self, fields, limit=5):
+        """Async version of get_latest"""
+        queryset, pending = self._latest_threads(fields, limit)
+        rows = [row async for row in queryset.order_by('-updated_date')[:limit]]
+        if pending:
+            rows += [row async for row in queryset.filter(id__in=pending)]
+        return self._merge_latest(rows, pending, limit)
+
+    def _latest_threads(self, fields, limit):
+        """Return the root threads' (id, updated_date, *fields) and the pending updated dates,
+           of which only the most recent ones may be among the latest threads
+        """
         queryset = self.get_queryset()
-        return queryset.values_list(*fields).filter(
-            root_thread_id__isnull=True).order_by('-updated_date')[:limit]
+        return (queryset.values_list('id', 'updated_date', *fields).filter(root_thread_id__isnull=True),
+                updated_date_buffer.latest(limit))
+
+    @staticmethod
+    def _merge_latest(rows, pending, limit):
+        latest = {}
+        for thread_id, updated_date, *values in rows:
+            latest[thread_id] = (max(updated_date, pending.get(thread_id, updated_date)), tuple(values))
+        return [values for _, values in sorted(latest.values(), key=itemgetter(0), reverse=True)[:limit]]
+
+    def get_subcategory_latest(self, subcat_id, before=None, after=None, limit=None, by_activity=False):
+        """Return a keyset page of the subcategory's root threads, newest first,
+           or with by_activity the ones with the latest reply (or creation, if without replies) first.
+           'before' and 'after' are decoded (date, id) cursors of the neighbouring pages
+        """
+        queryset, field = self._subcategory_threads(subcat_id, by_activity)
+        return keyset_page(queryset, field, limit or settings.FORUM_THREADS_PAGE_SIZE,
+                           before=before, after=after)
+
+    async def aget_subcategory_latest(self, subcat_id, before=None, after=None, limit=None, by_activity=False):
+        """Async version of get_subcategory_latest"""
+        queryset, field = self._subcategory_threads(subcat_id, by_activity)
+        return await akeyset_page(queryset, field, limit or settings.FORUM_THREADS_PAGE_SIZE,
+                                  before=before, after=after)
+
+    def _subcategory_threads(self, subcat_id, by_activity):
+        queryset = self.get_queryset().filter(subcategory=subcat_id, reply_to=None)
+        if by_activity:
+            return queryset.annotate(activity_date=Coalesce('last_reply_at', 'created_date')), 'activity_date'
+        return queryset, 'created_date'
 
-    def get_subcategory_latest(self, subcat_id):
+    def get_thread_tree(self, thread_id):
+        """Return the thread with all of its replies fetched by one query and linked in memory.
+           The thread gets 'preloaded_root_replies' ordered by creation and every post
+           gets its 'preloaded_direct_replies', so rendering the tree needs no further queries.
+           A reply opened as a thread page gets its direct replies with a second query.
+           The thread's updated_date includes its bump pending in updated_date_buffer
+        """
+        thread = self._link_thread_tree(thread_id, list(self._thread_tree_posts(thread_id)))
+        if thread.root_thread_id is not None:
+            self.preload_direct_replies([thread])
+        return thread
+
+    async def aget_thread_tree(self, thread_id):
+        """Async version of get_thread_tree"""
+        thread = self._link_thread_tree(thread_id, [post async for post in self._thread_tree_posts(thread_id)])
+        if thread.root_thread_id is not None:
+            await self.apreload_direct_replies([thread])
+        return thread
+
+    def _thread_tree_posts(self, thread_id):
+        queryset = self.get_queryset().select_related('subcategory')
+        return queryset.filter(Q(id=thread_id) | Q(root_thread_id=thread_id))
+
+    def _link_thread_tree(self, thread_id, posts):
+        posts = sorted(posts, key=attrgetter('created_date', 'id'))
+        posts_by_id = {post.id: post for post in posts}
+
+        thread = posts_by_id.get(int(thread_id))
+        if thread is None:
+            raise self.model.DoesNotExist(f'Thread matching id {thread_id} does not exist.')
+
+        replies = [post for post in posts if post is not thread]
+        for reply in replies:
+            reply.preloaded_direct_replies = []
+        # a reply opened as a thread page is not the root of its replies' replies,
+        # get_thread_tree preloads its direct replies separately
+        if thread.root_thread_id is None:
+            thread.preloaded_direct_replies = []
+        for reply in replies:
+            parent = posts_by_id.get(reply.reply_to_id)
+            if parent is not None and hasattr(parent, 'preloaded_direct_replies'):
+                parent.preloaded_direct_replies.append(reply)
+
+        thread.preloaded_root_replies = replies
+        # the page compares its time with the update checks, which see the bumps not written yet
+        pending_date = updated_date_buffer.get_many([thread.id]).get(thread.id)
+        if pending_date is not None and pending_date > thread.updated_date:
+            thread.updated_date = pending_date
+        return thread
+
+    def search(self, text, subcategory_id=None, include_private=False, page=1, limit=None):
+        """Return the page of threads and replies matching the text, best match first, and whether
+           there is a next page. Matches are ranked by bm25 of the search index, where subject
+           matches weigh more than message ones. Posts of categories requiring authentication
+           are found only if include_private is set
+        """
+        expression = match_expression(text)
+        if expression is None:
+            return [], False
+
+        limit = limit or settings.FORUM_SEARCH_PAGE_SIZE
+        conditions = [f'{SEARCH_TABLE} MATCH %s']
+        params = [expression]
+        if subcategory_id:
+            conditions.append('forum_thread.subcategory_id = %s')
+            params.append(subcategory_id)
+        if not include_private:
+            conditions.append('NOT forum_category.auth_required')
+
+        threads = list(self.raw(f"""
+            SELECT forum_thread.*, forum_subcategory.name AS subcategory_name
+            FROM {SEARCH_TABLE}
+            JOIN forum_thread ON forum_thread.id = {SEARCH_TABLE}.rowid
+            JOIN forum_subcategory ON forum_subcategory.id = forum_thread.subcategory_id
+            JOIN forum_category ON forum_category.id = forum_subcategory.category_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25({SEARCH_TABLE}, 10.0, 1.0), forum_thread.id DESC
+            LIMIT %s OFFSET %s""", params + [limit + 1, (page - 1) * limit]))
+        return threads[:limit], len(threads) > limit
+
+    def preload_recent_replies(self, threads, limit=2):
+        """Attach the latest 'limit' root replies to every given thread and the direct replies
+           to the threads and those replies, using two queries regardless of the number of threads
+        """
+        threads = list(threads)
+        if not threads:
+            return threads
+
+        replies = self._attach_recent_replies(threads, self._recent_replies(threads, limit))
+        self.preload_direct_replies(threads + replies)
+        return threads
+
+    async def apreload_recent_replies(self, threads, limit=2):
+        """Async version of preload_recent_replies"""
+        threads = list(threads)
+        if not threads:
+            return threads
+
+        replies = self._attach_recent_replies(threads, [reply async for reply in self._recent_replies(threads, limit)])
+        await self.apreload_direct_replies(threads + replies)
+        return threads
+
+    def _recent_replies(self, threads, limit):
         queryset = self.get_queryset()
-        return queryset.filter(subcategory=subcat_id,
-                               reply_to=None).order_by('-created_date')
+        return queryset.filter(root_thread_id__in=[thread.id for thread in threads]).annotate(
+            reply_rank=Window(RowNumber(), partition_by=F('root_thread_id'),
+                              order_by=(F('created_date').desc(), F('id').desc()))
+        ).filter(reply_rank__lte=limit)
+
+    @staticmethod
+    def _attach_recent_replies(threads, recent_replies):
+        """Attach the replies to their threads, return all of them"""
+        replies_by_root = defaultdict(list)
+        for reply in recent_replies:
+            replies_by_root[reply.root_thread_id].append(reply)
+
+        replies = []
+        for thread in threads:
+            thread.preloaded_recent_replies = sorted(replies_by_root[thread.id], key=attrgetter('created_date', 'id'))
+            replies.extend(thread.preloaded_recent_replies)
+        return replies
+
+    def preload_direct_replies(self, posts):
+        """Attach the direct replies (only their ids) to every given thread or reply with one query"""
+        self._attach_direct_replies(posts, self._direct_replies(posts))
+
+    async def apreload_direct_replies(self, posts):
+        """Async version of preload_direct_replies"""
+        self._attach_direct_replies(posts, [reply async for reply in self._direct_replies(posts)])
+
+    def _direct_replies(self, posts):
+        queryset = self.get_queryset()
+        return queryset.filter(reply_to_id__in=[post.id for post in posts]).only('id', 'reply_to_id', 'created_date')
+
+    @staticmethod
+    def _attach_direct_replies(posts, direct_replies):
+        replies_by_post = defaultdict(list)
+        for reply in direct_replies:
+            replies_by_post[reply.reply_to_id].append(reply)
+
+        for post in posts:
+            post.preloaded_direct_replies = sorted(replies_by_post[post.id], key=attrgetter('created_date', 'id'))
+
+    def get_updated_date(self, thread_id):
+        """Return the thread's updated_date from the cache, falling back to a single column query.
+           Returns None if the thread does not exist
+        """
+        return self.get_updated_dates([thread_id]).get(thread_id)
+
+    async def aget_updated_date(self, thread_id):
+        """Async version of get_updated_date"""
+        return (await self.aget_updated_dates([thread_id])).get(thread_id)
+
+    def get_updated_dates(self, thread_ids):
+        """Return {thread_id: updated_date} of the given existing threads, read from the cache
+           and with a single primary key lookup for the ones missing from it
+        """
+        cache_keys = {updated_date_cache_key(thread_id): thread_id for thread_id in thread_ids}
+        updated_dates = {cache_keys[key]: updated_date for key, updated_date in cache.get_many(cache_keys).items()}
+
+        missing_ids = self._record_updated_date_lookups(thread_ids, updated_dates)
+        if missing_ids:
+            queryset = self.get_queryset()
+            db_updated_dates = self._with_pending_dates(
+                dict(queryset.filter(id__in=missing_ids).values_list('id', 'updated_date')))
+            cache.set_many(self._updated_date_entries(missing_ids, db_updated_dates),
+                           settings.FORUM_UPDATED_DATE_TIMEOUT)
+            updated_dates.update(db_updated_dates)
+        return {thread_id: updated_date for thread_id, updated_date in updated_dates.items() if updated_date}
+
+    async def aget_updated_dates(self, thread_ids):
+        """Async version of get_updated_dates"""
+        cache_keys = {updated_date_cache_key(thread_id): thread_id for thread_id in thread_ids}
+        updated_dates = {cache_keys[key]: updated_date
+                         for key, updated_date in (await cache.aget_many(cache_keys)).items()}
+
+        missing_ids = self._record_updated_date_lookups(thread_ids, updated_dates)
+        if missing_ids:
+            queryset = self.get_queryset()
+            db_updated_dates = self._with_pending_dates(
+                {thread_id: updated_date async for thread_id, updated_date
+                 in queryset.filter(id__in=missing_ids).values_list('id', 'updated_date')})
+            await cache.aset_many(self._updated_date_entries(missing_ids, db_updated_dates),
+                                  settings.FORUM_UPDATED_DATE_TIMEOUT)
+            updated_dates.update(db_updated_dates)
+        return {thread_id: updated_date for thread_id, updated_date in updated_dates.items() if updated_date}
+
+    @staticmethod
+    def _record_updated_date_lookups(thread_ids, cached_dates):
+        """Counts the cache lookups, return the ids missing from the cache"""
+        missing_ids = [thread_id for thread_id in thread_ids if thread_id not in cached_dates]
+        record_cache('updated_date', True, len(cached_dates))
+        record_cache('updated_date', False, len(missing_ids))
+        return missing_ids
+
+    @staticmethod
+    def _with_pending_dates(db_updated_dates):
+        """Return the updated dates read from the database, replaced by the later ones not written yet"""
+        for thread_id, updated_date in updated_date_buffer.get_many(db_updated_dates).items():
+            db_updated_dates[thread_id] = max(db_updated_dates[thread_id], updated_date)
+        return db_updated_dates
+
+    @staticmethod
+    def _updated_date_entries(missing_ids, db_updated_dates):
+        entries = {updated_date_cache_key(thread_id): updated_date
+                   for thread_id, updated_date in db_updated_dates.items()}
+        # unknown ids are remembered as False until a thread with that id is created
+        entries.update({updated_date_cache_key(thread_id): False
+                        for thread_id in missing_ids if thread_id not in db_updated_dates})
+        return entries
+
+    def get_file_subcategories(self, file_name):
+        """Return the ids of the subcategories of the threads referencing the file, cached for
+           FORUM_MEDIA_ACCESS_TIMEOUT seconds. Unreferenced files are not cached, their threads may be posted next
+        """
+        cache_key = file_subcategories_cache_key(file_name)
+        subcategory_ids = cache.get(cache_key)
+        record_cache('file_subcategories', subcategory_ids is not None)
+        if subcategory_ids is None:
+            queryset = self.get_queryset()
+            subcategory_ids = tuple(queryset.filter(file=file_name).order_by()
+                                    .values_list('subcategory_id', flat=True).distinct())
+            if subcategory_ids:
+                cache.set(cache_key, subcategory_ids, settings.FORUM_MEDIA_ACCESS_TIMEOUT)
+        return subcategory_ids
 
     def update_date(self, thread_id):
+        """Bumps the thread's updated_date. Outside of a transaction the UPDATE is written behind by
+           updated_date_buffer, in one batch with the other bumps of FORUM_UPDATED_DATE_FLUSH_INTERVAL seconds.
+           The date is read at once from the cache, or from the buffer by get_updated_dates and get_latest
+        """
+        updated_date = timezone.now()
+        if settings.FORUM_UPDATED_DATE_FLUSH_INTERVAL and not transaction.get_connection().in_atomic_block:
+            updated_date_buffer.add(thread_id, updated_date)
+        else:
+            queryset = self.get_queryset()
+            queryset.filter(id=thread_id).update(updated_date=updated_date)
+        cache.set(updated_date_cache_key(thread_id), updated_date, settings.FORUM_UPDATED_DATE_TIMEOUT)
+        return updated_date
+
+    def write_updated_dates(self, updated_dates):
+        """Writes {thread_id: updated_date} with one UPDATE per batch, which picks each thread's date
+           by a CASE on its id. A date is only moved forward, as a reply may have been added since the bump.
+           Sends updated_dates_written, as the pages ordered by the dates were invalidated before they were written
+        """
         queryset = self.get_queryset()
-        queryset.filter(id=thread_id).update(updated_date=timezone.now())
+        items = list(updated_dates.items())
+        for start in range(0, len(items), UPDATED_DATES_BATCH_SIZE):
+            batch = items[start:start + UPDATED_DATES_BATCH_SIZE]
+            new_date = Case(*(When(id=thread_id, then=Value(updated_date)) for thread_id, updated_date in batch),
+                            output_field=models.DateTimeField())
+            queryset.filter(id__in=[thread_id for thread_id, _ in batch]).update(
+                updated_date=Greatest('updated_date', new_date))
+        updated_dates_written.send(sender=self.model, thread_ids=list(updated_dates))
+
+    def add_reply(self, reply):
+        """Saves the reply and, in the same transaction, updates the reply counter, the last reply fields
+           and the updated date of its root thread. The counter is incremented by the database,
+           so concurrent replies are never lost. Return the new updated date of the root thread
+        """
+        queryset = self.get_queryset()
+        with transaction.atomic():
+            reply.save()
+            queryset.filter(id=reply.root_thread_id).update(
+                reply_count=F('reply_count') + 1, last_reply=reply, last_reply_at=reply.created_date,
+                last_reply_author=reply.author_name, updated_date=reply.created_date)
+        cache.set(updated_date_cache_key(reply.root_thread_id), reply.created_date,
+                  settings.FORUM_UPDATED_DATE_TIMEOUT)
+        return reply.created_date
+
+    def refresh_reply_counters(self, root_ids):
+        """Recompute the reply counter and the last reply fields of the given root threads
+           from their replies, with one UPDATE whose subqueries seek the replies index of each thread.
+           A grouped aggregate gives the count and the latest date but not the last reply's id and author,
+           and the subqueries read only the replies of the given threads, in thread_root_replies_idx order
+        """
+        queryset = self.get_queryset()
+        replies = queryset.filter(root_thread=OuterRef('pk')).order_by()
+        reply_total = replies.values('root_thread').annotate(total=Count('id')).values('total')
+        last_reply = replies.order_by('-created_date', '-id')[:1]
+        queryset.filter(id__in=root_ids).update(
+            reply_count=Coalesce(Subquery(reply_total), 0),
+            last_reply=Subquery(last_reply.values('id')),
+            last_reply_at=Subquery(last_reply.values('created_date')),
+            last_reply_author=Coalesce(Subquery(last_reply.values('author_name')), Value('')))
 
     def update_message(self, thread_id, new_message):
         queryset = self.get_queryset()
-        queryset.filter(id=thread_id).update(message=new_message, updated_date=timezone.now())
+        updated_date = timezone.now()
+        queryset.filter(id=thread_id).update(message=new_message, updated_date=updated_date)
+        cache.set(updated_date_cache_key(thread_id), updated_date, settings.FORUM_UPDATED_DATE_TIMEOUT)
+        return updated_date
+
+    def release_file(self, name):
+        """Deletes the stored file and its thumbnails if no thread references it anymore.
+           Only content-addressed files are deleted, and not those reused by an upload in the last
+           FORUM_ATTACHMENT_REUSE_GRACE seconds, whose thread may not be committed yet.
+           Return whether the file was deleted
+        """
+        storage = self.model._meta.get_field('file').storage
+        if not storage.is_content_name(name) or self.get_queryset().filter(file=name).exists():
+            return False
+        try:
+            if time.time() - os.path.getmtime(storage.path(name)) < settings.FORUM_ATTACHMENT_REUSE_GRACE:
+                return False
+        except FileNotFoundError:
+            return False
+
+        storage.delete(name)
+        for size in settings.FORUM_THUMBNAIL_SIZES:
+            default_storage.delete(thumbnail_name(name, size))
+        return True
 
 
 class Thread(models.Model):
@@ -78,39 +560,120 @@ class Thread(models.Model):
     author_name = models.CharField(max_length=150, blank=True)
     author_email = models.CharField(max_length=254, blank=True)
     message = models.TextField()
-    file = models.FileField(upload_to='thread_files/', null=True, blank=True)
+    file = models.FileField(upload_to='thread_files/', storage=attachment_storage, null=True, blank=True)
     reply_to = models.ForeignKey(to='Thread', on_delete=models.CASCADE, blank=True, null=True,
-                                 related_name="%(class)s_reply_to")
+                                 related_name="%(class)s_reply_to", db_index=False)
     created_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now_add=True)
     root_thread = models.ForeignKey(to='Thread', on_delete=models.CASCADE, blank=True, null=True,
-                                    related_name="%(class)s_root_thread")
+                                    related_name="%(class)s_root_thread", db_index=False)
+    file_mime_type = models.CharField(max_length=100, blank=True)
+    file_is_image = models.BooleanField(default=False)
+    file_width = models.PositiveIntegerField(null=True, blank=True)
+    file_height = models.PositiveIntegerField(null=True, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    has_thumbnails = models.BooleanField(default=False)
+    # the file is stored under the hash of its content
+    file_original_name = models.CharField(max_length=255, blank=True)
+    # maintained on root threads by ThreadManager.add_reply
+    reply_count = models.PositiveIntegerField(default=0)
+    last_reply = models.ForeignKey(to='Thread', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    last_reply_at = models.DateTimeField(null=True, blank=True)
+    last_reply_author = models.CharField(max_length=150, blank=True)
+
+    class Meta:
+        indexes = [
+            # dashboard's latest threads
+            models.Index(fields=['-updated_date'], condition=Q(root_thread=None), name='thread_latest_idx'),
+            # subcategory's pages of root threads
+            models.Index(fields=['subcategory', '-created_date', '-id'], condition=Q(reply_to=None),
+                         name='thread_subcat_latest_idx'),
+            models.Index(F('subcategory'), Coalesce('last_reply_at', 'created_date').desc(), F('id').desc(),
+                         condition=Q(reply_to=None), name='thread_subcat_activity_idx'),
+            # thread's replies, also serve as the indexes of the foreign keys
+            models.Index(fields=['root_thread', '-created_date', '-id'], condition=Q(root_thread__isnull=False),
+                         name='thread_root_replies_idx'),
+            models.Index(fields=['reply_to', 'created_date'], condition=Q(reply_to__isnull=False),
+                         name='thread_direct_replies_idx'),
+            # threads sharing a file
+            models.Index(fields=['file'], condition=Q(file__isnull=False), name='thread_file_idx'),
+        ]
 
     objects = ThreadManager()
 
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.file_original_name = os.path.basename(self.file.name)[:255]
+        super().save(*args, **kwargs)
+
     @property
     def direct_replies(self):
+        if hasattr(self, 'preloaded_direct_replies'):
+            return self.preloaded_direct_replies
         return self.thread_reply_to.order_by('created_date')
 
     @property
     def root_replies(self):
+        if hasattr(self, 'preloaded_root_replies'):
+            return self.preloaded_root_replies
         return self.thread_root_thread.order_by('created_date')
 
     @property
     def recent_root_replies(self):
+        if hasattr(self, 'preloaded_recent_replies'):
+            return self.preloaded_recent_replies
         return self.thread_root_thread.order_by('-created_date')[:2:-1]
 
     @property
     def file_name(self):
-        """Return file name without 'upload_to' prefix
+        """Return the name the file was uploaded with,
+           or for files stored before it was kept, the file name without 'upload_to' prefix
            e.g. input upload_to/file.txt returns file.txt
         """
-        return os.path.basename(self.file.name)
+        return self.file_original_name or os.path.basename(self.file.name)
 
     @property
     def is_file_image(self):
-        """Checks if the thread's file is an image.
-           imghdr.what will return None if the file is not an image or
-           image's format if it is
+        """Checks if the thread's file is an image,
+           based on the metadata detected when the file was uploaded
+        """
+        return self.file_is_image
+
+    @property
+    def small_thumbnail_url(self):
+        return self.thumbnail_url(settings.FORUM_THUMBNAIL_SIZES[0])
+
+    @property
+    def large_thumbnail_url(self):
+        return self.thumbnail_url(settings.FORUM_THUMBNAIL_SIZES[-1])
+
+    def thumbnail_url(self, size):
+        """Return the URL of the image's thumbnail with the given size,
+           or of the original image while the thumbnails are not created yet
+        """
+        if self.has_thumbnails:
+            return default_storage.url(thumbnail_name(self.file.name, size))
+        return self.file.url
+
+    def detect_file_metadata(self):
+        """Detects and sets the MIME type, size and, for images, the dimensions of the thread's file.
+           Only the image header is read, the file itself is not decoded
         """
-        return imghdr.what(settings.MEDIA_ROOT + "/" + self.file.name)
+        self.file_mime_type = mimetypes.guess_type(self.file.name)[0] or 'application/octet-stream'
+        self.file_is_image = False
+        self.file_width = self.file_height = None
+        self.file_size = self.file.size
+
+        self.file.seek(0)
+        try:
+            with Image.open(self.file) as image:
+                self.file_width, self.file_height = image.size
+                self.file_mime_type = Image.MIME.get(image.format, self.file_mime_type)
+                self.file_is_image = True
+        except (UnidentifiedImageError, OSError):
+            pass
+        finally:
+            self.file.seek(0)
+
+
+updated_date_buffer = UpdatedDateBuffer(lambda updated_dates: Thread.objects.write_updated_dates(updated_dates))
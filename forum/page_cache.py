@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .db_routers import PIN_COOKIE
+from .metrics import record_cache
+from .models import CATEGORIES_VERSION_KEY
+
+DASHBOARD_SCOPE = 'dashboard'
+CSRF_PLACEHOLDER = 'forum-page-cache-csrf-token'
+
+
+def subcategory_scope(slug):
+    return f'subcategory:{slug}'
+
+
+def thread_scope(thread_id):
+    return f'thread:{thread_id}'
+
+
+def generation_key(scope):
+    return f'page:generation:{scope}'
+
+
+def page_cache_key(path):
+    return 'page:' + hashlib.md5(path.encode()).hexdigest()
+
+
+def bump_page_generations(*scopes):
+    """Invalidates the cached pages of the given scopes once the current transaction is committed"""
+    transaction.on_commit(lambda: cache.set_many({generation_key(scope): time.time_ns() for scope in scopes}, None))
+
+
+def _current_generations(scopes):
+    keys = [generation_key(scope) for scope in scopes] + [CATEGORIES_VERSION_KEY]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # a lost generation must not match pages cached before it was lost
+            cache.add(key, time.time_ns(), None)
+            generations[key] = cache.get(key)
+    return tuple(generations[key] for key in keys)
+
+
+async def _acurrent_generations(scopes):
+    keys = [generation_key(scope) for scope in scopes] + [CATEGORIES_VERSION_KEY]
+    generations = await cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await cache.aadd(key, time.time_ns(), None)
+            generations[key] = await cache.aget(key)
+    return tuple(generations[key] for key in keys)
+
+
+def page_timeout(generations):
+    """Return the seconds a page rendered at the given generations is cached. With read replicas the page
+       may have been read from one which had not received the write bumping a generation yet,
+       so until FORUM_DB_PIN_SECONDS after the last bump it is cached only for the rest of that time
+    """
+    if settings.FORUM_DB_REPLICAS:
+        lag_seconds = max(generations) / 1e9 + settings.FORUM_DB_PIN_SECONDS - time.time()
+        if lag_seconds > 0:
+            return min(math.ceil(lag_seconds), settings.FORUM_PAGE_CACHE_TIMEOUT)
+    return settings.FORUM_PAGE_CACHE_TIMEOUT
+
+
+def _cached_response(request, entry):
+    content, content_type = entry[1], entry[2]
+    return HttpResponse(content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode()),
+                        content_type=content_type)
+
+
+def _wait_for_page(key, generations):
+    deadline = time.monotonic() + settings.FORUM_PAGE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry and entry[0] == generations:
+            return entry
+    return None
+
+
+async def _await_page(key, generations):
+    deadline = time.monotonic() + settings.FORUM_PAGE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entry = await cache.aget(key)
+        if entry and entry[0] == generations:
+            return entry
+    return None
+
+
+async def ais_authenticated(request):
+    """Checks if the request's user is authenticated. The user (and the session) is loaded in the sync thread
+       the first time, so the templates of the async views read an already loaded user
+    """
+    if not hasattr(request, 'forum_is_authenticated'):
+        request.forum_is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.forum_is_authenticated
+
+
+def csrf_placeholder(request):
+    """Context processor rendering the CSRF token of a cacheable page as a placeholder,
+       which is replaced by the requester's token whenever the page is served
+    """
+    if getattr(request, 'page_cache_csrf_placeholder', False):
+        return {'csrf_token': CSRF_PLACEHOLDER}
+    return {}
+
+
+def cache_anonymous_page(get_scopes):
+    """Caches the whole response of the view for anonymous GET requests,
+       except for clients pinned to the primary database after a write, which get their writes rendered.
+       get_scopes receives the view's URL arguments and returns the generation scopes of the page,
+       a page is served from the cache until one of them (or the categories version) is bumped.
+       Only one worker renders a page at a time, the others serve its previous version meanwhile
+       or wait for the new one if there is none
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            return _async_cached_view(view, get_scopes)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (not settings.FORUM_PAGE_CACHE_ENABLED or request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated or 'messages' in request.COOKIES
+                    or PIN_COOKIE in request.COOKIES):
+                return view(request, *args, **kwargs)
+
+            generations = _current_generations(get_scopes(*args, **kwargs))
+            key = page_cache_key(request.get_full_path())
+            entry = cache.get(key)
+            if entry and entry[0] == generations:
+                record_cache('page', True)
+                return _cached_response(request, entry)
+
+            lock_key = key + ':lock'
+            if not cache.add(lock_key, 1, settings.FORUM_PAGE_CACHE_WAIT):
+                entry = entry or _wait_for_page(key, generations)
+                record_cache('page', bool(entry))
+                if entry:
+                    return _cached_response(request, entry)
+                return view(request, *args, **kwargs)
+
+            record_cache('page', False)
+            request.page_cache_csrf_placeholder = True
+            try:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+
+                entry = (generations, response.content, response['Content-Type'])
+                cache.set(key, entry, page_timeout(generations))
+            finally:
+                request.page_cache_csrf_placeholder = False
+                cache.delete(lock_key)
+            return _cached_response(request, entry)
+
+        return wrapper
+
+    return decorator
+
+
+def _async_cached_view(view, get_scopes):
+    """The page cache of an async view, with the async cache API"""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if (not settings.FORUM_PAGE_CACHE_ENABLED or request.method not in ('GET', 'HEAD')
+                or await ais_authenticated(request) or 'messages' in request.COOKIES
+                or PIN_COOKIE in request.COOKIES):
+            return await view(request, *args, **kwargs)
+
+        generations = await _acurrent_generations(get_scopes(*args, **kwargs))
+        key = page_cache_key(request.get_full_path())
+        entry = await cache.aget(key)
+        if entry and entry[0] == generations:
+            record_cache('page', True)
+            return _cached_response(request, entry)
+
+        lock_key = key + ':lock'
+        if not await cache.aadd(lock_key, 1, settings.FORUM_PAGE_CACHE_WAIT):
+            entry = entry or await _await_page(key, generations)
+            record_cache('page', bool(entry))
+            if entry:
+                return _cached_response(request, entry)
+            return await view(request, *args, **kwargs)
+
+        record_cache('page', False)
+        request.page_cache_csrf_placeholder = True
+        try:
+            response = await view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+
+            entry = (generations, response.content, response['Content-Type'])
+            await cache.aset(key, entry, page_timeout(generations))
+        finally:
+            request.page_cache_csrf_placeholder = False
+            await cache.adelete(lock_key)
+        return _cached_response(request, entry)
+
+    return wrapper
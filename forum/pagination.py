@@ -0,0 +1,73 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# the range of the database's 64-bit integer ids
+MIN_ID, MAX_ID = -2 ** 63, 2 ** 63 - 1
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'older_cursor', 'newer_cursor'])
+
+
+def encode_cursor(date, item_id):
+    """Return an URL safe cursor for the (date, id) key
+       e.g. 2023-05-24 16:56:00.000001+00:00 and id 7 returns 1684947360000001_7
+    """
+    micros = (date - EPOCH) // timedelta(microseconds=1)
+    return f'{micros}_{item_id}'
+
+
+def decode_cursor(cursor):
+    """Return the (date, id) key encoded by 'encode_cursor',
+       or None if the cursor is missing or malformed
+    """
+    try:
+        micros, item_id = cursor.split('_')
+        key = EPOCH + timedelta(microseconds=int(micros)), int(item_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    return key if MIN_ID <= key[1] <= MAX_ID else None
+
+
+def keyset_page(queryset, field, limit, before=None, after=None):
+    """Return one page of the queryset ordered by (field, id) descending.
+       Pages are addressed by the key of their edge rows instead of an offset,
+       so every page costs a single index range scan and stays stable while new rows are added.
+       'before' selects rows older than the given key, 'after' rows newer than it.
+    """
+    rows = list(_keyset_rows(queryset, field, limit, before, after))
+    return _keyset_result(rows, field, limit, before, after)
+
+
+async def akeyset_page(queryset, field, limit, before=None, after=None):
+    """Async version of keyset_page"""
+    rows = [row async for row in _keyset_rows(queryset, field, limit, before, after)]
+    return _keyset_result(rows, field, limit, before, after)
+
+
+def _keyset_rows(queryset, field, limit, before, after):
+    """Return the query of the page's rows and one more, which tells whether there is a further page"""
+    if after:
+        value, item_id = after
+        return (queryset.filter(Q(**{field + '__gt': value}) | Q(**{field: value, 'id__gt': item_id}))
+                .order_by(field, 'id')[:limit + 1])
+    if before:
+        value, item_id = before
+        queryset = queryset.filter(Q(**{field + '__lt': value}) | Q(**{field: value, 'id__lt': item_id}))
+    return queryset.order_by('-' + field, '-id')[:limit + 1]
+
+
+def _keyset_result(rows, field, limit, before, after):
+    if after:
+        has_newer = len(rows) > limit
+        has_older = True
+        items = rows[:limit][::-1]
+    else:
+        has_older = len(rows) > limit
+        has_newer = before is not None
+        items = rows[:limit]
+
+    older_cursor = encode_cursor(getattr(items[-1], field), items[-1].id) if has_older and items else None
+    newer_cursor = encode_cursor(getattr(items[0], field), items[0].id) if has_newer and items else None
+    return KeysetPage(items, older_cursor, newer_cursor)
@@ -0,0 +1,41 @@
+import re
+
+SEARCH_TABLE = 'forum_thread_fts'
+
+
+def match_expression(text):
+    """Return the FTS5 MATCH expression finding posts which contain every word of the text,
+       the last one also as a prefix, e.g. 'django orm' returns '"django" "orm"*'.
+       Quoting the words keeps the user's input from being parsed as FTS5 query syntax
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+# the triggers keeping the search index in sync, created by the migration 0011 and restored by restore_search_triggers.
+# A change to them needs a new migration running restore_search_triggers
+SEARCH_TRIGGERS = {
+    'forum_thread_fts_insert': f"""CREATE TRIGGER forum_thread_fts_insert AFTER INSERT ON forum_thread BEGIN
+           INSERT INTO {SEARCH_TABLE}(rowid, subject, message) VALUES (new.id, new.subject, new.message);
+       END""",
+    'forum_thread_fts_update': f"""CREATE TRIGGER forum_thread_fts_update
+           AFTER UPDATE OF subject, message ON forum_thread BEGIN
+           UPDATE {SEARCH_TABLE} SET subject = new.subject, message = new.message WHERE rowid = new.id;
+       END""",
+    'forum_thread_fts_delete': f"""CREATE TRIGGER forum_thread_fts_delete AFTER DELETE ON forum_thread BEGIN
+           DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+       END""",
+}
+
+
+def restore_search_triggers(apps, schema_editor):
+    """Migration operation recreating the triggers which keep the search index in sync.
+       SQLite drops them whenever a migration remakes the forum_thread table,
+       so it has to follow every such migration
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        for name, statement in SEARCH_TRIGGERS.items():
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            schema_editor.execute(statement)
@@ -0,0 +1,92 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import instrument_connection
+from .models import Category, Subcategory, Thread, updated_date_cache_key, updated_dates_written
+from .page_cache import DASHBOARD_SCOPE, bump_page_generations, subcategory_scope, thread_scope
+from .thumbnails import generate_thumbnails, thumbnails_exist
+
+logger = logging.getLogger(__name__)
+
+_thumbnail_executor = None
+
+
+def get_thumbnail_executor():
+    global _thumbnail_executor
+    if _thumbnail_executor is None:
+        _thumbnail_executor = ThreadPoolExecutor(max_workers=settings.FORUM_THUMBNAIL_WORKERS,
+                                                 thread_name_prefix='thumbnails')
+    return _thumbnail_executor
+
+
+def create_thread_thumbnails(thread_id, file_name):
+    # files are shared by the threads uploading the same content, so may have thumbnails already
+    if not thumbnails_exist(settings.MEDIA_ROOT, file_name, settings.FORUM_THUMBNAIL_SIZES):
+        generate_thumbnails(settings.MEDIA_ROOT, file_name, settings.FORUM_THUMBNAIL_SIZES)
+    Thread.objects.filter(id=thread_id).update(has_thumbnails=True)
+
+    thread = Thread.objects.filter(id=thread_id).values('root_thread_id', 'subcategory__slug').first()
+    if thread:
+        bump_page_generations(subcategory_scope(thread['subcategory__slug']),
+                              thread_scope(thread['root_thread_id'] or thread_id))
+
+
+def _create_thread_thumbnails_task(thread_id, file_name):
+    try:
+        create_thread_thumbnails(thread_id, file_name)
+    except Exception:
+        logger.exception('Thumbnails of thread #%s (%s) could not be created', thread_id, file_name)
+    finally:
+        connection.close()
+
+
+@receiver(post_save, sender=Thread)
+def schedule_thread_thumbnails(sender, instance, created, **kwargs):
+    """Creates the thumbnails of a new thread's image off the request path, once the thread is committed"""
+    if created and instance.file_is_image:
+        transaction.on_commit(lambda: get_thumbnail_executor().submit(
+            _create_thread_thumbnails_task, instance.id, instance.file.name))
+
+
+@receiver(post_save, sender=Thread)
+def cache_new_thread_updated_date(sender, instance, created, **kwargs):
+    if created:
+        cache.set(updated_date_cache_key(instance.id), instance.updated_date, settings.FORUM_UPDATED_DATE_TIMEOUT)
+
+
+@receiver(post_delete, sender=Thread)
+def release_deleted_thread_file(sender, instance, **kwargs):
+    """Deletes the file of a deleted thread once the deletion is committed, unless other threads share it"""
+    if instance.file:
+        file_name = instance.file.name
+        transaction.on_commit(lambda: Thread.objects.release_file(file_name))
+
+
+@receiver(updated_dates_written, sender=Thread)
+def invalidate_updated_pages(sender, thread_ids, **kwargs):
+    """The dashboard, thread and subcategory pages may have been rendered by another process, without
+       the bumps buffered in this one, after they were invalidated by the bumping requests
+    """
+    slugs = Thread.objects.filter(id__in=thread_ids).values_list('subcategory__slug', flat=True).distinct()
+    bump_page_generations(DASHBOARD_SCOPE, *(thread_scope(thread_id) for thread_id in thread_ids),
+                          *(subcategory_scope(slug) for slug in slugs))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Subcategory)
+@receiver(post_delete, sender=Subcategory)
+def invalidate_categories_cache(sender, **kwargs):
+    Category.invalidate_cache()
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    instrument_connection(connection)
@@ -9,14 +9,41 @@ function setReplyTo(replyId) {
 }
 
 /**
-    On the page load sets the interval that periodically (currently 1 minute) checks
+    On the page load subscribes to the thread's Server-Sent Events, which push the thread's
+    new update time whenever it changes. If the browser does not support SSE or the server
+    refuses the stream (it does so when it is not running under ASGI), it falls back to polling.
+    If the thread has been changed it will display a message and stop listening.
+**/
+window.onload = function () {
+    const check_update_data = JSON.parse(document.getElementById('check-update-data').textContent);
+
+    if (!window.EventSource) {
+        pollUpdates(check_update_data);
+        return;
+    }
+
+    const source = new EventSource(check_update_data.events_url);
+    source.addEventListener('update', function (event) {
+        if (event.data > check_update_data.thread_page_time) {
+            new bootstrap.Toast(document.getElementById("updateToast")).show();
+            source.close();
+        }
+    });
+    source.onerror = function () {
+        if (source.readyState === EventSource.CLOSED) {
+            pollUpdates(check_update_data);
+        }
+    };
+}
+
+/**
+    Sets the interval that periodically (currently 1 minute) checks
     whether the thread has been updated (by invoking an appropriate view via Ajax).
     If the thread has been changed it will display a message and clear the interval.
 **/
-window.onload = function () {
+function pollUpdates(check_update_data) {
 
     let update_interval = setInterval(function () {
-        const check_update_data = JSON.parse(document.getElementById('check-update-data').textContent);
         let thread_page_time = check_update_data.thread_page_time
         const request = new XMLHttpRequest();
         request.open('GET', check_update_data.url);
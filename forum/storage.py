@@ -0,0 +1,86 @@
+import hashlib
+import os
+import posixpath
+import re
+import secrets
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+# e.g. thread_files/3a/7b/3a7b...e1.jpg
+CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(?:\.[a-z0-9]{1,10})?$')
+EXTENSION_RE = re.compile(r'\.[a-z0-9]{1,10}')
+
+
+@deconstructible(path='forum.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage keeping every file under the SHA-256 hash of its content,
+       e.g. a file saved as thread_files/cat.jpg is stored as thread_files/3a/7b/3a7b...e1.jpg.
+       The hash is computed while the content is streamed to a temporary file,
+       and content stored already is not written again, the existing name is returned instead.
+       Files are shared by all the names they are saved under, see ThreadManager.release_file
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save replaces the name with the content's one, which may exist already
+        return name
+
+    @staticmethod
+    def content_name(name, digest):
+        """Return the name of the content with the given hash saved as name,
+           in the name's directory and with its (lowercase) extension
+        """
+        directory, base_name = posixpath.split(name)
+        extension = os.path.splitext(base_name)[1].lower()
+        if not EXTENSION_RE.fullmatch(extension):
+            extension = ''
+        return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    @staticmethod
+    def is_content_name(name):
+        return bool(CONTENT_NAME_RE.search(name))
+
+    def hash_name(self, name):
+        """Return the content name of a file stored under another name e.g. before the storage was used"""
+        digest = hashlib.sha256()
+        with open(self.path(name), 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return self.content_name(name, digest.hexdigest())
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+        # in the target's directory tree, so it is moved to its place without copying
+        temp_path = self.path(posixpath.join(directory, f'.upload-{secrets.token_hex(8)}'))
+
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, 'xb') as temp_file:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            name = self.content_name(name, digest.hexdigest())
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(temp_path)
+                # marks the file as just reused, see ThreadManager.release_file
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                # concurrent saves of the same content replace the file with an identical one
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+attachment_storage = ContentAddressedStorage()
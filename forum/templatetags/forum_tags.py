@@ -0,0 +1,35 @@
+from django import template
+
+from forum.fragment_cache import get_or_render, post_fragment_key
+
+register = template.Library()
+
+
+class PostCacheNode(template.Node):
+    def __init__(self, nodelist, post, thread_page):
+        self.nodelist = nodelist
+        self.post = post
+        self.thread_page = thread_page
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        user = context.get('user')
+        is_staff = bool(user and user.is_authenticated and user.is_staff)
+        page = 'thread' if self.thread_page.resolve(context) else 'list'
+
+        key = post_fragment_key(post, page, 'staff' if is_staff else 'user')
+        return get_or_render(key, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def postcache(parser, token):
+    """Caches the rendered post between the tags, per post version, page type and staff/non staff user.
+       Usage: {% postcache thread thread_page %} ... {% endpostcache %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a post and the thread page flag")
+
+    nodelist = parser.parse(('endpostcache',))
+    parser.delete_first_token()
+    return PostCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
@@ -0,0 +1,119 @@
+import re
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from forum.models import Category, Thread
+from forum.page_cache import page_cache_key
+
+# the masked CSRF tokens of the forms and scripts, which differ in every response
+CSRF_TOKEN_RE = re.compile(r'\b[A-Za-z0-9]{64}\b')
+
+
+def without_csrf_tokens(response):
+    return CSRF_TOKEN_RE.sub('', response.content.decode())
+
+
+@override_settings(ROOT_URLCONF='forum.async_urls')
+class AsyncReadViewsTest(TestCase):
+    fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+        # the error pages are rendered in another thread, which does not see the test's transaction
+        Category.get_all()
+        self.thread = Thread.objects.create(subcategory_id=1, subject='First Thread', message='Hello World')
+        reply = self.reply = Thread(subcategory_id=1, message='Reply', reply_to=self.thread,
+                                    root_thread=self.thread)
+        Thread.objects.add_reply(reply)
+        Thread.objects.add_reply(Thread(subcategory_id=1, message='Nested reply', reply_to=reply,
+                                        root_thread=self.thread))
+
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    async def test_pages_match_sync_views(self):
+        for path in (reverse('home'), reverse('subcategory', kwargs={'name': 'football'}),
+                     reverse('subcategory', kwargs={'name': 'football'}) + '?sort=activity',
+                     reverse('thread_view', kwargs={'id': self.thread.id}),
+                     reverse('thread_view', kwargs={'id': self.reply.id})):
+            with self.subTest(path=path):
+                response = await self.async_client.get(path)
+                with override_settings(ROOT_URLCONF='forum.sync_urls'):
+                    sync_response = await sync_to_async(self.client.get)(path)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(without_csrf_tokens(response), without_csrf_tokens(sync_response))
+
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    async def test_pages_of_authenticated_user(self):
+        user = await User.objects.aget(username='test_user')
+        await sync_to_async(self.async_client.force_login)(user)
+
+        response = await self.async_client.get(reverse('thread_view', kwargs={'id': self.thread.id}))
+        private_response = await self.async_client.get(reverse('subcategory', kwargs={'name': 'stuffing'}))
+
+        self.assertContains(response, 'test_user')
+        self.assertEqual(private_response.status_code, 200)
+
+    async def test_page_cache(self):
+        path = reverse('thread_view', kwargs={'id': self.thread.id})
+
+        response = await self.async_client.get(path)
+        cached_response = await self.async_client.get(path)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(without_csrf_tokens(cached_response), without_csrf_tokens(response))
+        self.assertIsNotNone(await cache.aget(page_cache_key(path)))
+
+    async def test_private_subcategory_redirects_to_login(self):
+        response = await self.async_client.get(reverse('subcategory', kwargs={'name': 'stuffing'}))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'login?next=/forum/stuffing')
+
+    async def test_not_found(self):
+        thread_response = await self.async_client.get(reverse('thread_view', kwargs={'id': 1000}))
+        subcategory_response = await self.async_client.get(reverse('subcategory', kwargs={'name': 'unknown'}))
+        updated_response = await self.async_client.get(reverse('thread_get_update', kwargs={'thread_id': 1000}))
+
+        self.assertEqual(thread_response.status_code, 404)
+        self.assertEqual(subcategory_response.status_code, 404)
+        self.assertEqual(updated_response.status_code, 404)
+
+    async def test_thread_get_updated_date(self):
+        url = reverse('thread_get_update', kwargs={'thread_id': self.thread.id})
+        await cache.aclear()
+
+        response = await self.async_client.get(url)
+        not_modified = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+
+        updated_date = (await Thread.objects.aget(id=self.thread.id)).updated_date
+        self.assertEqual(response.content.decode(), str(int(updated_date.timestamp())))
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(await Thread.objects.aget_updated_dates([self.thread.id, 1000]),
+                         {self.thread.id: updated_date})
+
+
+class BenchmarkConcurrencyTest(TransactionTestCase):
+    """The benchmark's threads read the data through their own connections, so it has to be committed"""
+    fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+
+    def test_benchmark_concurrency_command(self):
+        Thread.objects.create(subcategory_id=1, subject='First Thread', message='Hello World')
+        output = StringIO()
+
+        call_command('benchmark_concurrency', '--requests', '8', '--concurrency', '4', stdout=output)
+
+        rows = [line.split() for line in output.getvalue().splitlines()[1:]]
+        self.assertEqual([row[:2] for row in rows],
+                         [[view, server] for view in ('dashboard', 'subcategory', 'thread_view',
+                                                      'thread_get_updated_date') for server in ('wsgi', 'asgi')])
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from forum.db_routers import PIN_COOKIE
+from forum.models import Category, Thread
+
+REPLICA = 'replica'
+
+
+@override_settings(FORUM_DB_REPLICAS=[REPLICA])
+class PrimaryReplicaRouterTest(TransactionTestCase):
+    """The default test database is the primary, a SQLite file the replica, replicated on demand by replicate()"""
+    fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+        self.replica_dir = tempfile.mkdtemp()
+        connections.settings[REPLICA] = connections.configure_settings({
+            'default': connections.settings['default'],
+            REPLICA: {'ENGINE': 'django.db.backends.sqlite3',
+                      'NAME': os.path.join(self.replica_dir, 'replica.sqlite3')}
+        })[REPLICA]
+        self.replicate()
+
+    def tearDown(self):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(self.replica_dir)
+
+    def replicate(self):
+        primary = connections['default']
+        primary.ensure_connection()
+        replica = sqlite3.connect(connections.settings[REPLICA]['NAME'])
+        try:
+            primary.connection.backup(replica)
+        finally:
+            replica.close()
+
+    def test_reads_from_replica_and_writes_to_primary(self):
+        thread = Thread.objects.create(subcategory_id=1, subject='First Thread', message='Hello World')
+
+        self.assertFalse(Thread.objects.filter(id=thread.id).exists())
+        self.assertTrue(Thread.objects.using('default').filter(id=thread.id).exists())
+        with transaction.atomic():
+            self.assertEqual(Thread.objects.get_by_id(thread.id), thread)
+
+        self.replicate()
+        self.assertEqual(Thread.objects.get_by_id(thread.id), thread)
+        self.assertEqual(Thread.objects.get_latest(['id']), [(thread.id,)])
+
+    def test_client_reads_its_writes(self):
+        thread = Thread.objects.create(subcategory_id=1, subject='First Thread', message='Hello World')
+        self.replicate()
+        thread_url = reverse('thread_view', kwargs={'id': thread.id})
+        poster, reader = Client(), Client()
+        reader.get(thread_url)
+
+        response = poster.post(reverse('thread_reply', kwargs={'root_id': thread.id}),
+                               data={'subcategory': 1, 'subject': 'First Thread', 'message': 'Reply message'})
+        poster_page = poster.get(thread_url)
+        reader_page = reader.get(thread_url)
+
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+        self.assertContains(poster_page, 'Reply message')
+        self.assertNotContains(reader_page, 'Reply message')
+        self.assertNotIn(PIN_COOKIE, reader_page.cookies)
+
+        self.replicate()
+        # the page read from the replica is cached only while the replica may lag behind the reply
+        with patch('time.time', return_value=time.time() + 10):
+            self.assertContains(reader.get(thread_url), 'Reply message')
+
+    def test_login_pins_to_primary(self):
+        private_url = reverse('subcategory', kwargs={'name': 'stuffing'})
+
+        response = self.client.post(reverse('login'), data={'username': 'test_user', 'password': 'password'})
+        pinned_response = self.client.get(private_url)
+        del self.client.cookies[PIN_COOKIE]
+        unpinned_response = self.client.get(private_url)
+
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(pinned_response.status_code, 200)
+        # the replica does not have the session yet
+        self.assertEqual(unpinned_response.status_code, 302)
+
+    @override_settings(FORUM_DB_REPLICAS=[])
+    def test_without_replicas(self):
+        response = self.client.post(reverse('login'), data={'username': 'test_user', 'password': 'password'})
+        thread = Thread.objects.create(subcategory_id=1, subject='First Thread', message='Hello World')
+
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(Thread.objects.get_by_id(thread.id), thread)
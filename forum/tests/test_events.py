@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from forum.events import InProcessHub, thread_event_stream
+from forum.models import Thread
+
+
+class InProcessHubTest(SimpleTestCase):
+    async def test_publish_from_other_thread(self):
+        hub = InProcessHub()
+        queue = hub.subscribe(1)
+
+        publisher = threading.Thread(target=hub.publish, args=(1, 1700000000))
+        publisher.start()
+        publisher.join()
+
+        self.assertEqual(await asyncio.wait_for(queue.get(), 1), 1700000000)
+
+    async def test_publish_keeps_latest_event(self):
+        hub = InProcessHub()
+        queue = hub.subscribe(1)
+        other_queue = hub.subscribe(2)
+
+        hub.publish(1, 1700000000)
+        hub.publish(1, 1700000005)
+        await asyncio.sleep(0)
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait(), 1700000005)
+        self.assertTrue(other_queue.empty())
+
+    async def test_unsubscribe(self):
+        hub = InProcessHub()
+        queue = hub.subscribe(1)
+
+        hub.unsubscribe(1, queue)
+
+        self.assertEqual(hub.subscriber_count(1), 0)
+
+    @override_settings(FORUM_SSE_KEEPALIVE=0.01, FORUM_SSE_MAX_AGE=1)
+    async def test_thread_event_stream(self):
+        hub = InProcessHub()
+        # the thread is unknown, so there is no current timestamp to send first
+        with patch('forum.events.get_hub', return_value=hub), \
+                patch.object(Thread.objects, 'aget_updated_date', return_value=None):
+            stream = thread_event_stream(1)
+
+            self.assertTrue((await anext(stream)).startswith('retry:'))
+            self.assertEqual(await anext(stream), ': keepalive\n\n')
+            hub.publish(1, 1700000000)
+            self.assertEqual(await anext(stream), 'event: update\ndata: 1700000000\n\n')
+
+            await stream.aclose()
+        self.assertEqual(hub.subscriber_count(1), 0)
+
+
+class ThreadEventsViewTest(TestCase):
+    fixtures = ('test_init_cat_subcat.json',)
+
+    @override_settings(FORUM_SSE_KEEPALIVE=0.01, FORUM_SSE_MAX_AGE=1)
+    async def test_thread_event_stream_sends_current_timestamp(self):
+        thread = await Thread.objects.acreate(subcategory_id=1, subject="First Thread", message="Hello World")
+        stream = thread_event_stream(thread.id)
+
+        await anext(stream)
+        first_event = await anext(stream)
+        await stream.aclose()
+
+        self.assertEqual(first_event, f'event: update\ndata: {int(thread.updated_date.timestamp())}\n\n')
+
+    def test_thread_events_without_asgi(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+
+        response = self.client.get(reverse('thread_events', kwargs={'thread_id': thread.id}))
+
+        self.assertEqual(response.status_code, 204)
+
+    @patch('forum.events.get_hub')
+    def test_thread_reply_publishes_update(self, mock_get_hub):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        reply_request = {'subcategory': '1', 'subject': 'Subject name', 'message': 'message content',
+                         'reply_to': thread.id}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('thread_reply', kwargs={'root_id': thread.id}), data=reply_request)
+
+        updated_timestamp = int(Thread.objects.get_by_id(thread.id).updated_date.timestamp())
+        mock_get_hub.return_value.publish.assert_called_once_with(thread.id, updated_timestamp)
+
+    @patch('forum.events.get_hub')
+    def test_thread_edit_message_publishes_update(self, mock_get_hub):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('thread_edit_message', kwargs={'thread_id': thread.id}),
+                             data={"newMessage": "New message"}, content_type='application/json',
+                             HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        mock_get_hub.return_value.publish.assert_called_once()
+        self.assertEqual(mock_get_hub.return_value.publish.call_args.args[0], thread.id)
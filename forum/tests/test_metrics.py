@@ -0,0 +1,96 @@
+import re
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from forum.metrics import Histogram, MetricsRegistry, RequestSample, registry
+from forum.models import Category, Thread
+
+
+class MetricsRegistryTest(SimpleTestCase):
+    def test_histogram_buckets_inclusive(self):
+        histogram = Histogram((1, 5))
+
+        for value in (0, 1, 3, 5, 7):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [2, 2, 1])
+        self.assertEqual((histogram.sum, histogram.count), (16, 5))
+
+    def test_render_prometheus_text(self):
+        metrics = MetricsRegistry()
+        sample = RequestSample()
+        sample.duration = 0.003
+        sample.db_queries = 2
+        sample.cache[('page', 'hit')] += 1
+
+        metrics.observe('thread_view', sample)
+        metrics.observe('thread_view', sample)
+        text = metrics.render()
+
+        self.assertIn('# TYPE forum_request_duration_seconds histogram', text)
+        self.assertIn('forum_request_duration_seconds_bucket{view="thread_view",le="0.0025"} 0', text)
+        self.assertIn('forum_request_duration_seconds_bucket{view="thread_view",le="0.005"} 2', text)
+        self.assertIn('forum_request_duration_seconds_bucket{view="thread_view",le="+Inf"} 2', text)
+        self.assertIn('forum_db_queries_sum{view="thread_view"} 4', text)
+        self.assertIn('forum_cache_requests_total{view="thread_view",cache="page",result="hit"} 2', text)
+
+
+class MetricsMiddlewareTest(TestCase):
+    fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+        registry.reset()
+
+    def metric(self, line_start):
+        match = re.search('^' + re.escape(line_start) + r' (\S+)$', registry.render(), re.MULTILINE)
+        return float(match.group(1)) if match else None
+
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    def test_request_measured_per_view(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+
+        self.client.get(reverse('thread_view', kwargs={'id': thread.id}))
+        self.client.get(reverse('thread_view', kwargs={'id': thread.id}))
+
+        self.assertEqual(self.metric('forum_request_duration_seconds_count{view="thread_view"}'), 2)
+        self.assertGreater(self.metric('forum_db_queries_sum{view="thread_view"}'), 0)
+        self.assertGreater(self.metric('forum_db_duration_seconds_sum{view="thread_view"}'), 0)
+        self.assertGreater(self.metric('forum_template_duration_seconds_sum{view="thread_view"}'), 0)
+        self.assertEqual(
+            self.metric('forum_cache_requests_total{view="thread_view",cache="fragment",result="miss"}'), 1)
+        self.assertEqual(
+            self.metric('forum_cache_requests_total{view="thread_view",cache="fragment",result="hit"}'), 1)
+
+    def test_page_cache_lookups_counted(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+
+        self.assertEqual(self.metric('forum_cache_requests_total{view="home",cache="page",result="miss"}'), 1)
+        self.assertEqual(self.metric('forum_cache_requests_total{view="home",cache="page",result="hit"}'), 1)
+        self.assertEqual(self.metric('forum_db_queries_bucket{view="home",le="0"}'), 1)
+
+    def test_unresolved_request(self):
+        self.client.get('/no/such/page')
+
+        self.assertEqual(self.metric('forum_request_duration_seconds_count{view="unresolved"}'), 1)
+
+    @override_settings(FORUM_METRICS_SAMPLE_RATE=0)
+    def test_requests_not_sampled(self):
+        self.client.get(reverse('home'))
+
+        self.assertIsNone(self.metric('forum_request_duration_seconds_count{view="home"}'))
+
+    def test_metrics_endpoint_staff_only(self):
+        response = self.client.get(reverse('request_metrics'))
+        self.client.login(username='admin', password='admin')
+        staff_response = self.client.get(reverse('request_metrics'))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(staff_response.status_code, 200)
+        self.assertTrue(staff_response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(staff_response, 'forum_request_duration_seconds_count{view="request_metrics"} 1')
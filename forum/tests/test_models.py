@@ -1,17 +1,43 @@
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
 from os import remove
 from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
-from django.test import TestCase
-
-from forum.models import Category, Subcategory, Thread
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from forum.fragment_cache import post_fragment_key
+from forum.models import (CATEGORIES_VERSION_KEY, Category, Subcategory, Thread, updated_date_buffer,
+                           updated_date_cache_key)
+from forum.page_cache import DASHBOARD_SCOPE, generation_key, subcategory_scope, thread_scope
+from forum.pagination import decode_cursor
+from forum.search import SEARCH_TABLE
+from forum.signals import _create_thread_thumbnails_task
+from forum.thumbnails import thumbnail_name
 
 
 class ModelsTest(TestCase):
     fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
 
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+
     def test_categories_exist(self):
         categories = Category.objects.all()
 
@@ -29,24 +55,54 @@ class ModelsTest(TestCase):
         self.assertEqual(len(subcategories), 2)
         self.assertEqual(subcategories[0].name, 'Football')
 
-    def test_get_categories_and_set_cache(self):
-        self.assertFalse(cache.get('categories'))
+    def test_get_categories_plain_data(self):
+        categories = Category.get_all()
+
+        self.assertIsInstance(categories, tuple)
+        self.assertEqual(len(categories), 4)
+        self.assertEqual(categories[0].name, 'Hobbies')
+        self.assertEqual(categories[0].subcategories[0].name, 'Football')
+        self.assertEqual(categories[0].subcategories[0].slug, 'football')
+        self.assertTrue(categories[3].auth_required)
+
+    def test_get_categories_from_local_memo(self):
+        categories = Category.get_all()
+
+        with self.assertNumQueries(0), patch('django.core.cache.cache.get') as mock_cache_get:
+            self.assertIs(Category.get_all(), categories)
+        mock_cache_get.assert_not_called()
 
+    def test_get_categories_from_shared_cache(self):
         categories = Category.get_all()
+        Category._memo = None
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Category.get_all(), categories)
+
+    def test_get_categories_invalidated_on_change(self):
+        Category.get_all()
+        category = Category.objects.get(id=1)
+        category.name = 'Sports'
+        category.save()
 
-        self.assertTrue(categories)
-        self.assertTrue(cache.get('categories'))
+        self.assertEqual(Category.get_all()[0].name, 'Sports')
 
-    @patch('django.core.cache.cache.get')
-    def test_get_categories_from_cache(self, mock_get_all_categories):
-        categories = [Category(id=1, name='first'), Category(id=2, name='second')]
-        mock_get_all_categories.return_value = categories
+    @override_settings(FORUM_CATEGORIES_LOCAL_TTL=0)
+    def test_get_categories_version_bumped_by_other_process(self):
+        Category.get_all()
+        Subcategory.objects.filter(id=1).update(name='Soccer', slug='soccer')
+        cache.set(CATEGORIES_VERSION_KEY, 'other-process-version')
 
-        actual_categories = Category.get_all()
+        self.assertEqual(Category.get_all()[0].subcategories[0].name, 'Soccer')
+        self.assertEqual(Subcategory.get_by_name('soccer').id, 1)
 
-        mock_get_all_categories.assert_called_once_with('categories')
-        self.assertEqual(actual_categories, categories)
-        self.assertTrue(cache.get('categories'))
+    def test_get_categories_versions_expire(self):
+        Category.get_all()
+        version = cache.get(CATEGORIES_VERSION_KEY)
+
+        with patch('time.time', return_value=time.time() + settings.FORUM_CATEGORIES_TIMEOUT + 1):
+            self.assertIsNone(cache.get(f'categories:{version}'))
+            self.assertEqual(cache.get(CATEGORIES_VERSION_KEY), version)
 
     def test_subcategory_by_id(self):
         subcategory = Subcategory.objects.get(id=3)
@@ -57,7 +113,38 @@ class ModelsTest(TestCase):
         subcategory = Subcategory.get_by_name('linux')
 
         self.assertTrue(subcategory)
-        self.assertTrue(cache.get('categories'))
+        with self.assertNumQueries(0):
+            self.assertEqual(Subcategory.get_by_name('Linux'), subcategory)
+            self.assertFalse(subcategory.auth_required)
+
+    def test_subcategory_get_by_name_created_later(self):
+        Subcategory.get_by_name('linux')
+        Subcategory.objects.bulk_create([Subcategory(category_id=1, name='Rugby', slug='rugby')])
+
+        self.assertEqual(Subcategory.get_by_name('rugby').name, 'Rugby')
+
+    def test_subcategory_name_map_refreshed_on_change(self):
+        Subcategory.get_by_name('linux')
+        subcategory = Subcategory.objects.get(name='Linux')
+        subcategory.name = 'GNU Linux'
+        subcategory.save()
+
+        self.assertFalse(Subcategory.get_by_name('linux'))
+        self.assertEqual(Subcategory.get_by_name('gnu linux').id, subcategory.id)
+
+    def test_subcategory_slug(self):
+        subcategory = Subcategory(category_id=1, name='Water Polo')
+        subcategory.save()
+
+        self.assertEqual(subcategory.slug, 'water polo')
+
+    def test_subcategory_duplicate_name_rejected(self):
+        subcategory = Subcategory(category_id=2, name='LINUX')
+
+        with self.assertRaises(ValidationError):
+            subcategory.full_clean()
+        with self.assertRaises(IntegrityError):
+            subcategory.save()
 
     def test_subcategory_get_by_name_not_found(self):
         subcategory = Subcategory.get_by_name('Unknown')
@@ -77,6 +164,8 @@ class ModelsTest(TestCase):
         self.assertEqual(actual_thread.file_name, 'python.txt')
 
         remove(actual_thread.file.path)
+        # the empty content hash directories
+        os.removedirs(os.path.dirname(actual_thread.file.path))
 
     def test_thread_add_reply(self):
         thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
@@ -104,6 +193,77 @@ class ModelsTest(TestCase):
 
         self.assertEqual(db_reply.direct_replies[0].message, 'Just to add something else')
 
+    def test_thread_add_reply_updates_counters(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+
+        Thread.objects.add_reply(Thread(subcategory_id=1, message='First reply', author_name='Ana',
+                                        reply_to_id=thread.id, root_thread_id=thread.id))
+        last_reply = Thread(subcategory_id=1, message='Second reply', reply_to_id=thread.id, root_thread_id=thread.id)
+        updated_date = Thread.objects.add_reply(last_reply)
+
+        thread.refresh_from_db()
+        self.assertEqual(thread.reply_count, 2)
+        self.assertEqual(thread.last_reply_id, last_reply.id)
+        self.assertEqual(thread.last_reply_at, last_reply.created_date)
+        self.assertEqual(thread.last_reply_author, '')
+        self.assertEqual(thread.updated_date, updated_date)
+        self.assertEqual(Thread.objects.get_updated_date(thread.id), updated_date)
+
+    def test_repair_reply_counters_command(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+        without_replies = Thread(subcategory_id=1, subject='Second Thread', message='Hello World', reply_count=3)
+        without_replies.save()
+        replies = [Thread(subcategory_id=1, message=f'Reply {number}', author_name=f'Author {number}',
+                          reply_to_id=thread.id, root_thread_id=thread.id) for number in range(3)]
+        for reply in replies:
+            reply.save()
+
+        call_command('repair_reply_counters', '--batch-size', '1', stdout=StringIO())
+
+        thread.refresh_from_db()
+        without_replies.refresh_from_db()
+        self.assertEqual(thread.reply_count, 3)
+        self.assertEqual(thread.last_reply_id, replies[-1].id)
+        self.assertEqual(thread.last_reply_at, replies[-1].created_date)
+        self.assertEqual(thread.last_reply_author, 'Author 2')
+        self.assertEqual(without_replies.reply_count, 0)
+        self.assertIsNone(without_replies.last_reply_id)
+
+    def test_refresh_reply_counters_breaks_date_ties_by_id(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+        replies = [Thread(subcategory_id=1, message=f'Reply {number}', author_name=f'Author {number}',
+                          reply_to_id=thread.id, root_thread_id=thread.id) for number in range(2)]
+        for reply in replies:
+            reply.save()
+        Thread.objects.filter(root_thread=thread).update(created_date=replies[0].created_date)
+
+        with self.assertNumQueries(1):
+            Thread.objects.refresh_reply_counters([thread.id])
+
+        thread.refresh_from_db()
+        self.assertEqual(thread.reply_count, 2)
+        self.assertEqual(thread.last_reply_id, replies[1].id)
+        self.assertEqual(thread.last_reply_author, 'Author 1')
+
+    def test_thread_get_subcategory_latest_by_activity(self):
+        threads = []
+        for number in range(3):
+            thread = Thread(subcategory_id=1, subject=f'Thread {number}', message='Hello World')
+            thread.save()
+            threads.append(thread)
+        Thread.objects.add_reply(Thread(subcategory_id=1, message='Reply', reply_to_id=threads[0].id,
+                                        root_thread_id=threads[0].id))
+
+        first_page = Thread.objects.get_subcategory_latest(1, limit=2, by_activity=True)
+        second_page = Thread.objects.get_subcategory_latest(1, before=decode_cursor(first_page.older_cursor),
+                                                            limit=2, by_activity=True)
+
+        self.assertEqual([thread.id for thread in first_page.items], [threads[0].id, threads[2].id])
+        self.assertEqual([thread.id for thread in second_page.items], [threads[1].id])
+
     def test_thread_get_latest(self):
         for i in range(1, 6):
             thread = Thread(subcategory_id=i, subject='Thread ' + str(i), message='Hello World')
@@ -120,6 +280,39 @@ class ModelsTest(TestCase):
 
         self.assertTrue(len(latest_threads) == 5)
 
+    def test_thread_get_subcategory_latest_pages(self):
+        for i in range(1, 6):
+            Thread(subcategory_id=1, subject='Thread ' + str(i), message='Hello World').save()
+        Thread(subcategory_id=2, subject='Other subcategory', message='Hello World').save()
+
+        first_page = Thread.objects.get_subcategory_latest(1, limit=2)
+        second_page = Thread.objects.get_subcategory_latest(1, before=decode_cursor(first_page.older_cursor), limit=2)
+        last_page = Thread.objects.get_subcategory_latest(1, before=decode_cursor(second_page.older_cursor), limit=2)
+        newer_page = Thread.objects.get_subcategory_latest(1, after=decode_cursor(last_page.newer_cursor), limit=2)
+
+        self.assertEqual([thread.subject for thread in first_page.items], ['Thread 5', 'Thread 4'])
+        self.assertIsNone(first_page.newer_cursor)
+        self.assertEqual([thread.subject for thread in second_page.items], ['Thread 3', 'Thread 2'])
+        self.assertEqual([thread.subject for thread in last_page.items], ['Thread 1'])
+        self.assertIsNone(last_page.older_cursor)
+        self.assertEqual([thread.subject for thread in newer_page.items], ['Thread 3', 'Thread 2'])
+
+    def test_thread_get_subcategory_latest_stable_cursor(self):
+        for i in range(1, 4):
+            Thread(subcategory_id=1, subject='Thread ' + str(i), message='Hello World').save()
+        first_page = Thread.objects.get_subcategory_latest(1, limit=2)
+
+        Thread(subcategory_id=1, subject='New Thread', message='Hello World').save()
+        second_page = Thread.objects.get_subcategory_latest(1, before=decode_cursor(first_page.older_cursor), limit=2)
+
+        self.assertEqual([thread.subject for thread in second_page.items], ['Thread 1'])
+
+    def test_cursor_decode_invalid(self):
+        self.assertIsNone(decode_cursor('invalid'))
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor('1_9999999999999999999999999'))
+        self.assertEqual(decode_cursor(f'0_{2 ** 63 - 1}')[1], 2 ** 63 - 1)
+
     def test_thread_recent_root_replies(self):
         thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
         thread.save()
@@ -140,6 +333,56 @@ class ModelsTest(TestCase):
         self.assertEqual(thread.recent_root_replies[0].subject, 'Second Reply')
         self.assertEqual(thread.recent_root_replies[1].subject, 'Third Reply')
 
+    def test_thread_preload_recent_replies(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+        replies = []
+        for i in range(1, 4):
+            reply = Thread(subcategory_id=1, subject='Reply ' + str(i), message='Just to add something',
+                           reply_to_id=thread.id, root_thread_id=thread.id)
+            reply.save()
+            replies.append(reply)
+        reply_on_reply = Thread(subcategory_id=1, message='Just to add something else',
+                                reply_to_id=replies[2].id, root_thread_id=thread.id)
+        reply_on_reply.save()
+
+        with self.assertNumQueries(2):
+            threads = Thread.objects.preload_recent_replies([thread])
+            recent_replies = threads[0].recent_root_replies
+            direct_replies = threads[0].direct_replies
+            recent_direct_replies = recent_replies[0].direct_replies
+
+        self.assertEqual([reply.id for reply in recent_replies], [replies[2].id, reply_on_reply.id])
+        self.assertEqual([reply.id for reply in direct_replies], [reply.id for reply in replies])
+        self.assertEqual([reply.id for reply in recent_direct_replies], [reply_on_reply.id])
+
+    def test_thread_get_thread_tree(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+        first_reply = Thread(subcategory_id=1, message='First reply', reply_to_id=thread.id, root_thread_id=thread.id)
+        first_reply.save()
+        second_reply = Thread(subcategory_id=1, message='Second reply', reply_to_id=first_reply.id,
+                              root_thread_id=thread.id)
+        second_reply.save()
+        Thread(subcategory_id=1, subject='Other Thread', message='Hello World').save()
+
+        with self.assertNumQueries(1):
+            tree = Thread.objects.get_thread_tree(thread.id)
+            root_replies = tree.root_replies
+            direct_replies = tree.direct_replies
+            reply_direct_replies = root_replies[0].direct_replies
+            subcategory_name = tree.subcategory.name
+
+        self.assertEqual([reply.id for reply in root_replies], [first_reply.id, second_reply.id])
+        self.assertEqual([reply.id for reply in direct_replies], [first_reply.id])
+        self.assertEqual([reply.id for reply in reply_direct_replies], [second_reply.id])
+        self.assertEqual(root_replies[1].direct_replies, [])
+        self.assertEqual(subcategory_name, 'Football')
+
+    def test_thread_get_thread_tree_not_found(self):
+        with self.assertRaises(Thread.DoesNotExist):
+            Thread.objects.get_thread_tree(1)
+
     def test_user_exists(self):
         db_user = User.objects.get(username='test_user')
         self.assertTrue(db_user.id)
@@ -156,6 +399,29 @@ class ModelsTest(TestCase):
         updated_thread = Thread.objects.get_by_id(thread.id)
         self.assertNotEquals(updated_thread.updated_date, thread.updated_date)
 
+    def test_thread_get_updated_date_cached(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Thread.objects.get_updated_date(thread.id), thread.updated_date)
+            self.assertEqual(Thread.objects.get_updated_date(thread.id), thread.updated_date)
+
+        Thread.objects.update_message(thread.id, 'New Message')
+        with self.assertNumQueries(0):
+            updated_date = Thread.objects.get_updated_date(thread.id)
+        self.assertEqual(updated_date, Thread.objects.get_by_id(thread.id).updated_date)
+
+    def test_thread_get_updated_date_created_after_miss(self):
+        self.assertIsNone(Thread.objects.get_updated_date(1))
+
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Thread.objects.get_updated_date(thread.id), thread.updated_date)
+
     def test_thread_update_message(self):
         new_message = 'New Message'
         thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
@@ -167,13 +433,386 @@ class ModelsTest(TestCase):
         self.assertEquals(updated_thread.message, new_message)
 
     def test_thread_file_is_not_file_image(self):
-        thread_file = ContentFile('someContent', 'thread_files/java.txt')
+        thread_file = ContentFile('someContent', 'java.txt')
         thread = Thread(file=thread_file)
+        thread.detect_file_metadata()
 
         self.assertFalse(thread.is_file_image)
+        self.assertEqual(thread.file_mime_type, 'text/plain')
+        self.assertEqual(thread.file_size, 11)
+        self.assertIsNone(thread.file_width)
 
     def test_thread_file_is_file_image(self):
-        thread_file = ContentFile('someContent', 'thread_files/scale.jpg')
+        with open(os.path.join(settings.MEDIA_ROOT, 'thread_files', 'scale.jpg'), 'rb') as image:
+            thread_file = ContentFile(image.read(), 'scale.jpg')
         thread = Thread(file=thread_file)
+        thread.detect_file_metadata()
 
         self.assertTrue(thread.is_file_image)
+        self.assertEqual(thread.file_mime_type, 'image/jpeg')
+        self.assertEqual((thread.file_width, thread.file_height), (1200, 1100))
+        self.assertEqual(thread.file_size, thread_file.size)
+
+    def test_backfill_file_metadata_command(self):
+        image_thread = Thread(subcategory_id=1, message='Image', file='thread_files/scale.jpg')
+        image_thread.save()
+        text_thread = Thread(subcategory_id=1, message='Text', file='thread_files/java.txt')
+        text_thread.save()
+        missing_thread = Thread(subcategory_id=1, message='Missing', file='thread_files/missing.txt')
+        missing_thread.save()
+
+        call_command('backfill_file_metadata', stdout=StringIO(), stderr=StringIO())
+
+        image_thread.refresh_from_db()
+        text_thread.refresh_from_db()
+        missing_thread.refresh_from_db()
+        self.assertTrue(image_thread.file_is_image)
+        self.assertEqual(image_thread.file_width, 1200)
+        self.assertFalse(text_thread.file_is_image)
+        self.assertEqual(text_thread.file_mime_type, 'text/plain')
+        self.assertEqual(missing_thread.file_mime_type, '')
+
+    def test_thread_thumbnail_url_falls_back_to_original(self):
+        thread = Thread(file='thread_files/scale.jpg', file_is_image=True)
+
+        self.assertEqual(thread.small_thumbnail_url, '/media/thread_files/scale.jpg')
+
+        thread.has_thumbnails = True
+        self.assertEqual(thread.small_thumbnail_url, '/media/thread_thumbnails/256/thread_files/scale.jpg')
+        self.assertEqual(thread.large_thumbnail_url, '/media/thread_thumbnails/1024/thread_files/scale.jpg')
+
+    @patch('forum.signals.get_thumbnail_executor')
+    def test_thread_thumbnails_scheduled_on_commit(self, mock_get_executor):
+        with self.captureOnCommitCallbacks(execute=True):
+            image_thread = Thread(subcategory_id=1, message='Image', file='thread_files/scale.jpg', file_is_image=True)
+            image_thread.save()
+            Thread(subcategory_id=1, message='Text', file='thread_files/java.txt').save()
+
+        mock_get_executor.return_value.submit.assert_called_once_with(
+            _create_thread_thumbnails_task, image_thread.id, 'thread_files/scale.jpg')
+
+    def test_generate_thumbnails_command(self):
+        source = os.path.join(settings.MEDIA_ROOT, 'thread_files', 'scale.jpg')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'thread_files'))
+            shutil.copy(source, os.path.join(media_root, 'thread_files'))
+            thread = Thread(subcategory_id=1, message='Image', file='thread_files/scale.jpg', file_is_image=True)
+            thread.save()
+            scopes = (thread_scope(thread.id), subcategory_scope('football'))
+            cache.set_many({generation_key(scope): 1 for scope in scopes})
+
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('generate_thumbnails', '--workers', '1', stdout=StringIO())
+
+            thread.refresh_from_db()
+            self.assertTrue(thread.has_thumbnails)
+            for scope in scopes:
+                self.assertGreater(cache.get(generation_key(scope)), 1)
+            for size in settings.FORUM_THUMBNAIL_SIZES:
+                with Image.open(os.path.join(media_root, thumbnail_name(thread.file.name, size))) as thumbnail:
+                    self.assertEqual(max(thumbnail.size), size)
+
+    def test_thread_files_stored_by_content(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            first = Thread(subcategory_id=1, message='First', file=ContentFile(b'same content', 'meme.JPG'))
+            first.save()
+            second = Thread(subcategory_id=1, message='Second', file=ContentFile(b'same content', 'copy.jpg'))
+            second.save()
+            other = Thread(subcategory_id=1, message='Other', file=ContentFile(b'other content', 'meme.jpg'))
+            other.save()
+
+            self.assertRegex(first.file.name, r'^thread_files/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+            self.assertEqual(second.file.name, first.file.name)
+            self.assertNotEqual(other.file.name, first.file.name)
+            self.assertEqual((first.file_name, second.file_name), ('meme.JPG', 'copy.jpg'))
+            with first.file.open('rb'):
+                self.assertEqual(first.file.read(), b'same content')
+            stored = [name for _, _, names in os.walk(media_root) for name in names]
+            self.assertEqual(len(stored), 2)
+
+    @override_settings(FORUM_ATTACHMENT_REUSE_GRACE=0)
+    def test_thread_file_deleted_with_last_reference(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            first = Thread(subcategory_id=1, message='First', file=ContentFile(b'shared', 'shared.txt'))
+            first.save()
+            second = Thread(subcategory_id=1, message='Second', file=ContentFile(b'shared', 'shared.txt'))
+            second.save()
+            path = first.file.path
+
+            with self.captureOnCommitCallbacks(execute=True):
+                first.delete()
+            self.assertTrue(os.path.exists(path))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                second.delete()
+            self.assertFalse(os.path.exists(path))
+
+    def test_thread_file_of_fresh_upload_kept(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            thread = Thread(subcategory_id=1, message='First', file=ContentFile(b'fresh', 'fresh.txt'))
+            thread.save()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                thread.delete()
+
+            self.assertTrue(os.path.exists(thread.file.path))
+
+    def test_dedupe_attachments_command(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'thread_files'))
+            for name in ('cat.png', 'cat_copy.png', 'dog.png'):
+                with open(os.path.join(media_root, 'thread_files', name), 'wb') as file:
+                    file.write(b'dog' if name == 'dog.png' else b'cat')
+            cat = Thread.objects.create(subcategory_id=1, message='Cat', file='thread_files/cat.png')
+            copy = Thread.objects.create(subcategory_id=1, message='Copy', file='thread_files/cat_copy.png')
+            dog = Thread.objects.create(subcategory_id=1, message='Dog', file='thread_files/dog.png')
+            missing = Thread.objects.create(subcategory_id=1, message='Missing', file='thread_files/missing.png')
+
+            fragment_key = post_fragment_key(cat)
+
+            output = StringIO()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('dedupe_attachments', stdout=output, stderr=StringIO())
+
+            for thread in (cat, copy, dog, missing):
+                thread.refresh_from_db()
+            # the cached fragments and pages linking to the old names are not served anymore
+            self.assertNotEqual(post_fragment_key(cat), fragment_key)
+            self.assertIsNotNone(cache.get(generation_key(thread_scope(cat.id))))
+            self.assertIsNone(cache.get(generation_key(thread_scope(missing.id))))
+            self.assertIn('Moved 3 files, 1 of them duplicates freeing 3 bytes, 1 files not found', output.getvalue())
+            self.assertTrue(Thread.file.field.storage.is_content_name(cat.file.name))
+            self.assertEqual(copy.file.name, cat.file.name)
+            self.assertNotEqual(dog.file.name, cat.file.name)
+            self.assertEqual((cat.file_name, copy.file_name), ('cat.png', 'cat_copy.png'))
+            self.assertEqual(missing.file.name, 'thread_files/missing.png')
+            self.assertEqual(sorted(os.listdir(os.path.join(media_root, 'thread_files'))),
+                             [cat.file.name.split('/')[1], dog.file.name.split('/')[1]])
+            with cat.file.open('rb'):
+                self.assertEqual(cat.file.read(), b'cat')
+
+    def test_thread_search_ranks_subject_first(self):
+        message_match = Thread(subcategory_id=1, subject='Match report', message='The goalkeeper saved a penalty')
+        message_match.save()
+        subject_match = Thread(subcategory_id=1, subject='Penalty rules', message='How are they decided?')
+        subject_match.save()
+        Thread(subcategory_id=1, subject='Transfers', message='Nothing to see').save()
+
+        threads, has_next = Thread.objects.search('penalty')
+
+        self.assertEqual([thread.id for thread in threads], [subject_match.id, message_match.id])
+        self.assertEqual(threads[0].subcategory_name, 'Football')
+        self.assertFalse(has_next)
+
+    def test_thread_search_prefix_and_invalid_syntax(self):
+        Thread(subcategory_id=4, subject='Kernel', message='Compiling the kernel modules').save()
+
+        self.assertEqual(len(Thread.objects.search('compil')[0]), 1)
+        self.assertEqual(len(Thread.objects.search('"kernel" -(')[0]), 1)
+        self.assertEqual(Thread.objects.search('*:()'), ([], False))
+
+    def test_thread_search_filters(self):
+        Thread(subcategory_id=1, subject='Ball', message='Football ball').save()
+        Thread(subcategory_id=4, subject='Ball', message='Linux ball').save()
+        Thread(subcategory_id=8, subject='Ball', message='Private ball').save()
+
+        self.assertEqual(len(Thread.objects.search('ball')[0]), 2)
+        self.assertEqual(len(Thread.objects.search('ball', include_private=True)[0]), 3)
+        self.assertEqual([thread.subcategory_id for thread in Thread.objects.search('ball', subcategory_id=4)[0]], [4])
+
+    def test_thread_search_pages(self):
+        for number in range(5):
+            Thread(subcategory_id=1, subject=f'Match {number}', message='Result').save()
+
+        first_page, first_has_next = Thread.objects.search('match', limit=3)
+        second_page, second_has_next = Thread.objects.search('match', page=2, limit=3)
+
+        self.assertEqual((len(first_page), first_has_next), (3, True))
+        self.assertEqual((len(second_page), second_has_next), (2, False))
+        self.assertFalse({thread.id for thread in first_page} & {thread.id for thread in second_page})
+
+    def test_thread_search_index_follows_changes(self):
+        thread = Thread(subcategory_id=1, subject='Match', message='Old message')
+        thread.save()
+
+        Thread.objects.update_message(thread.id, 'Edited message')
+        self.assertEqual(Thread.objects.search('old'), ([], False))
+        self.assertEqual(len(Thread.objects.search('edited')[0]), 1)
+
+        thread.delete()
+        self.assertEqual(Thread.objects.search('edited'), ([], False))
+
+    def test_rebuild_search_index_command(self):
+        thread = Thread(subcategory_id=1, subject='Match', message='Hello World')
+        thread.save()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}(rowid, subject, message) VALUES (%s, 'Stale', 'Stale')",
+                           [thread.id + 1])
+
+        call_command('rebuild_search_index', '--batch-size', '1', '--optimize', stdout=StringIO())
+
+        self.assertEqual([found.id for found in Thread.objects.search('hello')[0]], [thread.id])
+        self.assertEqual(Thread.objects.search('stale'), ([], False))
+
+    def test_seed_forum_command(self):
+        call_command('seed_forum', '--categories', '2', '--subcategories', '2', '--threads', '10', '--replies', '4',
+                     '--reply-depth', '2', '--attachments', '0.5', '--batch-size', '4', stdout=StringIO())
+
+        roots = Thread.objects.filter(subcategory__name__startswith='Seed', root_thread=None)
+        replies = Thread.objects.filter(subcategory__name__startswith='Seed', root_thread__isnull=False)
+        self.assertEqual(roots.count(), 10)
+        self.assertEqual(sum(root.reply_count for root in roots), replies.count())
+        self.assertFalse(replies.filter(reply_to__isnull=True).exists())
+        self.assertTrue(Subcategory.get_by_name('seed-1-1').auth_required)
+        self.assertTrue(Thread.objects.exclude(file_mime_type='').exists())
+
+    def test_export_import_forum_commands(self):
+        thread = Thread(subcategory_id=8, subject='First Thread', message='Hello World', file='thread_files/java.txt')
+        thread.save()
+        reply = Thread(subcategory_id=8, message='Reply', author_name='Ana', reply_to=thread, root_thread=thread)
+        Thread.objects.add_reply(reply)
+        Thread.objects.add_reply(Thread(subcategory_id=8, message='Reply on reply', reply_to=reply,
+                                        root_thread=thread))
+        Thread.objects.get_updated_date(thread.id + 3)
+
+        with tempfile.TemporaryDirectory() as export_dir:
+            export_file = os.path.join(export_dir, 'forum.jsonl.gz')
+            call_command('export_forum', export_file, stderr=StringIO())
+            call_command('import_forum', export_file, '--batch-size', '2', stderr=StringIO())
+
+        self.assertEqual(Subcategory.objects.count(), 8)
+        imported = Thread.objects.order_by('id')[3:]
+        imported_thread, imported_reply, imported_reply_on_reply = imported
+        self.assertEqual(imported_thread.id, thread.id + 3)
+        self.assertEqual(imported_thread.subcategory_id, 8)
+        self.assertEqual(imported_thread.file.name, 'thread_files/java.txt')
+        self.assertEqual(imported_thread.created_date, thread.created_date)
+        self.assertEqual(imported_reply.root_thread_id, imported_thread.id)
+        self.assertEqual(imported_reply_on_reply.reply_to_id, imported_reply.id)
+        self.assertEqual(imported_thread.reply_count, 2)
+        self.assertEqual(imported_thread.last_reply_id, imported_reply_on_reply.id)
+        self.assertEqual(Thread.objects.get_updated_date(imported_thread.id), imported_thread.updated_date)
+        self.assertEqual(len(Thread.objects.search('hello', include_private=True)[0]), 2)
+
+        new_thread = Thread(subcategory_id=1, message='After import')
+        new_thread.save()
+        self.assertGreater(new_thread.id, imported_reply_on_reply.id)
+
+    def test_import_forum_command_invalid_record(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as import_file:
+            import_file.write('{"format": "django-forum", "version": 1}\n{"model": "forum.thread", "pk": 1}\n')
+            import_file.flush()
+
+            with self.assertRaisesMessage(CommandError, 'Line 2: invalid record'):
+                call_command('import_forum', import_file.name, stderr=StringIO())
+
+
+@override_settings(FORUM_UPDATED_DATE_FLUSH_INTERVAL=60)
+class UpdatedDateBufferTest(TransactionTestCase):
+    """The bumps are written behind outside of transactions, so the test commits its writes"""
+    fixtures = ('test_init_cat_subcat.json',)
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+        self.threads = [Thread.objects.create(subcategory_id=1, subject=f'Thread {i}', message='Hello World')
+                        for i in range(3)]
+
+    def tearDown(self):
+        updated_date_buffer.stop()
+
+    def db_updated_date(self, thread):
+        return Thread.objects.filter(id=thread.id).values_list('updated_date', flat=True).get()
+
+    def test_update_date_is_written_behind(self):
+        first, second, third = self.threads
+        Thread.objects.update_date(first.id)
+        Thread.objects.update_date(second.id)
+        updated_date = Thread.objects.update_date(first.id)
+        cache.clear()
+
+        self.assertEqual(self.db_updated_date(first), first.updated_date)
+        self.assertEqual(Thread.objects.get_updated_date(first.id), updated_date)
+        self.assertEqual(Thread.objects.get_latest(['id'], limit=2), [(first.id,), (second.id,)])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(updated_date_buffer.flush(), 2)
+        # one UPDATE, then the subcategories of the pages to invalidate
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['UPDATE', 'SELECT'])
+        self.assertEqual(self.db_updated_date(first), updated_date)
+        self.assertEqual(self.db_updated_date(third), third.updated_date)
+        self.assertEqual(updated_date_buffer.flush(), 0)
+
+    def test_flush_invalidates_pages(self):
+        thread = self.threads[0]
+        Thread.objects.update_date(thread.id)
+        scopes = (DASHBOARD_SCOPE, thread_scope(thread.id), subcategory_scope('football'))
+        generations = [cache.get(generation_key(scope)) for scope in scopes]
+
+        updated_date_buffer.flush()
+
+        for scope, generation in zip(scopes, generations):
+            self.assertNotEqual(cache.get(generation_key(scope)), generation, scope)
+
+    def test_thread_page_time_after_reply_edit(self):
+        thread = self.threads[0]
+        reply = Thread(subcategory_id=1, message='Reply', reply_to=thread, root_thread=thread)
+        Thread.objects.add_reply(reply)
+        thread_url = reverse('thread_view', kwargs={'id': thread.id})
+        update_url = reverse('thread_get_update', kwargs={'thread_id': thread.id})
+        self.client.get(thread_url)
+
+        # a second later, so the page time in seconds changes
+        with patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=1)):
+            self.client.post(reverse('thread_edit_message', kwargs={'thread_id': thread.id}),
+                             data={'replyId': reply.id, 'newMessage': 'Edited'},
+                             content_type='application/json', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        page_time = self.page_time(self.client.get(thread_url))
+        updated_time = self.client.get(update_url).content.decode()
+        updated_date_buffer.flush()
+
+        self.assertEqual(page_time, updated_time)
+        self.assertEqual(self.page_time(self.client.get(thread_url)), updated_time)
+
+    @staticmethod
+    def page_time(response):
+        return re.search(r'"thread_page_time": "(\d+)"', response.content.decode()).group(1)
+
+    def test_flush_keeps_later_reply_date(self):
+        thread = self.threads[0]
+        Thread.objects.update_date(thread.id)
+        reply_date = Thread.objects.add_reply(Thread(subcategory_id=1, message='Reply', reply_to=thread,
+                                                     root_thread=thread))
+
+        updated_date_buffer.flush()
+
+        self.assertEqual(self.db_updated_date(thread), reply_date)
+
+    def test_stop_writes_pending_dates(self):
+        updated_date = Thread.objects.update_date(self.threads[0].id)
+
+        updated_date_buffer.stop()
+
+        self.assertEqual(self.db_updated_date(self.threads[0]), updated_date)
+        self.assertEqual(updated_date_buffer.latest(5), {})
+
+    @override_settings(FORUM_UPDATED_DATE_FLUSH_INTERVAL=0)
+    def test_update_date_written_at_once(self):
+        updated_date = Thread.objects.update_date(self.threads[0].id)
+
+        self.assertEqual(self.db_updated_date(self.threads[0]), updated_date)
+        self.assertEqual(updated_date_buffer.latest(5), {})
+
+    def test_benchmark_views_command_restores_threads(self):
+        before = list(Thread.objects.order_by('id').values())
+        dashboard_generation = cache.get(generation_key(DASHBOARD_SCOPE))
+
+        call_command('benchmark_views', '--views', 'thread_reply', 'thread_edit_message', '--iterations', '2',
+                     '--warmup', '1', stdout=StringIO())
+
+        self.assertEqual(updated_date_buffer.latest(5), {})
+        self.assertEqual(list(Thread.objects.order_by('id').values()), before)
+        # the benchmark's cache entries are under a prefix of its own
+        self.assertEqual(cache.get(updated_date_cache_key(self.threads[0].id)), self.threads[0].updated_date)
+        self.assertEqual(cache.get(generation_key(DASHBOARD_SCOPE)), dashboard_generation)
@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from forum.models import Category, Thread
+from forum.pagination import decode_cursor
+
+
+class QueryPlanTest(TestCase):
+    fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
+
+    @classmethod
+    def setUpTestData(cls):
+        threads = Thread.objects.bulk_create(
+            Thread(subcategory_id=subcat_id, subject=f'Thread {number}', message='Hello World')
+            for number in range(50) for subcat_id in (1, 3, 4))
+        replies = Thread.objects.bulk_create(
+            Thread(subcategory_id=thread.subcategory_id, message=f'Reply {number}', root_thread=thread, reply_to=thread)
+            for thread in threads for number in range(5))
+        Thread.objects.bulk_create(
+            Thread(subcategory_id=reply.subcategory_id, message='Reply on reply',
+                   root_thread_id=reply.root_thread_id, reply_to=reply)
+            for reply in replies[::3])
+        # the planner decides on the statistics of the seeded rows, as it would on a live database
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.thread = threads[-1]
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+
+    def assertIndexedPlans(self, run):
+        """Runs the callable and checks the query plan of every query it made,
+           none of them may scan the threads table or sort with a temporary B-tree
+        """
+        with CaptureQueriesContext(connection) as context:
+            run()
+        self.assertTrue(context.captured_queries)
+
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+                for step in plan:
+                    with self.subTest(sql=query['sql'], plan=plan):
+                        self.assertNotRegex(step, r'^SCAN forum_thread$')
+                        self.assertNotIn('TEMP B-TREE', step)
+
+    def test_get_latest_plan(self):
+        self.assertIndexedPlans(lambda: list(Thread.objects.get_latest(['id', 'subject'])))
+
+    def test_get_subcategory_latest_plan(self):
+        page = Thread.objects.get_subcategory_latest(4, limit=10)
+
+        self.assertIndexedPlans(lambda: Thread.objects.get_subcategory_latest(4, limit=10))
+        self.assertIndexedPlans(lambda: Thread.objects.get_subcategory_latest(
+            4, before=decode_cursor(page.older_cursor), limit=10))
+        self.assertIndexedPlans(lambda: Thread.objects.get_subcategory_latest(
+            4, after=decode_cursor(page.older_cursor), limit=10))
+
+    def test_get_subcategory_latest_by_activity_plan(self):
+        page = Thread.objects.get_subcategory_latest(4, limit=10, by_activity=True)
+
+        self.assertIndexedPlans(lambda: Thread.objects.get_subcategory_latest(4, limit=10, by_activity=True))
+        self.assertIndexedPlans(lambda: Thread.objects.get_subcategory_latest(
+            4, before=decode_cursor(page.older_cursor), limit=10, by_activity=True))
+        self.assertIndexedPlans(lambda: Thread.objects.get_subcategory_latest(
+            4, after=decode_cursor(page.older_cursor), limit=10, by_activity=True))
+
+    def test_get_thread_tree_plan(self):
+        self.assertIndexedPlans(lambda: Thread.objects.get_thread_tree(self.thread.id))
+
+    def test_preload_replies_plan(self):
+        threads = Thread.objects.get_subcategory_latest(4, limit=10).items
+
+        self.assertIndexedPlans(lambda: Thread.objects.preload_recent_replies(threads))
+        self.assertIndexedPlans(lambda: Thread.objects.preload_direct_replies(threads))
+
+    def test_replies_plan(self):
+        thread = Thread.objects.get_by_id(self.thread.id)
+
+        self.assertIndexedPlans(lambda: list(thread.root_replies))
+        self.assertIndexedPlans(lambda: list(thread.direct_replies))
+        self.assertIndexedPlans(lambda: list(thread.recent_root_replies))
+
+    def test_get_updated_dates_plan(self):
+        self.assertIndexedPlans(lambda: Thread.objects.get_updated_dates([self.thread.id, self.thread.id - 1]))
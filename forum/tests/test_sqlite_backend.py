@@ -0,0 +1,90 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from django.core.cache import cache
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.test import TransactionTestCase
+
+from forum.models import Category, Thread
+
+PROFILED = 'profiled'
+
+
+class SqliteBackendTest(TransactionTestCase):
+    """The tuned backend on a SQLite file, with the schema and the fixtures copied from the test database"""
+    fixtures = ('test_init_cat_subcat.json',)
+
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+        self.database_dir = tempfile.mkdtemp()
+        self.database_name = os.path.join(self.database_dir, 'forum.sqlite3')
+        connections['default'].ensure_connection()
+        database = sqlite3.connect(self.database_name)
+        try:
+            connections['default'].connection.backup(database)
+        finally:
+            database.close()
+        connections.settings[PROFILED] = connections.configure_settings({
+            'default': connections.settings['default'],
+            PROFILED: {'ENGINE': 'forum.db.backends.sqlite3', 'NAME': self.database_name,
+                       'OPTIONS': {'pragmas': {'cache_size': -2048}}}
+        })[PROFILED]
+
+    def tearDown(self):
+        connections[PROFILED].close()
+        del connections[PROFILED]
+        del connections.settings[PROFILED]
+        shutil.rmtree(self.database_dir)
+
+    def test_pragmas(self):
+        with connections[PROFILED].cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                       for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'foreign_keys')}
+
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000,
+                                   'cache_size': -2048, 'foreign_keys': 1})
+
+    def test_atomic_takes_write_lock_at_once(self):
+        other = sqlite3.connect(self.database_name, timeout=0, isolation_level=None)
+        try:
+            with transaction.atomic(using=PROFILED):
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                    other.execute('BEGIN IMMEDIATE')
+            other.execute('BEGIN IMMEDIATE')
+            other.execute('ROLLBACK')
+        finally:
+            other.close()
+
+    def test_concurrent_writers(self):
+        root = Thread.objects.using(PROFILED).create(subcategory_id=1, subject='First Thread', message='Hello World')
+        writers, replies = 16, 25
+        errors = []
+
+        def write_replies():
+            try:
+                for _ in range(replies):
+                    # reads before writing, like the form validation and counters of a reply
+                    with transaction.atomic(using=PROFILED):
+                        thread = Thread.objects.using(PROFILED).get(id=root.id)
+                        Thread.objects.using(PROFILED).create(subcategory_id=1, message='Reply',
+                                                              reply_to_id=thread.id, root_thread_id=thread.id)
+                        Thread.objects.using(PROFILED).filter(id=root.id).update(reply_count=F('reply_count') + 1)
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                connections[PROFILED].close()
+
+        threads = [threading.Thread(target=write_replies) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Thread.objects.using(PROFILED).get(id=root.id).reply_count, writers * replies)
+        self.assertEqual(Thread.objects.using(PROFILED).filter(root_thread=root).count(), writers * replies)
@@ -1,16 +1,38 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from io import StringIO
 from math import trunc
 from os import remove
+from unittest.mock import patch
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from forum.models import Thread
+from forum import archive, fragment_cache
+from forum.models import Category, Thread
+from forum.page_cache import CSRF_PLACEHOLDER, bump_page_generations, page_cache_key, thread_scope
+from forum.thumbnails import thumbnail_name
+from forum.uploads import MaxSizeUploadHandler
 
 
 class ViewTest(TestCase):
     fixtures = ('test_init_cat_subcat.json', 'test_init_user.json')
 
+    def setUp(self):
+        cache.clear()
+        Category.invalidate_cache()
+
     def test_thread_get_update_date(self):
         thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
         thread.save()
@@ -20,6 +42,69 @@ class ViewTest(TestCase):
         db_update_timestamp = int(response.content.decode('utf-8'))
         self.assertEqual(db_update_timestamp, thread_update_timestamp)
 
+    def test_thread_get_update_date_not_modified(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_get_update', kwargs={'thread_id': thread.id})
+
+        response = self.client.get(url)
+        etag_response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        modified_since_response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(etag_response.status_code, 304)
+        self.assertEqual(modified_since_response.status_code, 304)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_thread_get_update_date_changed(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_get_update', kwargs={'thread_id': thread.id})
+        etag = self.client.get(url)['ETag']
+
+        Thread.objects.update_date(thread.id)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_thread_get_update_date_not_found(self):
+        response = self.client.get(reverse('thread_get_update', kwargs={'thread_id': 1}))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_threads_get_updated_dates(self):
+        threads = []
+        for i in range(3):
+            thread = Thread(subcategory_id=1, subject="Thread " + str(i), message="Hello World")
+            thread.save()
+            threads.append(thread)
+        seen = {thread.id: trunc(thread.updated_date.timestamp()) for thread in threads}
+        seen[threads[1].id] -= 10
+        query = ','.join(f'{thread_id}:{timestamp}' for thread_id, timestamp in seen.items()) + ',999:0'
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('threads_get_updates'), {'threads': query})
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(reverse('threads_get_updates'), {'threads': query})
+
+        expected = {str(threads[1].id): trunc(threads[1].updated_date.timestamp())}
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(cached_response.json(), expected)
+
+    def test_threads_get_updated_dates_bad_request(self):
+        too_many = ','.join(f'{thread_id}:0' for thread_id in range(1, 102))
+
+        invalid_response = self.client.get(reverse('threads_get_updates'), {'threads': '1:abc'})
+        oversized_response = self.client.get(reverse('threads_get_updates'),
+                                             {'threads': '9999999999999999999999999:0'})
+        too_many_response = self.client.get(reverse('threads_get_updates'), {'threads': too_many})
+
+        self.assertEqual(invalid_response.status_code, 400)
+        self.assertEqual(oversized_response.status_code, 400)
+        self.assertEqual(too_many_response.status_code, 400)
+
     def test_thread_update_thread_message(self):
         thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
         thread.save()
@@ -122,6 +207,47 @@ class ViewTest(TestCase):
         self.assertEqual(len(response.context['threads']), 3)
         self.assertEqual(response.context['subcategory'].name, 'Skills')
 
+    @override_settings(FORUM_THREADS_PAGE_SIZE=2)
+    def test_subcategory_paginated(self):
+        for i in range(1, 4):
+            Thread(subcategory_id=3, subject="Thread " + str(i), message="Hello World").save()
+
+        response = self.client.get(reverse('subcategory', kwargs={'name': 'skills'}))
+        older_cursor = response.context['page'].older_cursor
+        older_response = self.client.get(reverse('subcategory', kwargs={'name': 'skills'}), {'before': older_cursor})
+
+        self.assertEqual(len(response.context['threads']), 2)
+        self.assertContains(response, '?before=' + older_cursor)
+        self.assertEqual(len(older_response.context['threads']), 1)
+        self.assertEqual(older_response.context['threads'][0].subject, 'Thread 1')
+        self.assertContains(older_response, '?after=' + older_response.context['page'].newer_cursor)
+
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    def test_subcategory_query_count_independent_of_threads(self):
+        def add_threads(count):
+            for i in range(count):
+                thread = Thread(subcategory_id=3, subject="Thread " + str(i), message="Hello World")
+                thread.save()
+                for j in range(3):
+                    reply = Thread(subcategory_id=3, message="Reply " + str(j), reply_to_id=thread.id,
+                                   root_thread_id=thread.id)
+                    reply.save()
+                    Thread(subcategory_id=3, message="Reply on reply", reply_to_id=reply.id,
+                           root_thread_id=thread.id).save()
+
+        def count_page_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('subcategory', kwargs={'name': 'skills'}))
+            return len(queries)
+
+        count_page_queries()
+        add_threads(2)
+        few_threads_queries = count_page_queries()
+        add_threads(8)
+        many_threads_queries = count_page_queries()
+
+        self.assertEqual(few_threads_queries, many_threads_queries)
+
     def test_subcategory_unquote_name(self):
         response = self.client.get(reverse('subcategory', kwargs={'name': 'c%2B%2B'}))
 
@@ -146,6 +272,57 @@ class ViewTest(TestCase):
         self.assertEqual(created_thread.file_name, 'django.txt')
 
         remove(created_thread.file.path)
+        # the empty content hash directories
+        os.removedirs(os.path.dirname(created_thread.file.path))
+
+    def test_thread_create_stores_file_metadata(self):
+        with open(os.path.join(settings.MEDIA_ROOT, 'thread_files', 'apple.png'), 'rb') as image:
+            file = SimpleUploadedFile('apple_upload.png', image.read())
+        thread_request = {'subcategory': 1, 'subject': 'Subject name', 'message': 'message content', 'file': file}
+
+        self.client.post(reverse('thread_create', kwargs={'subcategory_name': 'london'}), data=thread_request)
+        created_thread = Thread.objects.get_by_id(1)
+
+        self.assertTrue(created_thread.file_is_image)
+        self.assertEqual(created_thread.file_mime_type, 'image/jpeg')
+        self.assertEqual((created_thread.file_width, created_thread.file_height), (512, 512))
+        self.assertEqual(created_thread.file_size, file.size)
+
+        remove(created_thread.file.path)
+        # the empty content hash directories
+        os.removedirs(os.path.dirname(created_thread.file.path))
+
+    @override_settings(FORUM_MAX_UPLOAD_SIZE=1024)
+    def test_thread_create_rejects_too_large_file(self):
+        thread_request = {'subcategory': 1, 'subject': 'Subject name', 'message': 'message content',
+                          'file': SimpleUploadedFile('large.txt', b'x' * 1025)}
+
+        response = self.client.post(reverse('thread_create', kwargs={'subcategory_name': 'london'}),
+                                    data=thread_request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Thread.objects.exists())
+
+    @override_settings(FORUM_MAX_UPLOAD_SIZE=1024, DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_thread_create_rejects_too_large_body_before_reading_it(self):
+        with patch.object(MaxSizeUploadHandler, 'receive_data_chunk') as receive_data_chunk:
+            response = self.client.post(reverse('thread_create', kwargs={'subcategory_name': 'london'}),
+                                        data={'subcategory': 1, 'message': 'message content',
+                                              'file': SimpleUploadedFile('large.txt', b'x' * 4096)})
+
+        self.assertEqual(response.status_code, 400)
+        receive_data_chunk.assert_not_called()
+
+    def test_thread_create_shares_identical_files(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for name in ('meme.png', 'meme_again.png'):
+                self.client.post(reverse('thread_create', kwargs={'subcategory_name': 'london'}),
+                                 data={'subcategory': 1, 'message': name,
+                                       'file': SimpleUploadedFile(name, b'meme content')})
+
+            first, second = Thread.objects.order_by('id')
+            self.assertEqual(first.file.name, second.file.name)
+            self.assertEqual((first.file_name, second.file_name), ('meme.png', 'meme_again.png'))
 
     def test_thread_view(self):
         thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
@@ -158,6 +335,43 @@ class ViewTest(TestCase):
         self.assertEqual(len(response.context['categories']), 4)
         self.assertEqual(response.context['thread'].id, 1)
 
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    def test_thread_view_query_count_independent_of_replies(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+
+        def add_replies(count):
+            for i in range(count):
+                reply = Thread(subcategory_id=1, message="Reply " + str(i), reply_to_id=thread.id,
+                               root_thread_id=thread.id)
+                reply.save()
+                Thread(subcategory_id=1, message="Reply on reply", reply_to_id=reply.id,
+                       root_thread_id=thread.id).save()
+
+        def count_page_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('thread_view', kwargs={'id': thread.id}))
+            return len(queries)
+
+        count_page_queries()
+        add_replies(2)
+        few_replies_queries = count_page_queries()
+        add_replies(20)
+        many_replies_queries = count_page_queries()
+
+        self.assertEqual(few_replies_queries, many_replies_queries)
+
+    def test_thread_reply_invalid_form(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+
+        response = self.client.post(reverse('thread_reply', kwargs={'root_id': thread.id}), data={'subcategory': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'thread.html')
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual(response.context['thread'].root_replies, [])
+
     def test_thread_reply(self):
         thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
         thread.save()
@@ -172,6 +386,361 @@ class ViewTest(TestCase):
         self.assertRedirects(response, '/forum/thread/1')
         self.assertEqual(created_reply.subject, 'Subject name')
 
+    def test_subcategory_shows_reply_counters(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        reply_request = {'subcategory': '1', 'author_name': 'Author name', 'message': 'message content',
+                         'reply_to': thread.id}
+        self.client.post(reverse('thread_reply', kwargs={'root_id': thread.id}), data=reply_request)
+
+        response = self.client.get(reverse('subcategory', kwargs={'name': 'football'}), {'sort': 'activity'})
+
+        self.assertTrue(response.context['by_activity'])
+        self.assertContains(response, '1 reply,')
+        self.assertContains(response, 'last by Author name')
+
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    def test_thread_view_posts_from_fragment_cache(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        Thread(subcategory_id=1, message="First reply", reply_to_id=thread.id, root_thread_id=thread.id).save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+
+        self.client.get(url)
+        stats_before = fragment_cache.stats.as_dict()
+        response = self.client.get(url)
+        stats_after = fragment_cache.stats.as_dict()
+
+        self.assertContains(response, 'First reply')
+        self.assertEqual(stats_after['hits'] - stats_before['hits'], 2)
+        self.assertEqual(stats_after['misses'], stats_before['misses'])
+
+    @override_settings(FORUM_PAGE_CACHE_ENABLED=False)
+    def test_thread_view_fragment_invalidated_by_message_update(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+        self.client.get(url)
+
+        Thread.objects.update_message(thread.id, 'Edited message')
+        response = self.client.get(url)
+
+        self.assertContains(response, 'Edited message')
+        self.assertNotContains(response, 'Hello World')
+
+    def test_thread_view_fragment_per_staff_variant(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+        self.client.get(url)
+
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(url)
+
+        self.assertContains(response, 'showEditModal(' + str(thread.id) + ')')
+
+    def test_fragment_cache_stats(self):
+        anonymous_response = self.client.get(reverse('fragment_cache_stats'))
+        self.client.login(username='admin', password='admin')
+        staff_response = self.client.get(reverse('fragment_cache_stats'))
+
+        self.assertEqual(anonymous_response.status_code, 403)
+        self.assertEqual(set(staff_response.json()), {'hits', 'misses'})
+
+    def test_anonymous_page_cached(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(url)
+
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertContains(cached_response, 'Hello World')
+
+    def test_thread_create_invalidates_posted_subcategory(self):
+        url = reverse('subcategory', kwargs={'name': 'football'})
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('thread_create', kwargs={'subcategory_name': 'unknown'}),
+                                        data={'subcategory': 1, 'subject': 'Subject name', 'message': 'Hello'})
+
+        self.assertRedirects(response, '/forum/unknown', fetch_redirect_response=False)
+        self.assertContains(self.client.get(url), 'Subject name')
+
+    def test_authenticated_page_not_cached(self):
+        self.client.login(username='test_user', password='password')
+        self.client.get(reverse('subcategory', kwargs={'name': 'skills'}))
+
+        response = self.client.get(reverse('subcategory', kwargs={'name': 'skills'}))
+
+        self.assertTemplateUsed(response, 'subcategory.html')
+
+    def test_anonymous_page_invalidated_by_reply(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+        subcategory_url = reverse('subcategory', kwargs={'name': 'football'})
+        self.client.get(url)
+        self.client.get(subcategory_url)
+        other_thread_url = reverse('thread_view', kwargs={'id': Thread.objects.create(
+            subcategory_id=1, subject="Other Thread", message="Hello World").id})
+        self.client.get(other_thread_url)
+
+        reply_request = {'subcategory': '1', 'subject': 'First Thread', 'message': 'Brand new reply',
+                         'reply_to': thread.id}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('thread_reply', kwargs={'root_id': thread.id}), data=reply_request)
+
+        self.assertContains(self.client.get(url), 'Brand new reply')
+        self.assertContains(self.client.get(subcategory_url), 'Brand new reply')
+        with self.assertNumQueries(0):
+            self.client.get(other_thread_url)
+
+    def test_anonymous_page_cached_csrf_token(self):
+        csrf_client = Client(enforce_csrf_checks=True)
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+        Client().get(url)
+
+        response = csrf_client.get(url)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        reply_request = {'subcategory': '1', 'subject': 'First Thread', 'message': 'Reply', 'reply_to': thread.id,
+                         'csrfmiddlewaretoken': token}
+        reply_response = csrf_client.post(reverse('thread_reply', kwargs={'root_id': thread.id}), data=reply_request)
+
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        self.assertEqual(reply_response.status_code, 302)
+
+    def test_anonymous_page_stale_while_rendered_by_other_worker(self):
+        thread = Thread(subcategory_id=1, subject="First Thread", message="Hello World")
+        thread.save()
+        url = reverse('thread_view', kwargs={'id': thread.id})
+        self.client.get(url)
+
+        Thread.objects.update_message(thread.id, 'Edited message')
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_page_generations(thread_scope(thread.id))
+        cache.add(page_cache_key(url) + ':lock', 1)
+        with self.assertNumQueries(0):
+            stale_response = self.client.get(url)
+        cache.delete(page_cache_key(url) + ':lock')
+        fresh_response = self.client.get(url)
+
+        self.assertContains(stale_response, 'Hello World')
+        self.assertContains(fresh_response, 'Edited message')
+
+    def test_search(self):
+        Thread(subcategory_id=1, subject='Penalty rules', message='Hello World').save()
+        Thread(subcategory_id=8, subject='Penalty salary', message='Hello World').save()
+
+        response = self.client.get(reverse('search'), {'q': 'penalty'})
+        self.client.login(username='test_user', password='password')
+        auth_response = self.client.get(reverse('search'), {'q': 'penalty', 'subcategory': 'stuffing'})
+
+        self.assertContains(response, 'Penalty rules')
+        self.assertNotContains(response, 'Penalty salary')
+        self.assertContains(auth_response, 'Penalty salary')
+        self.assertNotContains(auth_response, 'Penalty rules')
+
+    def test_search_empty_and_invalid_page(self):
+        response = self.client.get(reverse('search'), {'q': '', 'page': 'x'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'No threads found')
+
+    def test_benchmark_views_command(self):
+        for number in range(3):
+            Thread(subcategory_id=1, subject=f'Thread {number}', message='Hello World').save()
+        output = StringIO()
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as baseline:
+            call_command('benchmark_views', '--iterations', '2', '--warmup', '1', '--save-baseline', baseline.name,
+                         stdout=output)
+            results = json.load(baseline)
+
+        self.assertEqual(set(results), {'dashboard', 'subcategory', 'thread_view', 'thread_reply',
+                                        'thread_get_updated_date', 'thread_edit_message'})
+        self.assertEqual(results['thread_view']['requests'], 2)
+        self.assertIn('p95 ms', output.getvalue())
+        self.assertEqual(Thread.objects.count(), 3)
+
+    def test_benchmark_views_command_regression(self):
+        Thread(subcategory_id=1, subject='Thread', message='Hello World').save()
+        baseline = {'thread_get_updated_date': {'p50_ms': 0.0001, 'p95_ms': 0.0001, 'queries': 0}}
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as baseline_file:
+            json.dump(baseline, baseline_file)
+            baseline_file.flush()
+            with self.assertRaisesMessage(CommandError, 'thread_get_updated_date: p95'):
+                call_command('benchmark_views', '--views', 'thread_get_updated_date', '--iterations', '2',
+                             '--baseline', baseline_file.name, stdout=StringIO())
+
+    def test_thread_archive_zip(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World', author_email='a@mail.com',
+                        file='thread_files/scale.jpg', file_is_image=True)
+        thread.save()
+        reply = Thread(subcategory_id=1, message='Reply', file='thread_files/java.txt', reply_to=thread,
+                       root_thread=thread)
+        reply.save()
+
+        response = self.client.get(reverse('thread_archive', kwargs={'thread_id': reply.id}))
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn(f'filename="thread-{thread.id}.zip"', response['Content-Disposition'])
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            posts = [json.loads(line) for line in archive.read(f'thread-{thread.id}/thread.jsonl').splitlines()]
+            with open(os.path.join(settings.MEDIA_ROOT, 'thread_files', 'java.txt'), 'rb') as attachment:
+                self.assertEqual(archive.read(f'thread-{thread.id}/attachments/{reply.id}_java.txt'),
+                                 attachment.read())
+            self.assertEqual(archive.getinfo(f'thread-{thread.id}/attachments/{thread.id}_scale.jpg').compress_type,
+                             zipfile.ZIP_STORED)
+        self.assertEqual([post['id'] for post in posts], [thread.id, reply.id])
+        self.assertNotIn('author_email', posts[0])
+
+    def test_thread_archive_chunks_bounded(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'thread_files'))
+            with open(os.path.join(media_root, 'thread_files', 'large.bin'), 'wb') as large_file:
+                large_file.write(os.urandom(20 * archive.CHUNK_SIZE))
+            thread = Thread(subcategory_id=1, message='Hello World', file='thread_files/large.bin')
+            thread.save()
+            Thread.objects.bulk_create(Thread(subcategory_id=1, message='Reply ' * 50, reply_to=thread,
+                                              root_thread=thread) for _ in range(1000))
+
+            response = self.client.get(reverse('thread_archive', kwargs={'thread_id': thread.id}))
+            chunk_sizes = [len(chunk) for chunk in response.streaming_content]
+
+        self.assertGreater(sum(chunk_sizes), 20 * archive.CHUNK_SIZE)
+        self.assertLess(max(chunk_sizes), 2 * archive.CHUNK_SIZE)
+
+    def test_thread_archive_jsonl_private(self):
+        thread = Thread(subcategory_id=8, subject='First Thread', message='Hello World')
+        thread.save()
+        url = reverse('thread_archive', kwargs={'thread_id': thread.id})
+
+        response = self.client.get(url, {'format': 'jsonl'})
+        self.client.login(username='test_user', password='password')
+        auth_response = self.client.get(url, {'format': 'jsonl'})
+
+        self.assertRedirects(response, f'/forum/login?next={url}%3Fformat%3Djsonl', fetch_redirect_response=False)
+        self.assertEqual(auth_response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(json.loads(b''.join(auth_response.streaming_content))['message'], 'Hello World')
+
+    def test_thread_archive_not_found_and_invalid_format(self):
+        thread = Thread(subcategory_id=1, subject='First Thread', message='Hello World')
+        thread.save()
+
+        self.assertEqual(self.client.get(reverse('thread_archive', kwargs={'thread_id': thread.id + 1})).status_code,
+                         404)
+        self.assertEqual(self.client.get(reverse('thread_archive', kwargs={'thread_id': thread.id}),
+                                         {'format': 'tar'}).status_code, 400)
+
+    async def test_thread_archive_asgi(self):
+        thread = await Thread.objects.acreate(subcategory_id=1, subject='First Thread', message='Hello World')
+
+        response = await self.async_client.get(reverse('thread_archive', kwargs={'thread_id': thread.id}),
+                                               {'format': 'jsonl'})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(json.loads(content)['id'], thread.id)
+
+    def test_thread_file_downloaded_with_original_name(self):
+        thread = Thread(subcategory_id=1, message='Text', file='thread_files/java.txt', file_original_name='notes.txt')
+        thread.save()
+
+        response = self.client.get(reverse('thread_view', kwargs={'id': thread.id}))
+
+        self.assertContains(response, '<a href="/media/thread_files/java.txt" download="notes.txt">notes.txt</a>',
+                            html=True)
+
+    def test_media_file_public(self):
+        Thread(subcategory_id=1, message='Text', file='thread_files/java.txt').save()
+        with open(os.path.join(settings.MEDIA_ROOT, 'thread_files', 'java.txt'), 'rb') as file:
+            content = file.read()
+
+        response = self.client.get('/media/thread_files/java.txt')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+        response.close()
+
+        not_modified = self.client.get('/media/thread_files/java.txt', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_media_file_private(self):
+        Thread(subcategory_id=8, message='Text', file='thread_files/java.txt').save()
+
+        response = self.client.get('/media/thread_files/java.txt')
+        self.client.login(username='test_user', password='password')
+        auth_response = self.client.get('/media/thread_files/java.txt')
+        auth_response.close()
+
+        self.assertRedirects(response, '/forum/login?next=/media/thread_files/java.txt', fetch_redirect_response=False)
+        self.assertEqual(auth_response.status_code, 200)
+        self.assertIn('private', auth_response['Cache-Control'])
+
+    def test_media_file_shared_by_public_thread(self):
+        Thread(subcategory_id=8, message='Private', file='thread_files/java.txt').save()
+        Thread(subcategory_id=1, message='Public', file='thread_files/java.txt').save()
+
+        response = self.client.get('/media/thread_files/java.txt')
+        response.close()
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_media_file_not_found(self):
+        Thread(subcategory_id=1, message='Missing', file='thread_files/missing.txt').save()
+
+        self.assertEqual(self.client.get('/media/thread_files/java.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/thread_files/missing.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/thread_files/../../manage.py').status_code, 404)
+
+    def test_media_file_range(self):
+        Thread(subcategory_id=1, message='Text', file='thread_files/java.txt').save()
+        with open(os.path.join(settings.MEDIA_ROOT, 'thread_files', 'java.txt'), 'rb') as file:
+            content = file.read()
+
+        partial = self.client.get('/media/thread_files/java.txt', HTTP_RANGE='bytes=2-5')
+        suffix = self.client.get('/media/thread_files/java.txt', HTTP_RANGE='bytes=-3')
+        unsatisfiable = self.client.get('/media/thread_files/java.txt', HTTP_RANGE=f'bytes={len(content)}-')
+        invalid = self.client.get('/media/thread_files/java.txt', HTTP_RANGE='bytes=5-3')
+
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), content[2:6])
+        self.assertEqual(partial['Content-Range'], f'bytes 2-5/{len(content)}')
+        self.assertEqual(b''.join(suffix.streaming_content), content[-3:])
+        self.assertEqual(unsatisfiable.status_code, 416)
+        self.assertEqual(unsatisfiable['Content-Range'], f'bytes */{len(content)}')
+        self.assertEqual(invalid.status_code, 200)
+        self.assertEqual(b''.join(invalid.streaming_content), content)
+
+    @override_settings(FORUM_MEDIA_ACCEL_HEADER='X-Accel-Redirect')
+    def test_media_file_accel_redirect(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            thread = Thread(subcategory_id=1, message='Image', file=SimpleUploadedFile('cat.png', b'cat'))
+            thread.save()
+            os.makedirs(os.path.dirname(os.path.join(media_root, thumbnail_name(thread.file.name, 256))))
+            shutil.copy(thread.file.path, os.path.join(media_root, thumbnail_name(thread.file.name, 256)))
+
+            response = self.client.get(f'/media/{thread.file.name}')
+            thumbnail_response = self.client.get(f'/media/{thumbnail_name(thread.file.name, 256)}')
+
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{thread.file.name}')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(thumbnail_response['X-Accel-Redirect'],
+                         f'/protected-media/{thumbnail_name(thread.file.name, 256)}')
+
     def test_login_successful(self):
         response = self.client.login(username='test_user', password='password')
 
@@ -0,0 +1,35 @@
+import os
+
+from PIL import Image, ImageOps
+
+THUMBNAILS_DIR = 'thread_thumbnails'
+
+
+def thumbnail_name(file_name, size):
+    """Return the storage name of the file's thumbnail with the given size
+       e.g. thread_files/apple.png and size 256 returns thread_thumbnails/256/thread_files/apple.png
+    """
+    return f'{THUMBNAILS_DIR}/{size}/{file_name}'
+
+
+def thumbnails_exist(media_root, file_name, sizes):
+    return all(os.path.exists(os.path.join(media_root, thumbnail_name(file_name, size))) for size in sizes)
+
+
+def generate_thumbnails(media_root, file_name, sizes):
+    """Create the thumbnails of an image stored under media_root, one per size (the longer side in pixels).
+       Only plain paths are used, so the function can run in worker processes.
+       Every thumbnail is written to a temporary file first, so a partial file is never served
+    """
+    with Image.open(os.path.join(media_root, file_name)) as image:
+        image_format = image.format
+        image = ImageOps.exif_transpose(image)
+        for size in sizes:
+            target = os.path.join(media_root, thumbnail_name(file_name, size))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            thumbnail.save(target + '.tmp', format=image_format)
+            os.replace(target + '.tmp', target)
+    return file_name
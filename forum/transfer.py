@@ -0,0 +1,49 @@
+import gzip
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+FORMAT = 'django-forum'
+VERSION = 1
+
+CATEGORY_FIELDS = ('name', 'auth_required')
+SUBCATEGORY_FIELDS = ('category', 'name', 'slug')
+# the reply counters are not transferred, they are recomputed by the importer
+THREAD_FIELDS = ('subcategory', 'subject', 'author_name', 'author_email', 'message', 'file', 'reply_to',
+                 'root_thread', 'created_date', 'updated_date', 'file_mime_type', 'file_is_image', 'file_width',
+                 'file_height', 'file_size', 'file_original_name')
+
+
+def encode_datetime(value):
+    """JSON encoder default keeping the dates' full precision, the updated dates are compared to the microsecond"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+@contextmanager
+def open_stream(path, mode):
+    """Open the JSON Lines file for 'r' or 'w' as text, gzip compressed if its name ends with .gz,
+       '-' is stdin or stdout
+    """
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    elif path.endswith('.gz'):
+        with gzip.open(path, mode + 't', encoding='utf-8') as stream:
+            yield stream
+    else:
+        with open(path, mode, encoding='utf-8') as stream:
+            yield stream
+
+
+@contextmanager
+def imported_dates(model):
+    """Turns off auto_now_add of the model's date fields meanwhile, so bulk_create keeps the imported dates"""
+    fields = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """Rejects the uploads of files larger than FORUM_MAX_UPLOAD_SIZE bytes with a 400 response.
+       A request announcing a larger body than the files and the other fields may take is rejected
+       before its body is read, others once a file's chunks add up to more than the limit,
+       so the next handlers never buffer or store more than the limit
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.max_size = settings.FORUM_MAX_UPLOAD_SIZE
+        # the fields other than files are limited by DATA_UPLOAD_MAX_MEMORY_SIZE
+        fields_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if fields_size is not None and content_length > self.max_size + fields_size:
+            raise RequestDataTooBig(f'Request body of {content_length} bytes exceeds the upload size limit')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            raise RequestDataTooBig(f'File {self.file_name} exceeds the upload size limit of {self.max_size} bytes')
+        return raw_data
+
+    def file_complete(self, file_size):
+        # the file is stored by the next handler
+        return None
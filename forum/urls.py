@@ -1,16 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
-from forum import views
+from forum import async_views, views
 from forum.views import LoginUser
 
-urlpatterns = [
-    path('home', views.dashboard, name='home'),
-    path('login', LoginUser.as_view(), name='login'),
-    path('logout', views.logout_user, name='logout'),
-    path('<str:name>', views.subcategory, name='subcategory'),
-    path('<str:subcategory_name>/createthread', views.thread_create, name='thread_create'),
-    path('thread/<int:id>', views.thread_view, name='thread_view'),
-    path('thread/<int:root_id>/reply', views.thread_reply, name='thread_reply'),
-    path('thread/<int:thread_id>/getupdated', views.thread_get_updated_date, name='thread_get_update'),
-    path('thread/<int:thread_id>/editmessage', views.thread_edit_message, name='thread_edit_message'),
-]
+
+def forum_patterns(read_views):
+    """Return the forum's URLs with the dashboard, subcategory, thread and update check views of read_views"""
+    return [
+        path('home', read_views.dashboard, name='home'),
+        path('login', LoginUser.as_view(), name='login'),
+        path('logout', views.logout_user, name='logout'),
+        path('search', views.search, name='search'),
+        path('stats/fragments', views.fragment_cache_stats, name='fragment_cache_stats'),
+        path('stats/metrics', views.request_metrics, name='request_metrics'),
+        path('<str:name>', read_views.subcategory, name='subcategory'),
+        path('<str:subcategory_name>/createthread', views.thread_create, name='thread_create'),
+        path('thread/<int:id>', read_views.thread_view, name='thread_view'),
+        path('thread/<int:root_id>/reply', views.thread_reply, name='thread_reply'),
+        path('thread/<int:thread_id>/getupdated', read_views.thread_get_updated_date, name='thread_get_update'),
+        path('threads/getupdated', views.threads_get_updated_dates, name='threads_get_updates'),
+        path('thread/<int:thread_id>/events', views.thread_events, name='thread_events'),
+        path('thread/<int:thread_id>/archive', views.thread_archive, name='thread_archive'),
+        path('thread/<int:thread_id>/editmessage', views.thread_edit_message, name='thread_edit_message'),
+    ]
+
+
+# the async read views are meant to be served through ASGI
+urlpatterns = forum_patterns(async_views if settings.FORUM_ASYNC_READ_VIEWS else views)
@@ -2,17 +2,31 @@ import json
 from math import trunc
 from urllib.parse import unquote
 
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib.auth import views as auth_views
-from django.http import HttpResponse, Http404
-from django.http import HttpResponseBadRequest
-from django.shortcuts import redirect, get_object_or_404, render
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.http import HttpResponseBadRequest, HttpResponseForbidden
+from django.shortcuts import redirect, render
 from django.template import loader
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
+from . import fragment_cache
+from .archive import async_chunks, jsonl_chunks, zip_chunks
+from .metrics import PROMETHEUS_CONTENT_TYPE, registry as metrics_registry
+from .events import publish_thread_update, thread_event_stream
 from .forms import ThreadForm
+from .media import attachment_name, media_name, media_response, requires_auth
 from .models import Category, Thread, Subcategory
+from .page_cache import (DASHBOARD_SCOPE, bump_page_generations, cache_anonymous_page, subcategory_scope,
+                         thread_scope)
+from .pagination import MAX_ID, MIN_ID, decode_cursor
 
 
+@cache_anonymous_page(lambda: [DASHBOARD_SCOPE])
 def dashboard(request):
     thread_fields = ['id', 'subject', 'subcategory__name']
     latest_threads = Thread.objects.get_latest(thread_fields)
@@ -26,6 +40,7 @@ def dashboard(request):
     return HttpResponse(template.render(context, request))
 
 
+@cache_anonymous_page(lambda name: [subcategory_scope(unquote(name).lower())])
 def subcategory(request, name):
     name_unquote = unquote(name)
     subcat = Subcategory.get_by_name(name_unquote)
@@ -33,12 +48,17 @@ def subcategory(request, name):
     if not subcat:
         raise Http404("No Subcategory found with name " + name)
 
-    if subcat.category.auth_required and not request.user.is_authenticated:
+    if subcat.auth_required and not request.user.is_authenticated:
         page = 'login'
         next_page = request.path
         return redirect(f'{page}?next={next_page}')
 
-    threads = Thread.objects.get_subcategory_latest(subcat.id)
+    by_activity = request.GET.get('sort') == 'activity'
+    page = Thread.objects.get_subcategory_latest(subcat.id,
+                                                 before=decode_cursor(request.GET.get('before')),
+                                                 after=decode_cursor(request.GET.get('after')),
+                                                 by_activity=by_activity)
+    Thread.objects.preload_recent_replies(page.items)
 
     form = ThreadForm()
     if request.user.is_authenticated:
@@ -47,7 +67,9 @@ def subcategory(request, name):
 
     context = {
         'subcategory': subcat,
-        'threads': threads,
+        'threads': page.items,
+        'page': page,
+        'by_activity': by_activity,
         'form': form
     }
     template = loader.get_template('subcategory.html')
@@ -59,25 +81,36 @@ def thread_create(request, subcategory_name):
 
     form = ThreadForm(request.POST, request.FILES)
     if form.is_valid():
-        thread_instance = form.instance
+        thread_instance = form.save(commit=False)
         if request.user.is_authenticated:
             thread_instance.author_name = request.user.username
             thread_instance.author_email = request.user.email
         thread_instance.save()
+        bump_page_generations(DASHBOARD_SCOPE, subcategory_scope(thread_instance.subcategory.slug))
         return redirect('subcategory', name=subcategory_name)
     else:
-        threads = Thread.objects.get_subcategory_latest(subcat.id)
+        page = Thread.objects.get_subcategory_latest(subcat.id)
+        Thread.objects.preload_recent_replies(page.items)
         context = {
             'subcategory': subcat,
-            'threads': threads,
+            'threads': page.items,
+            'page': page,
             'form': form
         }
 
         return render(request, 'subcategory.html', context)
 
 
+def get_thread_tree_or_404(thread_id):
+    try:
+        return Thread.objects.get_thread_tree(thread_id)
+    except Thread.DoesNotExist:
+        raise Http404("No Thread found with id " + str(thread_id))
+
+
+@cache_anonymous_page(lambda id: [thread_scope(id)])
 def thread_view(request, id):
-    thread = get_object_or_404(Thread, id=id)
+    thread = get_thread_tree_or_404(id)
 
     form = ThreadForm()
     form.fields['subject'].initial = thread.subject
@@ -97,17 +130,19 @@ def thread_view(request, id):
 def thread_reply(request, root_id):
     form = ThreadForm(request.POST, request.FILES)
     if form.is_valid():
-        thread_instance = form.instance
+        thread_instance = form.save(commit=False)
         thread_instance.root_thread_id = root_id
         if request.user.is_authenticated:
             thread_instance.author_name = request.user.username
             thread_instance.author_email = request.user.email
 
-        thread_instance.save()
-        Thread.objects.update_date(root_id)
+        updated_date = Thread.objects.add_reply(thread_instance)
+        publish_thread_update(root_id, updated_date)
+        bump_page_generations(DASHBOARD_SCOPE, subcategory_scope(thread_instance.subcategory.slug),
+                              thread_scope(root_id))
         return redirect('thread_view', id=root_id)
     else:
-        thread = get_object_or_404(Thread, id=root_id)
+        thread = get_thread_tree_or_404(root_id)
         context = {
             'thread': thread,
             'form': form
@@ -116,6 +151,28 @@ def thread_reply(request, root_id):
         return render(request, 'thread.html', context)
 
 
+def search(request):
+    text = request.GET.get('q', '').strip()
+    subcategory_name = request.GET.get('subcategory')
+    subcat = Subcategory.get_by_name(subcategory_name) if subcategory_name else None
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), settings.FORUM_SEARCH_MAX_PAGE)
+    except ValueError:
+        page = 1
+
+    threads, has_next = Thread.objects.search(text, subcategory_id=subcat.id if subcat else None,
+                                              include_private=request.user.is_authenticated, page=page)
+
+    context = {
+        'query': text,
+        'subcategory': subcat,
+        'threads': threads,
+        'page': page,
+        'has_next': has_next and page < settings.FORUM_SEARCH_MAX_PAGE
+    }
+    return render(request, 'search.html', context)
+
+
 class LoginUser(auth_views.LoginView):
     template_name = 'login.html'
 
@@ -126,9 +183,110 @@ def logout_user(request):
 
 
 def thread_get_updated_date(request, thread_id):
-    thread = Thread.objects.get_by_id(thread_id)
-    response = trunc(thread.updated_date.timestamp())
-    return HttpResponse(response)
+    updated_date = Thread.objects.get_updated_date(thread_id)
+    if updated_date is None:
+        raise Http404("No Thread found with id " + str(thread_id))
+
+    timestamp = trunc(updated_date.timestamp())
+    etag = f'"{updated_date.timestamp():.6f}"'
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = HttpResponse(timestamp)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    # the browser revalidates every poll, which is answered by 304 while the thread is unchanged
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def threads_get_updated_dates(request):
+    """Return the threads changed since the client has seen them, with their new update timestamps.
+       The threads are given as ?threads=<id>:<seen timestamp>,<id>:<seen timestamp>...
+    """
+    try:
+        seen_timestamps = dict(map(int, item.split(':'))
+                               for item in request.GET.get('threads', '').split(',') if item)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not all(MIN_ID <= thread_id <= MAX_ID for thread_id in seen_timestamps):
+        return HttpResponseBadRequest()
+
+    if len(seen_timestamps) > settings.FORUM_UPDATES_MAX_THREADS:
+        return HttpResponseBadRequest(f'At most {settings.FORUM_UPDATES_MAX_THREADS} threads can be checked at once')
+
+    updated_dates = Thread.objects.get_updated_dates(list(seen_timestamps))
+    changed = {}
+    for thread_id, updated_date in updated_dates.items():
+        timestamp = trunc(updated_date.timestamp())
+        if timestamp > seen_timestamps[thread_id]:
+            changed[thread_id] = timestamp
+
+    response = JsonResponse(changed, json_dumps_params={'separators': (',', ':')})
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def thread_events(request, thread_id):
+    if not isinstance(request, ASGIRequest):
+        # a WSGI worker can not be held by an idle connection, 204 makes the page fall back to polling
+        return HttpResponse(status=204)
+
+    if not await Thread.objects.filter(id=thread_id).aexists():
+        raise Http404("No Thread found with id " + str(thread_id))
+
+    response = StreamingHttpResponse(thread_event_stream(thread_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+ARCHIVE_FORMATS = {
+    'zip': (zip_chunks, 'application/zip'),
+    'jsonl': (jsonl_chunks, 'application/x-ndjson'),
+}
+
+
+def thread_archive(request, thread_id):
+    thread = Thread.objects.filter(id=thread_id).values('root_thread_id',
+                                                        'subcategory__category__auth_required').first()
+    if thread is None:
+        raise Http404("No Thread found with id " + str(thread_id))
+
+    if thread['subcategory__category__auth_required'] and not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), 'login')
+
+    archive_format = request.GET.get('format', 'zip')
+    if archive_format not in ARCHIVE_FORMATS:
+        return HttpResponseBadRequest()
+
+    # a reply's archive is the whole thread's one
+    root_id = thread['root_thread_id'] or thread_id
+    archive_chunks, content_type = ARCHIVE_FORMATS[archive_format]
+    chunks = archive_chunks(root_id)
+    if isinstance(request, ASGIRequest):
+        chunks = async_chunks(chunks)
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="thread-{root_id}.{archive_format}"'
+    return response
+
+
+def media_file(request, path):
+    """Serves the thread files and their thumbnails to the users allowed to see a thread referencing them"""
+    name = media_name(path)
+    file_name = attachment_name(name) if name else None
+    subcategory_ids = Thread.objects.get_file_subcategories(file_name) if file_name else ()
+    if not subcategory_ids:
+        raise Http404("No thread file " + path)
+
+    private = requires_auth(subcategory_ids)
+    if private and not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), 'login')
+
+    response = media_response(request, name, private)
+    if response is None:
+        raise Http404("No thread file " + path)
+    return response
 
 
 def thread_edit_message(request, thread_id):
@@ -140,14 +298,32 @@ def thread_edit_message(request, thread_id):
         reply_id = data.get('replyId')
         update_thread_id = reply_id if reply_id else thread_id
 
-        Thread.objects.update_message(update_thread_id, new_message)
+        updated_date = Thread.objects.update_message(update_thread_id, new_message)
         if reply_id:
-            Thread.objects.update_date(thread_id)
+            # the root thread's bump is written behind, batched with the others
+            updated_date = Thread.objects.update_date(thread_id)
+        publish_thread_update(thread_id, updated_date)
+        subcategory_slug = Thread.objects.filter(id=thread_id).values_list('subcategory__slug', flat=True).first()
+        bump_page_generations(DASHBOARD_SCOPE, subcategory_scope(subcategory_slug), thread_scope(thread_id))
 
         return HttpResponse(status=204)
 
     return HttpResponseBadRequest()
 
 
+def fragment_cache_stats(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(fragment_cache.stats.as_dict())
+
+
+def request_metrics(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 def set_categories(request):
-    return {'categories': Category.get_all()}
+    # loaded already by the async views, see async_views.aset_categories
+    categories = getattr(request, 'forum_categories', None)
+    return {'categories': categories if categories is not None else Category.get_all()}
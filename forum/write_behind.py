@@ -0,0 +1,86 @@
+import atexit
+import heapq
+import logging
+import threading
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatedDateBuffer:
+    """Process-wide buffer of thread updated_date bumps, keeping the latest date per thread.
+       A daemon thread writes them with write(updated_dates) every FORUM_UPDATED_DATE_FLUSH_INTERVAL seconds,
+       and the rest are written at exit. The dates stay readable from the buffer until they are written
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._lock = threading.Lock()
+        # thread id -> the latest updated_date not written yet
+        self._pending = {}
+        self._flusher = None
+        self._stopping = threading.Event()
+        self._registered_at_exit = False
+
+    def add(self, thread_id, updated_date):
+        with self._lock:
+            current = self._pending.get(thread_id)
+            if current is None or updated_date > current:
+                self._pending[thread_id] = updated_date
+            if self._flusher is None:
+                self._start_flusher()
+
+    def get_many(self, thread_ids):
+        """Return {thread_id: updated_date} of the given threads having a pending bump"""
+        with self._lock:
+            return {thread_id: self._pending[thread_id] for thread_id in thread_ids if thread_id in self._pending}
+
+    def latest(self, count):
+        """Return {thread_id: updated_date} of the count most recent pending bumps"""
+        with self._lock:
+            return dict(heapq.nlargest(count, self._pending.items(), key=itemgetter(1)))
+
+    def flush(self):
+        """Writes the pending bumps, return how many were written. A bump made during the write
+           stays pending, and all of them do if the write fails
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return 0
+
+        self._write(pending)
+        with self._lock:
+            for thread_id, updated_date in pending.items():
+                if self._pending.get(thread_id) == updated_date:
+                    del self._pending[thread_id]
+        return len(pending)
+
+    def stop(self):
+        """Stops the flusher thread and writes the pending bumps, called at exit"""
+        with self._lock:
+            flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self._stopping.set()
+            flusher.join()
+            self._stopping.clear()
+        self.flush()
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._run, name='updated-date-flusher', daemon=True)
+        self._flusher.start()
+        if not self._registered_at_exit:
+            atexit.register(self.stop)
+            self._registered_at_exit = True
+
+    def _run(self):
+        while not self._stopping.wait(settings.FORUM_UPDATED_DATE_FLUSH_INTERVAL):
+            try:
+                if self.flush():
+                    connection.close()
+            except Exception:
+                logger.exception('The pending updated dates could not be written, retrying at the next flush')
+                connection.close()
@@ -14,6 +14,8 @@ python manage.py migrate
 
 # insert into DB
 python manage.py loaddata init_user.json init_cat_subcat.json init_thread.json
+python manage.py backfill_file_metadata
+python manage.py repair_reply_counters
 
 # run the server
 python manage.py runserver
\ No newline at end of file